@@ -0,0 +1,242 @@
+# armazenamento_imagens.py
+
+import io
+import os
+import re
+import uuid
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+import cloudinary
+import cloudinary.uploader
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # sem Pillow, o armazenamento local guarda só o original
+    Image = None
+
+# Onde ficam as fotos das variações. IMAGENS_ARMAZENAMENTO=cloudinary (padrão) envia para o
+# Cloudinary; =local grava em static/images (ou IMAGENS_DIR) e serve-as em IMAGENS_URL_BASE, sem
+# rede nem credenciais, para desenvolvimento, testes e benchmarks.
+# Os envios de várias fotos correm em paralelo num executor limitado (IMAGENS_UPLOAD_WORKERS).
+#
+# Tamanhos responsivos: cada foto tem versões miniatura, cartão e detalhe em WebP e JPEG.
+# No Cloudinary são transformações no URL; no armazenamento local são geradas no envio
+# (Pillow). Os ficheiros locais têm o hash do conteúdo no nome e são servidos com cache
+# imutável.
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND = os.getenv("IMAGENS_ARMAZENAMENTO", "cloudinary").lower()
+DIRETORIO_LOCAL = os.getenv("IMAGENS_DIR", os.path.join(BASE_DIR, "static", "images"))
+URL_LOCAL = os.getenv("IMAGENS_URL_BASE", "/static/images")
+UPLOAD_WORKERS = int(os.getenv("IMAGENS_UPLOAD_WORKERS", "4"))
+
+# Largura máxima de cada tamanho (as imagens mais pequenas não são ampliadas)
+TAMANHOS = {"miniatura": 160, "cartao": 480, "detalhe": 1200}
+FORMATOS = {"webp": "WEBP", "jpg": "JPEG"}
+QUALIDADE = int(os.getenv("IMAGENS_QUALIDADE", "80"))
+# Nome de um ficheiro local com hash: <hash>.<ext> (original) ou <hash>-<tamanho>.<ext>
+PADRAO_NOME_HASH = re.compile(r"^[0-9a-f]{20}(-[a-z]+)?\.[a-z0-9]+$")
+# Extensões dos originais locais (servidos da mesma origem da API: nunca .html, .svg...)
+EXTENSOES_PERMITIDAS = (".jpg", ".jpeg", ".png", ".webp")
+EXTENSOES_FORMATO = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp"}
+
+cloudinary.config(
+    cloud_name = os.getenv("CLOUDINARY_CLOUD_NAME"),
+    api_key = os.getenv("CLOUDINARY_API_KEY"),
+    api_secret = os.getenv("CLOUDINARY_API_SECRET"),
+    secure = True
+)
+
+class ArmazenamentoCloudinary:
+    def __init__(self, pasta: str = "catalogo_api"):
+        self.pasta = pasta
+
+    def enviar(self, ficheiro: BinaryIO, nome: str) -> str:
+        upload_result = cloudinary.uploader.upload(ficheiro, folder=self.pasta)
+        return upload_result.get("secure_url")
+
+    def apagar(self, url: Optional[str]):
+        if not url or "cloudinary" not in url:
+            return
+        public_id_with_folder = "/".join(url.split("/")[-2:])
+        public_id = os.path.splitext(public_id_with_folder)[0]
+        cloudinary.uploader.destroy(public_id)
+
+def _derivadas_cloudinary(url: str) -> Dict[str, str]:
+    """Os tamanhos são transformações no próprio URL (geradas e guardadas em cache pela CDN)."""
+    prefixo, resto = url.split("/upload/", 1)
+    derivadas = {}
+    for tamanho, largura in TAMANHOS.items():
+        derivadas[tamanho] = f"{prefixo}/upload/c_limit,w_{largura},q_auto,f_jpg/{resto}"
+        derivadas[f"{tamanho}_webp"] = f"{prefixo}/upload/c_limit,w_{largura},q_auto,f_webp/{resto}"
+    return derivadas
+
+def gerar_derivadas(conteudo: bytes) -> Dict[str, bytes]:
+    """{"<tamanho>.<formato>": bytes} para todos os tamanhos; vazio se a imagem não puder ser lida."""
+    if Image is None:
+        return {}
+    try:
+        original = ImageOps.exif_transpose(Image.open(io.BytesIO(conteudo)))
+    except Exception:
+        return {}
+    if original.mode not in ("RGB", "RGBA"):
+        original = original.convert("RGBA" if "transparency" in original.info or original.mode in ("LA", "P") else "RGB")
+    derivadas = {}
+    for tamanho, largura in TAMANHOS.items():
+        imagem = original.copy()
+        imagem.thumbnail((largura, largura * 4), Image.LANCZOS)
+        for extensao, formato in FORMATOS.items():
+            saida = imagem
+            if formato == "JPEG" and imagem.mode == "RGBA":
+                # JPEG não tem transparência: fundo branco
+                saida = Image.new("RGB", imagem.size, (255, 255, 255))
+                saida.paste(imagem, mask=imagem.getchannel("A"))
+            buffer = io.BytesIO()
+            saida.save(buffer, formato, quality=QUALIDADE, optimize=True)
+            derivadas[f"{tamanho}.{extensao}"] = buffer.getvalue()
+    return derivadas
+
+def extensao_segura(conteudo: bytes, nome: Optional[str]) -> str:
+    """
+    Extensão do formato detetado pelo Pillow; sem Pillow (ou num formato fora da lista), a do
+    nome do ficheiro se for uma das EXTENSOES_PERMITIDAS. Caso contrário, .jpg.
+    """
+    if Image is not None:
+        try:
+            formato = Image.open(io.BytesIO(conteudo)).format
+        except Exception:
+            formato = None
+        if formato in EXTENSOES_FORMATO:
+            return EXTENSOES_FORMATO[formato]
+    extensao = os.path.splitext(nome or "")[1].lower()
+    return extensao if extensao in EXTENSOES_PERMITIDAS else ".jpg"
+
+class ArmazenamentoLocal:
+    def __init__(self, diretorio: str, url_base: str):
+        self.diretorio = diretorio
+        self.url_base = url_base.rstrip("/")
+
+    def _gravar(self, nome: str, conteudo: bytes):
+        caminho = os.path.join(self.diretorio, nome)
+        if os.path.exists(caminho):
+            return  # mesmo hash, mesmo conteúdo
+        # Nome único: dois envios em paralelo com o mesmo conteúdo gravam o mesmo `caminho`
+        temporario = f"{caminho}.{uuid.uuid4().hex}.tmp"
+        with open(temporario, "wb") as destino:
+            destino.write(conteudo)
+        os.replace(temporario, caminho)
+
+    def enviar(self, ficheiro: BinaryIO, nome: str) -> str:
+        os.makedirs(self.diretorio, exist_ok=True)
+        conteudo = ficheiro.read()
+        extensao = extensao_segura(conteudo, nome)
+        base = hashlib.sha256(conteudo).hexdigest()[:20]
+        # As derivadas são gravadas antes do original: um original com hash implica derivadas completas
+        for sufixo, dados in gerar_derivadas(conteudo).items():
+            self._gravar(f"{base}-{sufixo}", dados)
+        self._gravar(f"{base}{extensao}", conteudo)
+        return f"{self.url_base}/{base}{extensao}"
+
+    def apagar(self, url: Optional[str]):
+        if not url or not url.startswith(self.url_base + "/"):
+            return
+        nome = os.path.basename(url)
+        nomes = [nome]
+        if PADRAO_NOME_HASH.match(nome):
+            base = os.path.splitext(nome)[0]
+            nomes += [f"{base}-{tamanho}.{extensao}" for tamanho in TAMANHOS for extensao in FORMATOS]
+        for nome in nomes:
+            caminho = os.path.join(self.diretorio, nome)
+            if os.path.exists(caminho):
+                os.remove(caminho)
+        _tem_derivadas_locais.cache_clear()
+
+def criar_armazenamento():
+    if BACKEND == "local":
+        return ArmazenamentoLocal(DIRETORIO_LOCAL, URL_LOCAL)
+    return ArmazenamentoCloudinary()
+
+armazenamento = criar_armazenamento()
+
+@lru_cache(maxsize=8192)
+def _tem_derivadas_locais(base: str) -> bool:
+    return os.path.exists(os.path.join(DIRETORIO_LOCAL, f"{base}-detalhe.webp"))
+
+def imagens_responsivas(url: Optional[str]) -> Optional[Dict[str, str]]:
+    """
+    URLs dos tamanhos miniatura/cartao/detalhe (JPEG) e *_webp de uma foto, ou None se a foto
+    não tiver derivadas (ex.: ficheiros locais anteriores a esta funcionalidade).
+    """
+    if not url:
+        return None
+    if "res.cloudinary.com" in url and "/upload/" in url:
+        return _derivadas_cloudinary(url)
+    base_local = URL_LOCAL.rstrip("/") + "/"
+    nome = url[len(base_local):] if url.startswith(base_local) else ""
+    if not PADRAO_NOME_HASH.match(nome):
+        return None
+    base = os.path.splitext(nome)[0]
+    if not _tem_derivadas_locais(base):
+        return None
+    derivadas = {}
+    for tamanho in TAMANHOS:
+        derivadas[tamanho] = f"{base_local}{base}-{tamanho}.jpg"
+        derivadas[f"{tamanho}_webp"] = f"{base_local}{base}-{tamanho}.webp"
+    return derivadas
+
+def imagem_em_uso(db: Session, url: Optional[str]) -> bool:
+    """Com nomes por hash, duas variações com a mesma foto partilham o ficheiro local."""
+    return bool(url) and db.execute(text("SELECT 1 FROM estoque_variacoes WHERE url_foto = :url LIMIT 1"), {"url": url}).first() is not None
+
+# --- Envios em paralelo ---
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+def _obter_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix="upload-imagens")
+        return _executor
+
+def enviar_varias(ficheiros: List[Tuple[BinaryIO, str]], db: Optional[Session] = None) -> List[str]:
+    """
+    Envia várias imagens em paralelo e devolve os URLs pela mesma ordem. Se algum envio
+    falhar, apaga os que já tinham sido enviados e relança o erro.
+    """
+    futuros = [_obter_executor().submit(armazenamento.enviar, ficheiro, nome) for ficheiro, nome in ficheiros]
+    urls, erro = [], None
+    for futuro in futuros:
+        try:
+            urls.append(futuro.result())
+        except Exception as e:
+            erro = erro or e
+    if erro is not None:
+        apagar_varias(urls, db)
+        raise erro
+    return urls
+
+def apagar_varias(urls: List[str], db: Optional[Session] = None):
+    """
+    Remoção de melhor esforço (limpeza depois de uma falha). Com `db`, mantém as fotos que
+    outra variação já usa (o mesmo conteúdo tem o mesmo nome).
+    """
+    for url in urls:
+        try:
+            if db is None or not imagem_em_uso(db, url):
+                armazenamento.apagar(url)
+        except Exception as e:
+            print(f"Aviso: não foi possível apagar a imagem {url}: {e}")
+
+def encerrar_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
@@ -0,0 +1,143 @@
+# ativos_estaticos.py
+
+import os
+import gzip
+import hashlib
+import mimetypes
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+from fastapi import Request, Response
+from fastapi.staticfiles import StaticFiles
+
+import cache_http
+
+try:
+    import brotli
+except ImportError:  # sem brotli, só gzip
+    brotli = None
+
+# As páginas HTML (index.html, pdv.html, ...) e os ficheiros de texto de /static são lidos
+# para memória uma vez, já comprimidos em gzip e brotli. Cada pedido só escolhe a
+# representação pelo Accept-Encoding e responde 304 se a ETag (forte, por codificação)
+# coincidir. ATIVOS_RECARREGAR=true relê as páginas quando mudam no disco (desenvolvimento);
+# os ficheiros de /static são sempre validados pelo stat que o StaticFiles já faz.
+
+RECARREGAR = os.getenv("ATIVOS_RECARREGAR", "false").lower() == "true"
+TAMANHO_MAXIMO = int(os.getenv("ATIVOS_TAMANHO_MAXIMO_KB", "1024")) * 1024
+TAMANHO_MINIMO_COMPRESSAO = 256
+TIPOS_COMPRIMIVEIS = ("text/", "application/javascript", "application/json", "application/xml", "image/svg+xml")
+# Preferência do servidor quando o cliente aceita várias com o mesmo q
+PREFERENCIA = ("br", "gzip")
+
+class Ativo:
+    __slots__ = ("media_type", "mtime", "tamanho", "representacoes")
+
+    def __init__(self, conteudo: bytes, media_type: str, mtime: float):
+        self.media_type = media_type
+        self.mtime = mtime
+        self.tamanho = len(conteudo)
+        base = hashlib.sha1(conteudo).hexdigest()
+        # codificação -> (bytes, ETag); None é a representação original
+        self.representacoes: Dict[Optional[str], Tuple[bytes, str]] = {None: (conteudo, f'"{base}"')}
+        if len(conteudo) < TAMANHO_MINIMO_COMPRESSAO or not media_type.startswith(TIPOS_COMPRIMIVEIS):
+            return
+        comprimidos = {"gzip": gzip.compress(conteudo, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            comprimidos["br"] = brotli.compress(conteudo, quality=11)
+        for codificacao, dados in comprimidos.items():
+            if len(dados) < len(conteudo):
+                self.representacoes[codificacao] = (dados, f'"{base}-{codificacao}"')
+
+def comprimivel(caminho: str) -> bool:
+    media_type = mimetypes.guess_type(caminho)[0] or ""
+    return media_type.startswith(TIPOS_COMPRIMIVEIS)
+
+def escolher_codificacao(accept_encoding: Optional[str], disponiveis: Iterable[str]) -> Optional[str]:
+    """Codificação com maior q aceite pelo cliente (RFC 9110 §12.5.3); None para a original."""
+    if not accept_encoding:
+        return None
+    aceites: Dict[str, float] = {}
+    for parte in accept_encoding.lower().split(","):
+        nome, _, parametros = parte.strip().partition(";")
+        q = 1.0
+        parametros = parametros.strip()
+        if parametros.startswith("q="):
+            try:
+                q = float(parametros[2:])
+            except ValueError:
+                q = 0.0
+        if nome:
+            aceites[nome.strip()] = q
+    melhor, melhor_q = None, 0.0
+    for codificacao in PREFERENCIA:
+        if codificacao not in disponiveis:
+            continue
+        q = aceites.get(codificacao, aceites.get("*", 0.0))
+        if q > melhor_q:
+            melhor, melhor_q = codificacao, q
+    return melhor
+
+class ArmazemAtivos:
+    def __init__(self):
+        self._ativos: Dict[str, Ativo] = {}
+        self._lock = threading.Lock()
+
+    def _carregar(self, caminho: str, stat_result: os.stat_result) -> Ativo:
+        with open(caminho, "rb") as ficheiro:
+            conteudo = ficheiro.read()
+        media_type = mimetypes.guess_type(caminho)[0] or "application/octet-stream"
+        ativo = Ativo(conteudo, media_type, stat_result.st_mtime)
+        with self._lock:
+            self._ativos[caminho] = ativo
+        return ativo
+
+    def obter(self, caminho: str, stat_result: Optional[os.stat_result] = None) -> Ativo:
+        ativo = self._ativos.get(caminho)
+        if ativo is not None and stat_result is None and not RECARREGAR:
+            return ativo
+        if stat_result is None:
+            stat_result = os.stat(caminho)
+        if ativo is None or ativo.mtime != stat_result.st_mtime or ativo.tamanho != stat_result.st_size:
+            ativo = self._carregar(caminho, stat_result)
+        return ativo
+
+    def precarregar(self, caminhos: Iterable[str]):
+        for caminho in caminhos:
+            try:
+                self.obter(caminho, os.stat(caminho))
+            except OSError as e:
+                print(f"Aviso: não foi possível carregar {caminho}: {e}")
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            ativos = list(self._ativos.values())
+        return {
+            "ficheiros": len(ativos),
+            "bytes_originais": sum(a.tamanho for a in ativos),
+            "bytes_em_memoria": sum(len(dados) for a in ativos for dados, _ in a.representacoes.values()),
+            "brotli": brotli is not None,
+        }
+
+# Instância única partilhada pela aplicação
+ativos = ArmazemAtivos()
+
+def responder(request: Request, ativo: Ativo, cache_control: str = "no-cache") -> Response:
+    codificacao = escolher_codificacao(request.headers.get("accept-encoding"), ativo.representacoes)
+    conteudo, etag = ativo.representacoes[codificacao]
+    cabecalhos = {"ETag": etag, "Cache-Control": cache_control}
+    if len(ativo.representacoes) > 1:
+        cabecalhos["Vary"] = "Accept-Encoding"
+    if cache_http.etag_corresponde(request, etag):
+        return Response(status_code=304, headers=cabecalhos)
+    if codificacao:
+        cabecalhos["Content-Encoding"] = codificacao
+    return Response(content=conteudo, media_type=ativo.media_type, headers=cabecalhos)
+
+class StaticFilesComprimidos(StaticFiles):
+    """StaticFiles que serve os ficheiros de texto a partir de `ativos` (comprimidos e com ETag forte)."""
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200) -> Response:
+        if status_code != 200 or stat_result.st_size > TAMANHO_MAXIMO or not comprimivel(str(full_path)):
+            return super().file_response(full_path, stat_result, scope, status_code)
+        return responder(Request(scope), ativos.obter(str(full_path), stat_result))
@@ -0,0 +1,122 @@
+# autocompletar.py
+
+import bisect
+import heapq
+import threading
+from typing import Dict, List, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from indice_catalogo import normalizar
+
+QUERY_MODELOS = """
+    SELECT m.id, m.id_marca, CONCAT(b.nome, ' ', m.nome_modelo) AS full_name
+    FROM modelos_celular AS m
+    JOIN marcas AS b ON m.id_marca = b.id
+"""
+
+MAX_SUGESTOES = 10
+
+class IndiceAutocompletar:
+    """
+    Array ordenado de prefixos para o autocompletar de modelos.
+
+    Para cada "marca modelo" guardamos uma entrada por palavra, com o texto normalizado
+    a partir dessa palavra ("samsung galaxy s23", "galaxy s23", "s23"). Uma sugestão é
+    uma pesquisa binária pelo termo seguida da leitura das entradas com esse prefixo,
+    por isso "galaxy s2" e "sams" encontram "Samsung Galaxy S23" sem tocar na base de dados.
+
+    As escritas reconstroem o array (o número de modelos é pequeno) e trocam a referência
+    de uma só vez, pelo que as leituras não precisam de lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._modelos: Dict[int, Tuple[int, str]] = {}
+        self._entradas: List[Tuple[str, str, str]] = []
+        self.pronto = False
+
+    def construir(self, db: Session):
+        resultado = db.execute(text(QUERY_MODELOS)).fetchall()
+        with self._lock:
+            self._modelos = {row.id: (row.id_marca, row.full_name) for row in resultado}
+            self._reindexar()
+            self.pronto = True
+
+    def _reindexar(self):
+        entradas = []
+        for _, nome in self._modelos.values():
+            nome_normalizado = normalizar(nome)
+            palavras = nome_normalizado.split()
+            for i in range(len(palavras)):
+                entradas.append((" ".join(palavras[i:]), nome_normalizado, nome))
+        entradas.sort()
+        self._entradas = entradas
+
+    def _recarregar(self, db: Session, coluna: str, campo: str, valor: int):
+        try:
+            resultado = db.execute(text(f"{QUERY_MODELOS} WHERE {coluna} = :valor"), {"valor": valor}).fetchall()
+        except Exception as e:
+            print(f"Aviso: não foi possível atualizar o autocompletar ({coluna}={valor}): {e}")
+            return
+        with self._lock:
+            modelos = {
+                modelo_id: (marca_id, nome) for modelo_id, (marca_id, nome) in self._modelos.items()
+                if (modelo_id if campo == "modelo" else marca_id) != valor
+            }
+            modelos.update({row.id: (row.id_marca, row.full_name) for row in resultado})
+            self._modelos = modelos
+            self._reindexar()
+
+    def recarregar_modelo(self, db: Session, modelo_id: int):
+        self._recarregar(db, "m.id", "modelo", modelo_id)
+
+    def recarregar_marca(self, db: Session, marca_id: int):
+        self._recarregar(db, "b.id", "marca", marca_id)
+
+    def remover_modelo(self, modelo_id: int):
+        with self._lock:
+            modelos = dict(self._modelos)
+            modelos.pop(modelo_id, None)
+            self._modelos = modelos
+            self._reindexar()
+
+    def sugerir(self, q: str, limite: int = MAX_SUGESTOES) -> List[str]:
+        termo = " ".join(normalizar(q).split())
+        if not termo:
+            return []
+        entradas = self._entradas
+        posicao = bisect.bisect_left(entradas, (termo,))
+        encontrados = set()
+        while posicao < len(entradas) and entradas[posicao][0].startswith(termo):
+            encontrados.add(entradas[posicao][1:])
+            posicao += 1
+        return [nome for _, nome in heapq.nsmallest(limite, encontrados)]
+
+def query_sugerir(q: str, db_type: str):
+    """
+    Autocompletar diretamente na base de dados, usado enquanto o índice não está pronto.
+    Como o índice, procura o termo no início do nome ou de uma das suas palavras.
+    """
+    like_operator = "ILIKE" if db_type == "postgresql" else "LIKE"
+    termo = " ".join(q.split())
+    # O termo é literal: % e _ não são curingas (escape '\', o padrão nos dois dialetos)
+    termo = termo.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    query_sql = f"""
+        {QUERY_MODELOS}
+        WHERE CONCAT(b.nome, ' ', m.nome_modelo) {like_operator} :inicio_nome
+           OR CONCAT(b.nome, ' ', m.nome_modelo) {like_operator} :inicio_palavra
+        ORDER BY full_name
+        LIMIT {MAX_SUGESTOES}
+    """
+    return text(query_sql), {"inicio_nome": f"{termo}%", "inicio_palavra": f"% {termo}%"}
+
+# Instância única partilhada pela aplicação e pelos routers
+indice = IndiceAutocompletar()
+
+def construir_indice(db: Session):
+    try:
+        indice.construir(db)
+    except Exception as e:
+        print(f"Aviso: não foi possível construir o índice de autocompletar, a busca usará a base de dados: {e}")
@@ -0,0 +1,49 @@
+# cache_http.py
+
+import os
+import re
+import hashlib
+
+from fastapi import Request, Response
+from fastapi.staticfiles import StaticFiles
+
+CACHE_IMUTAVEL = "public, max-age=31536000, immutable"
+
+def gerar_etag(conteudo: bytes) -> str:
+    """ETag forte derivada do conteúdo da resposta."""
+    return f'"{hashlib.sha1(conteudo).hexdigest()}"'
+
+def etag_corresponde(request: Request, etag: str) -> bool:
+    """Verifica se o cabeçalho If-None-Match do pedido inclui a ETag atual."""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    candidatas = [valor.strip() for valor in if_none_match.split(",")]
+    # Comparação fraca (RFC 9110): o prefixo W/ é ignorado para pedidos GET/HEAD.
+    return "*" in candidatas or any(c.removeprefix("W/") == etag for c in candidatas)
+
+def resposta_com_etag(request: Request, conteudo: bytes, media_type: str, cache_control: str = "no-cache", headers: dict = None) -> Response:
+    """
+    Devolve 304 sem corpo se o cliente já tiver esta versão; caso contrário, o conteúdo
+    completo com a ETag. Com `no-cache` o browser guarda a resposta mas revalida sempre.
+    """
+    etag = gerar_etag(conteudo)
+    cabecalhos = {"ETag": etag, "Cache-Control": cache_control, **(headers or {})}
+    if etag_corresponde(request, etag):
+        return Response(status_code=304, headers=cabecalhos)
+    return Response(content=conteudo, media_type=media_type, headers=cabecalhos)
+
+class StaticFilesImutaveis(StaticFiles):
+    """
+    StaticFiles que marca como imutáveis os ficheiros cujo nome segue `padrao_imutavel`
+    (nomes com o hash do conteúdo); os restantes mantêm a revalidação por ETag/Last-Modified.
+    """
+    def __init__(self, *args, padrao_imutavel: re.Pattern, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.padrao_imutavel = padrao_imutavel
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200) -> Response:
+        resposta = super().file_response(full_path, stat_result, scope, status_code)
+        if self.padrao_imutavel.match(os.path.basename(full_path)):
+            resposta.headers["Cache-Control"] = CACHE_IMUTAVEL
+        return resposta
@@ -0,0 +1,173 @@
+# cache_leitura.py
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterable, Optional, Set
+
+# --- Configuração (variáveis de ambiente) ---
+# TTL de 0 desliga a cache.
+CACHE_TTL_SEGUNDOS = float(os.getenv("CACHE_TTL_SEGUNDOS", "60"))
+CACHE_MAX_ENTRADAS = int(os.getenv("CACHE_MAX_ENTRADAS", "2000"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+class EntradaCache:
+    __slots__ = ("conteudo", "headers", "tags", "expira_em", "tamanho")
+
+    def __init__(self, conteudo: bytes, headers: Dict[str, str], tags: Set[str], expira_em: float):
+        self.conteudo = conteudo
+        self.headers = headers
+        self.tags = tags
+        self.expira_em = expira_em
+        self.tamanho = len(conteudo) + sum(len(k) + len(v) for k, v in headers.items())
+
+class CacheLeitura:
+    """
+    Cache read-through das respostas públicas (já serializadas em JSON).
+
+    - Cada entrada expira após o TTL e, quando a cache excede o número de entradas ou
+      de bytes configurado, as menos usadas recentemente são descartadas (LRU).
+    - Cada entrada tem etiquetas ("variacao:12", "produto:3", "busca"...) e as escritas
+      invalidam apenas as entradas com as etiquetas afetadas; uma venda remove só as
+      respostas que contêm aquela variação.
+    - Uma invalidação que aconteça enquanto uma resposta está a ser calculada impede
+      que essa resposta (possivelmente desatualizada) seja guardada.
+    """
+
+    def __init__(self, ttl: float, max_entradas: int, max_bytes: int):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entradas: "OrderedDict[Hashable, EntradaCache]" = OrderedDict()
+        self._por_tag: Dict[str, Set[Hashable]] = {}
+        self._bytes = 0
+        self._geracao = 0
+        self.hits = 0
+        self.misses = 0
+        self.expiradas = 0
+        self.descartadas = 0
+        self.invalidadas = 0
+
+    @property
+    def ativa(self) -> bool:
+        return self.ttl > 0
+
+    @property
+    def geracao(self) -> int:
+        """Contador de invalidações; capture-o antes de calcular uma resposta a guardar."""
+        return self._geracao
+
+    def obter(self, chave: Hashable) -> Optional[EntradaCache]:
+        if not self.ativa:
+            return None
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is None:
+                self.misses += 1
+                return None
+            if entrada.expira_em <= time.monotonic():
+                self._remover(chave)
+                self.expiradas += 1
+                self.misses += 1
+                return None
+            self._entradas.move_to_end(chave)
+            self.hits += 1
+            return entrada
+
+    def guardar(self, chave: Hashable, conteudo: bytes, tags: Iterable[str], geracao: int, headers: Optional[Dict[str, str]] = None) -> EntradaCache:
+        entrada = EntradaCache(conteudo, dict(headers or {}), set(tags), time.monotonic() + self.ttl)
+        if not self.ativa or entrada.tamanho > self.max_bytes:
+            return entrada
+        with self._lock:
+            if geracao != self._geracao:
+                return entrada
+            if chave in self._entradas:
+                self._remover(chave)
+            self._entradas[chave] = entrada
+            self._bytes += entrada.tamanho
+            for tag in entrada.tags:
+                self._por_tag.setdefault(tag, set()).add(chave)
+            while len(self._entradas) > self.max_entradas or self._bytes > self.max_bytes:
+                self._remover(next(iter(self._entradas)))
+                self.descartadas += 1
+        return entrada
+
+    def _remover(self, chave: Hashable):
+        entrada = self._entradas.pop(chave)
+        self._bytes -= entrada.tamanho
+        for tag in entrada.tags:
+            chaves = self._por_tag.get(tag)
+            if chaves is not None:
+                chaves.discard(chave)
+                if not chaves:
+                    del self._por_tag[tag]
+
+    def invalidar(self, *tags: str):
+        """Remove todas as entradas com qualquer uma das etiquetas indicadas."""
+        with self._lock:
+            self._geracao += 1
+            for tag in tags:
+                for chave in list(self._por_tag.get(tag, ())):
+                    self._remover(chave)
+                    self.invalidadas += 1
+
+    def limpar(self):
+        with self._lock:
+            self._geracao += 1
+            self.invalidadas += len(self._entradas)
+            self._entradas.clear()
+            self._por_tag.clear()
+            self._bytes = 0
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            pedidos = self.hits + self.misses
+            return {
+                "ativa": self.ativa,
+                "ttl_segundos": self.ttl,
+                "entradas": len(self._entradas),
+                "max_entradas": self.max_entradas,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "taxa_acerto": round(self.hits / pedidos, 4) if pedidos else 0.0,
+                "expiradas": self.expiradas,
+                "descartadas_lru": self.descartadas,
+                "invalidadas": self.invalidadas,
+            }
+
+# Instância única partilhada pela aplicação e pelos routers
+cache = CacheLeitura(CACHE_TTL_SEGUNDOS, CACHE_MAX_ENTRADAS, CACHE_MAX_BYTES)
+
+# --- Etiquetas usadas pelos endpoints públicos ---
+TAG_BUSCA = "busca"          # resultados de /catalogo/search
+TAG_MODELOS = "modelos"      # sugestões de /modelos/search
+TAG_DETALHES = "detalhes"    # todas as páginas de detalhe de produto
+TAG_EM_ESTOQUE = "em_estoque"  # buscas com em_estoque=true (dependem de variações ausentes)
+
+def tag_variacao(variacao_id: int) -> str:
+    return f"variacao:{variacao_id}"
+
+def tag_produto(produto_id: int) -> str:
+    return f"produto:{produto_id}"
+
+def invalidar_variacao(variacao_id: int, cruzou_zero: bool = False):
+    """
+    Mudança de estoque (venda, reposição, compra): só as respostas que contêm a variação e,
+    se o estoque passou por zero, também as buscas com em_estoque=true, que a podem omitir.
+    """
+    if cruzou_zero:
+        cache.invalidar(tag_variacao(variacao_id), TAG_EM_ESTOQUE)
+    else:
+        cache.invalidar(tag_variacao(variacao_id))
+
+def invalidar_produto(produto_id: int):
+    """Mudança de dados do produto ou das suas variações: detalhes do produto e buscas."""
+    cache.invalidar(tag_produto(produto_id), TAG_BUSCA)
+
+def invalidar_nomes():
+    """Mudança de marca ou modelo: os nomes aparecem em todas as respostas."""
+    cache.limpar()
@@ -1,7 +1,12 @@
 # catalogo_api/database.py
 import os
+from contextlib import asynccontextmanager
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi.concurrency import run_in_threadpool
+
+from metricas_pool import PoolInstrumentado, PoolAsyncInstrumentado, instrumentar
 from dotenv import load_dotenv
 
 # Carrega variáveis de ambiente do ficheiro .env (para desenvolvimento local)
@@ -31,16 +36,52 @@ else:
     print("AVISO: A aplicação está a ser executada em modo de DESENVOLVIMENTO. A usar a base de dados local MySQL.")
     SQLALCHEMY_DATABASE_URL = "mysql+mysqlconnector://root:@localhost/catalogo_inteligente"
 
+# --- Configuração do pool de conexões (variáveis de ambiente) ---
+def _env_bool(nome: str, padrao: str) -> bool:
+    return os.getenv(nome, padrao).lower() in ("1", "true", "sim")
+
+POOL_CONFIG = {
+    "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+    "max_overflow": int(os.getenv("DB_POOL_MAX_OVERFLOW", "10")),
+    "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+    # Para produção, o Render pode fechar conexões inativas. `pool_recycle` ajuda a evitar erros.
+    "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")), # Recicla conexões a cada 30 minutos
+    # Testa a conexão antes de a entregar, descartando as que o servidor já fechou.
+    "pool_pre_ping": _env_bool("DB_POOL_PRE_PING", "true"),
+    # LIFO reutiliza as conexões mais recentes e deixa as restantes expirar em períodos calmos.
+    "pool_use_lifo": _env_bool("DB_POOL_LIFO", "false"),
+}
+
 # Cria a engine do SQLAlchemy
-# Para produção, o Render pode fechar conexões inativas. `pool_recycle` ajuda a evitar erros.
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    pool_recycle=1800 # Recicla conexões a cada 30 minutos
-)
+engine = create_engine(SQLALCHEMY_DATABASE_URL, poolclass=PoolInstrumentado, **POOL_CONFIG)
+instrumentar(engine)
 
 # Cria a classe de sessão
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# --- Engine assíncrona (opcional) ---
+# Com DB_ASYNC=true, os endpoints de leitura usam asyncpg (PostgreSQL) ou aiomysql (MySQL)
+# e não ocupam uma thread do threadpool enquanto esperam pela base de dados.
+USAR_DB_ASYNC = os.getenv("DB_ASYNC", "false").lower() in ("1", "true", "sim")
+
+def converter_url_async(url: str) -> str:
+    """Troca o driver síncrono da URL pelo equivalente assíncrono."""
+    if url.startswith("postgresql"):
+        url = url.replace("postgresql+psycopg2://", "postgresql://", 1).replace("postgresql://", "postgresql+asyncpg://", 1)
+        # O asyncpg não reconhece 'sslmode'; o parâmetro equivalente é 'ssl'.
+        return url.replace("sslmode=", "ssl=")
+    if url.startswith("mysql"):
+        return url.replace("mysql+mysqlconnector://", "mysql+aiomysql://", 1)
+    return url
+
+async_engine = None
+AsyncSessionLocal = None
+if USAR_DB_ASYNC:
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+    async_engine = create_async_engine(converter_url_async(SQLALCHEMY_DATABASE_URL), poolclass=PoolAsyncInstrumentado, **POOL_CONFIG)
+    instrumentar(async_engine.sync_engine)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 # Função para obter a sessão do banco de dados (usada com Depends)
 def get_db():
     db = SessionLocal()
@@ -49,6 +90,57 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    """Sessão assíncrona (AsyncSession). Requer DB_ASYNC=true."""
+    if AsyncSessionLocal is None:
+        raise RuntimeError("A engine assíncrona não está ativa. Defina DB_ASYNC=true.")
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def get_db_leitura():
+    """
+    Sessão para os endpoints de leitura `async def`: AsyncSession com DB_ASYNC=true,
+    caso contrário a Session síncrona habitual. Use `ler_linhas` para executar queries
+    de forma transparente em qualquer um dos modos.
+    """
+    if USAR_DB_ASYNC:
+        async for db in get_async_db():
+            yield db
+    else:
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+# A mesma sessão fora de Depends, com `async with`: para um endpoint abrir várias sessões
+# e correr queries em paralelo, cada uma na sua conexão do pool.
+sessao_leitura = asynccontextmanager(get_db_leitura)
+
+def _ler_linhas_sync(db: Session, query, params: dict) -> list:
+    try:
+        return db.execute(query, params).fetchall()
+    finally:
+        # Devolve a conexão ao pool na mesma thread. Se ficasse presa à sessão até ao fim
+        # do pedido, as threads do threadpool poderiam esgotar-se à espera de conexões
+        # detidas por pedidos que precisam de uma thread para as libertar.
+        db.close()
+
+async def ler_linhas(db, query, params: dict = None) -> list:
+    """Executa uma query de leitura e devolve todas as linhas, sem bloquear o event loop."""
+    if isinstance(db, AsyncSession):
+        resultado = await db.execute(query, params or {})
+        return resultado.fetchall()
+    return await run_in_threadpool(_ler_linhas_sync, db, query, params or {})
+
 # Função para obter a engine (usada para verificar o dialeto)
 def get_engine():
     return engine
+
+def estatisticas_pool() -> dict:
+    """Configuração e contadores dos pools de conexões (síncrono e, se ativo, assíncrono)."""
+    pools = {"sincrono": engine.pool.estatisticas.resumo(engine.pool)}
+    if async_engine is not None:
+        pool_async = async_engine.sync_engine.pool
+        pools["assincrono"] = pool_async.estatisticas.resumo(pool_async)
+    return {"configuracao": POOL_CONFIG, "pools": pools}
@@ -0,0 +1,58 @@
+# eventos_catalogo.py
+
+# Ponto único que os routers chamam depois de confirmar (commit) uma escrita no catálogo.
+# Mantém sincronizados os índices em memória (busca e autocompletar) e a cache de leitura
+# dos endpoints públicos.
+
+from sqlalchemy.orm import Session
+
+import autocompletar
+import cache_leitura
+from indice_catalogo import indice
+
+def estoque_alterado(variacao_id: int, nova_quantidade: int, quantidade_alterada: int):
+    """
+    Venda, reposição ou compra: só muda a quantidade de uma variação (em
+    `quantidade_alterada`, negativa nas vendas). Se passar por zero, a variação entra ou
+    sai das buscas com em_estoque=true, incluindo páginas em que ainda não aparece.
+    """
+    indice.atualizar_quantidade(variacao_id, nova_quantidade)
+    cruzou_zero = (nova_quantidade - quantidade_alterada > 0) != (nova_quantidade > 0)
+    cache_leitura.invalidar_variacao(variacao_id, cruzou_zero)
+
+def variacoes_criadas(db: Session, produto_id: int):
+    indice.recarregar_produto(db, produto_id)
+    cache_leitura.invalidar_produto(produto_id)
+
+def variacao_alterada(db: Session, variacao_id: int, produto_id: int):
+    indice.recarregar_variacao(db, variacao_id)
+    cache_leitura.invalidar_produto(produto_id)
+
+def variacao_removida(variacao_id: int, produto_id: int):
+    indice.remover_variacao(variacao_id)
+    cache_leitura.invalidar_produto(produto_id)
+
+def produto_alterado(db: Session, produto_id: int):
+    indice.recarregar_produto(db, produto_id)
+    cache_leitura.invalidar_produto(produto_id)
+
+def produto_removido(produto_id: int):
+    cache_leitura.invalidar_produto(produto_id)
+
+def modelo_criado(db: Session, marca_id: int):
+    autocompletar.indice.recarregar_marca(db, marca_id)
+    cache_leitura.cache.invalidar(cache_leitura.TAG_MODELOS)
+
+def modelo_alterado(db: Session, modelo_id: int):
+    indice.recarregar_modelo(db, modelo_id)
+    autocompletar.indice.recarregar_modelo(db, modelo_id)
+    cache_leitura.invalidar_nomes()
+
+def modelo_removido(modelo_id: int):
+    autocompletar.indice.remover_modelo(modelo_id)
+    cache_leitura.cache.invalidar(cache_leitura.TAG_MODELOS)
+
+def marca_alterada(db: Session, marca_id: int):
+    indice.recarregar_marca(db, marca_id)
+    autocompletar.indice.recarregar_marca(db, marca_id)
+    cache_leitura.invalidar_nomes()
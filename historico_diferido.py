@@ -0,0 +1,342 @@
+# historico_diferido.py
+
+import os
+import csv
+import io
+import glob
+import json
+import uuid
+import threading
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem bloqueio entre processos (um único worker)
+    fcntl = None
+
+# Gravação diferida (write-behind) das linhas de historico_estoque. Com HISTORICO_DIFERIDO=true,
+# as vendas e reposições só alteram estoque_variacoes dentro da transação do pedido; a linha
+# de histórico (com os preços e a data/hora lidos nessa transação) é entregue a esta fila
+# depois do commit e gravada em lotes por um thread próprio: COPY no PostgreSQL (psycopg2),
+# executemany nos restantes.
+#
+# - Antes de entrar na fila, cada linha é acrescentada (com fsync) a um ficheiro de spool
+#   local. Ao gravar um lote, o spool passa a `lote-<id>.jsonl` e só é apagado depois do
+#   commit; no arranque, os lotes e spools que ficaram por gravar são repetidos pelo
+#   primeiro ciclo do thread (e os que falharem, nos ciclos seguintes).
+# - O ID do lote é gravado em `historico_lotes_aplicados` na mesma transação das linhas:
+#   repetir um lote já gravado (queda entre o commit e a remoção do ficheiro) não duplica.
+# - Só fica por cobrir o intervalo entre o commit do pedido e o fsync do spool, e as linhas
+#   que, sem spool nem base de dados, ficam em memória até o thread as conseguir gravar.
+# - Com vários workers, cada um mantém bloqueado o seu spool; a recuperação ignora os
+#   spools que ainda têm dono.
+
+ATIVO = os.getenv("HISTORICO_DIFERIDO", "false").lower() in ("1", "true", "sim")
+TAMANHO_LOTE = int(os.getenv("HISTORICO_LOTE_TAMANHO", "500"))
+INTERVALO_SEGUNDOS = float(os.getenv("HISTORICO_LOTE_SEGUNDOS", "1"))
+DIRETORIO_SPOOL = os.getenv("HISTORICO_SPOOL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "spool_historico"))
+
+COLUNAS = (
+    "id_variacao_estoque", "id_usuario", "tipo_movimento", "quantidade_alterada",
+    "nova_quantidade_estoque", "preco_venda_momento", "preco_custo_momento", "data_hora",
+)
+_CHAVE_SESSAO = "historico_diferido"
+
+def _serializar(linha: Dict) -> str:
+    return json.dumps({c: linha[c] for c in COLUNAS}, default=str)
+
+def _desserializar(texto: str) -> Dict:
+    linha = json.loads(texto)
+    for coluna in ("preco_venda_momento", "preco_custo_momento"):
+        if linha[coluna] is not None:
+            linha[coluna] = Decimal(linha[coluna])
+    linha["data_hora"] = datetime.fromisoformat(linha["data_hora"])
+    return linha
+
+def _ler_ficheiro(caminho: str) -> List[Dict]:
+    with open(caminho, encoding="utf-8") as f:
+        # Uma linha incompleta no fim é uma escrita interrompida antes do fsync: ignorada
+        linhas = f.read().split("\n")
+    resultado = []
+    for texto in linhas:
+        try:
+            resultado.append(_desserializar(texto))
+        except (ValueError, KeyError):
+            continue
+    return resultado
+
+def _id_lote(caminho: str) -> str:
+    return os.path.basename(caminho).split("-", 1)[1].rsplit(".", 1)[0]
+
+def gravar_lote(db: Session, id_lote: str, linhas: List[Dict]) -> bool:
+    """Insere as linhas e marca o lote como aplicado. False se o lote já tinha sido gravado."""
+    aplicado = db.execute(text("SELECT 1 FROM historico_lotes_aplicados WHERE id_lote = :id"), {"id": id_lote}).scalar()
+    if aplicado:
+        return False
+    if linhas:
+        conexao = db.connection()
+        if conexao.dialect.name == "postgresql" and conexao.dialect.driver == "psycopg2":
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows([[linha[c] for c in COLUNAS] for linha in linhas])
+            buffer.seek(0)
+            cursor = conexao.connection.driver_connection.cursor()
+            cursor.copy_expert(f"COPY historico_estoque ({', '.join(COLUNAS)}) FROM STDIN WITH (FORMAT csv)", buffer)
+        else:
+            db.execute(text(f"""
+                INSERT INTO historico_estoque ({', '.join(COLUNAS)})
+                VALUES ({', '.join(':' + c for c in COLUNAS)})
+            """), linhas)
+    db.execute(text("INSERT INTO historico_lotes_aplicados (id_lote) VALUES (:id)"), {"id": id_lote})
+    try:
+        db.commit()
+    except IntegrityError:
+        # Outro worker gravou o mesmo lote (recuperação no arranque) ao mesmo tempo
+        db.rollback()
+        return False
+    return True
+
+class FilaHistorico:
+    """Linhas de histórico confirmadas à espera de gravação, com spool em disco."""
+
+    def __init__(self, diretorio: str, tamanho_lote: int, intervalo: float, fabrica_sessao):
+        self.diretorio = diretorio
+        self.tamanho_lote = tamanho_lote
+        self.intervalo = intervalo
+        self.fabrica_sessao = fabrica_sessao
+        self._lock = threading.Lock()
+        self._condicao = threading.Condition(self._lock)
+        self._lock_descarga = threading.Lock()
+        # Protege o ficheiro de spool (escrita e rotação); o fsync é feito fora dos locks
+        self._lock_spool = threading.Lock()
+        self._pendentes = 0
+        self._falhados: List[str] = []
+        # Linhas que não chegaram ao spool nem à base de dados: repetidas a cada ciclo
+        self._em_memoria: List[Tuple[str, List[Dict]]] = []
+        self._spool = None
+        self._caminho_spool: Optional[str] = None
+        self._thread: Optional[threading.Thread] = None
+        self._parar = False
+        self.linhas_gravadas = 0
+        self.lotes_gravados = 0
+        self.falhas = 0
+
+    # --- Spool ---
+    def _abrir_spool(self):
+        self._caminho_spool = os.path.join(self.diretorio, f"spool-{uuid.uuid4().hex}.jsonl")
+        self._spool = open(self._caminho_spool, "a", encoding="utf-8")
+        if fcntl is not None:
+            fcntl.flock(self._spool.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def _rodar_spool(self) -> Optional[str]:
+        """Fecha o spool atual, renomeia-o para lote e abre um novo. Chamar com o lock."""
+        with self._lock_spool:
+            caminho_lote = os.path.join(self.diretorio, f"lote-{_id_lote(self._caminho_spool)}.jsonl")
+            self._spool.close()
+            try:
+                os.replace(self._caminho_spool, caminho_lote)
+            except FileNotFoundError:
+                caminho_lote = None  # já recuperado por um worker que arrancou entretanto
+            self._abrir_spool()
+        return caminho_lote
+
+    # --- Ciclo de vida ---
+    def iniciar(self):
+        os.makedirs(self.diretorio, exist_ok=True)
+        self.recuperar()
+        with self._lock, self._lock_spool:
+            self._parar = False
+            self._abrir_spool()
+        self._thread = threading.Thread(target=self._ciclo, name="historico-diferido", daemon=True)
+        self._thread.start()
+
+    def parar(self):
+        """Grava o que falta e fecha o spool (chamado no fim do lifespan)."""
+        with self._condicao:
+            self._parar = True
+            self._condicao.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        try:
+            self.descarregar()
+        except Exception as e:
+            print(f"Aviso: histórico diferido por gravar no encerramento (repetido no próximo arranque): {e}")
+        with self._lock, self._lock_spool:
+            if self._em_memoria:
+                print(f"Aviso: {sum(len(l) for _, l in self._em_memoria)} linhas de histórico em memória perdidas no encerramento.")
+            if self._spool is not None:
+                self._spool.close()
+                # Um spool vazio não tem nada para repetir no próximo arranque
+                if os.path.getsize(self._caminho_spool) == 0:
+                    os.remove(self._caminho_spool)
+                self._spool = None
+
+    def recuperar(self):
+        """Entrega ao próximo ciclo os lotes e spools deixados por uma execução anterior."""
+        for caminho in sorted(glob.glob(os.path.join(self.diretorio, "*.jsonl"))):
+            if os.path.basename(caminho).startswith("spool-"):
+                with open(caminho, "a", encoding="utf-8") as f:
+                    if fcntl is not None:
+                        try:
+                            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        except OSError:
+                            continue  # spool de um worker ativo
+                caminho_lote = os.path.join(self.diretorio, f"lote-{_id_lote(caminho)}.jsonl")
+                try:
+                    os.replace(caminho, caminho_lote)
+                except FileNotFoundError:
+                    continue  # recuperado por outro worker
+                caminho = caminho_lote
+            with self._lock:
+                self._falhados.append(caminho)
+            print(f"Histórico diferido: {os.path.basename(caminho)} ficou por gravar e vai ser repetido.")
+
+    # --- Fila ---
+    def acrescentar(self, linhas: List[Dict]):
+        dados = "".join(_serializar(linha) + "\n" for linha in linhas)
+        with self._lock_spool:
+            if self._spool is None:
+                raise RuntimeError("A fila do histórico diferido não foi iniciada.")
+            self._spool.write(dados)
+            self._spool.flush()
+            # Cópia do descritor: o spool pode ser rodado (fechado) durante o fsync
+            descritor = os.dup(self._spool.fileno())
+        try:
+            # Fora dos locks: as vendas e o thread de gravação não esperam pelo disco umas das outras
+            os.fsync(descritor)
+        finally:
+            os.close(descritor)
+        with self._condicao:
+            self._pendentes += len(linhas)
+            if self._pendentes >= self.tamanho_lote:
+                self._condicao.notify()
+
+    def reter(self, linhas: List[Dict]):
+        """Último recurso, sem spool nem base de dados: linhas em memória até ao próximo ciclo."""
+        with self._lock:
+            self._em_memoria.append((uuid.uuid4().hex, linhas))
+
+    def _ciclo(self):
+        while True:
+            with self._condicao:
+                self._condicao.wait_for(lambda: self._parar or self._pendentes >= self.tamanho_lote, timeout=self.intervalo)
+                if self._parar:
+                    return
+            try:
+                self.descarregar()
+            except Exception as e:
+                print(f"Erro ao gravar o histórico diferido: {e}")
+
+    def descarregar(self):
+        """Grava as linhas pendentes (e os lotes que falharam antes) num lote por ficheiro."""
+        with self._lock_descarga:
+            with self._lock:
+                if self._pendentes:
+                    caminho_lote = self._rodar_spool()
+                    if caminho_lote:
+                        self._falhados.append(caminho_lote)
+                    self._pendentes = 0
+                lotes, self._falhados = self._falhados, []
+                em_memoria, self._em_memoria = self._em_memoria, []
+            for i, (id_lote, linhas) in enumerate(em_memoria):
+                try:
+                    with self.fabrica_sessao() as db:
+                        gravado = gravar_lote(db, id_lote, linhas)
+                except Exception:
+                    self.falhas += 1
+                    with self._lock:
+                        self._em_memoria = em_memoria[i:] + self._em_memoria
+                        self._falhados = lotes + self._falhados
+                    raise
+                if gravado:
+                    self.linhas_gravadas += len(linhas)
+                    self.lotes_gravados += 1
+            for i, caminho in enumerate(lotes):
+                if not os.path.exists(caminho):
+                    continue  # gravado e removido por outro worker durante a recuperação
+                try:
+                    linhas = _ler_ficheiro(caminho)
+                    with self.fabrica_sessao() as db:
+                        gravado = gravar_lote(db, _id_lote(caminho), linhas)
+                except Exception:
+                    # O ficheiro fica no disco: volta a ser tentado no próximo ciclo
+                    self.falhas += 1
+                    with self._lock:
+                        self._falhados = lotes[i:] + self._falhados
+                    raise
+                try:
+                    os.remove(caminho)
+                except FileNotFoundError:
+                    pass
+                if gravado:
+                    self.linhas_gravadas += len(linhas)
+                    self.lotes_gravados += 1
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            return {
+                "ativo": True,
+                "pendentes": self._pendentes,
+                "lotes_por_gravar": len(self._falhados),
+                "linhas_em_memoria": sum(len(linhas) for _, linhas in self._em_memoria),
+                "linhas_gravadas": self.linhas_gravadas,
+                "lotes_gravados": self.lotes_gravados,
+                "falhas": self.falhas,
+                "tamanho_lote": self.tamanho_lote,
+                "intervalo_segundos": self.intervalo,
+            }
+
+fila: Optional[FilaHistorico] = None
+
+def adiar(db: Session, linhas: List[Dict]):
+    """Guarda na sessão as linhas de histórico; entram na fila só se a transação for confirmada."""
+    db.info.setdefault(_CHAVE_SESSAO, []).extend(linhas)
+
+def _apos_commit(session: Session):
+    linhas = session.info.pop(_CHAVE_SESSAO, None)
+    if not linhas:
+        return
+    try:
+        fila.acrescentar(linhas)
+    except Exception as e:
+        # A venda já foi confirmada: sem spool (disco cheio, fila parada), grava já
+        print(f"Aviso: spool do histórico indisponível ({e}); a gravar {len(linhas)} linhas diretamente.")
+        try:
+            with fila.fabrica_sessao() as db:
+                gravar_lote(db, uuid.uuid4().hex, linhas)
+        except Exception as e:
+            # Nunca propaga a exceção: o cliente receberia um erro por uma venda confirmada
+            # e repeti-la-ia. As linhas ficam em memória e são repetidas pelo thread.
+            print(f"ERRO: histórico por gravar ({e}); {len(linhas)} linhas retidas em memória.")
+            fila.reter(linhas)
+
+def _apos_rollback(session: Session):
+    session.info.pop(_CHAVE_SESSAO, None)
+
+def iniciar():
+    global fila
+    from database import SessionLocal
+    fila = FilaHistorico(DIRETORIO_SPOOL, TAMANHO_LOTE, INTERVALO_SEGUNDOS, SessionLocal)
+    fila.iniciar()
+    event.listen(Session, "after_commit", _apos_commit)
+    event.listen(Session, "after_soft_rollback", _apos_rollback)
+
+def encerrar():
+    global fila
+    if fila is None:
+        return
+    event.remove(Session, "after_commit", _apos_commit)
+    event.remove(Session, "after_soft_rollback", _apos_rollback)
+    fila.parar()
+    fila = None
+
+def estatisticas() -> dict:
+    if fila is None:
+        return {"ativo": False}
+    return fila.estatisticas()
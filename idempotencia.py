@@ -0,0 +1,213 @@
+# idempotencia.py
+
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from fastapi import Depends, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+import seguranca
+from database import get_db
+
+# Suporte ao cabeçalho `Idempotency-Key` nos endpoints que alteram o estoque. O PDV pode
+# repetir um pedido cuja resposta se perdeu (rede instável, duplo clique) sem registar a
+# venda duas vezes: a repetição recebe a resposta guardada da primeira execução.
+#
+# - As chaves são por utilizador, método e caminho; reutilizar uma chave com outro corpo
+#   devolve 422 e uma repetição enquanto a primeira ainda corre devolve 409.
+# - Só as respostas de sucesso são guardadas; um erro não alterou nada (a transação foi
+#   desfeita) e pode ser repetido com a mesma chave.
+# - Por defeito, as chaves ficam em memória (por processo). Com IDEMPOTENCIA_DB=true ficam
+#   também na tabela `pedidos_idempotentes`, gravadas na mesma transação da alteração, o
+#   que cobre vários workers e reinícios.
+
+CABECALHO = "Idempotency-Key"
+TTL_SEGUNDOS = int(os.getenv("IDEMPOTENCIA_TTL_SEGUNDOS", str(24 * 3600)))
+MAX_ENTRADAS = int(os.getenv("IDEMPOTENCIA_MAX_ENTRADAS", "10000"))
+USAR_DB = os.getenv("IDEMPOTENCIA_DB", "false").lower() in ("1", "true", "sim")
+TAMANHO_MAXIMO_CHAVE = 255
+
+class RespostaGuardada:
+    __slots__ = ("impressao", "status_code", "conteudo", "expira_em")
+
+    def __init__(self, impressao: str, status_code: int, conteudo: bytes, expira_em: float):
+        self.impressao = impressao
+        self.status_code = status_code
+        self.conteudo = conteudo
+        self.expira_em = expira_em
+
+class ArmazemIdempotencia:
+    """Respostas guardadas por chave (TTL + limite de entradas, as mais antigas saem primeiro)."""
+
+    def __init__(self, ttl: int, max_entradas: int):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self._lock = threading.Lock()
+        self._respostas: "OrderedDict[str, RespostaGuardada]" = OrderedDict()
+        self._em_curso = set()
+
+    def obter(self, chave: str) -> Optional[RespostaGuardada]:
+        with self._lock:
+            guardada = self._respostas.get(chave)
+            if guardada is not None and guardada.expira_em <= time.monotonic():
+                del self._respostas[chave]
+                return None
+            return guardada
+
+    def reservar(self, chave: str) -> bool:
+        """Marca a chave como em processamento; False se já houver um pedido a usá-la."""
+        with self._lock:
+            if chave in self._em_curso:
+                return False
+            self._em_curso.add(chave)
+            return True
+
+    def libertar(self, chave: str):
+        with self._lock:
+            self._em_curso.discard(chave)
+
+    def guardar(self, chave: str, resposta: RespostaGuardada):
+        with self._lock:
+            self._respostas.pop(chave, None)
+            self._respostas[chave] = resposta
+            while len(self._respostas) > self.max_entradas:
+                self._respostas.popitem(last=False)
+
+    def limpar(self):
+        with self._lock:
+            self._respostas.clear()
+
+armazem = ArmazemIdempotencia(TTL_SEGUNDOS, MAX_ENTRADAS)
+
+def _resposta_repetida(guardada: RespostaGuardada) -> JSONResponse:
+    resposta = JSONResponse(content=json.loads(guardada.conteudo), status_code=guardada.status_code)
+    resposta.headers["Idempotent-Replayed"] = "true"
+    return resposta
+
+def _agora() -> datetime:
+    # criado_em é gravado pela aplicação, em UTC, para não depender do fuso do servidor da BD
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def _ler_da_bd(db: Session, chave: str) -> Optional[RespostaGuardada]:
+    limite = _agora() - timedelta(seconds=TTL_SEGUNDOS)
+    try:
+        linha = db.execute(text("""
+            SELECT impressao, status_code, resposta FROM pedidos_idempotentes
+            WHERE chave = :chave AND criado_em >= :limite
+        """), {"chave": chave, "limite": limite}).first()
+    finally:
+        # Não deixa a leitura abrir a transação da alteração que se segue
+        db.rollback()
+    if linha is None:
+        return None
+    return RespostaGuardada(linha.impressao, linha.status_code, linha.resposta.encode(), time.monotonic() + TTL_SEGUNDOS)
+
+class PedidoIdempotente:
+    """
+    Estado de um pedido com (ou sem) Idempotency-Key, injetado nos endpoints por
+    `pedido_idempotente`. Uso típico:
+
+        if idem.resposta: return idem.resposta
+        ... alteração ...
+        idem.registar(db, resultado)
+        db.commit()
+        return resultado
+    """
+
+    def __init__(self, chave: Optional[str] = None, impressao: Optional[str] = "", resposta: Optional[JSONResponse] = None,
+                 guardada: Optional[RespostaGuardada] = None):
+        self.chave = chave
+        self.impressao = impressao
+        self.resposta = resposta
+        self._guardada = guardada
+        self._a_guardar: Optional[RespostaGuardada] = None
+
+    def definir_conteudo(self, conteudo: bytes):
+        """
+        Endpoints multipart: a impressão é calculada a partir do ficheiro enviado (o corpo já
+        foi consumido e o boundary muda a cada envio). Chame antes de verificar `resposta`.
+        """
+        if self.chave is None:
+            return
+        self.impressao = hashlib.sha256(conteudo).hexdigest()
+        if self._guardada is not None:
+            if self._guardada.impressao != self.impressao:
+                raise HTTPException(status_code=422, detail="Esta Idempotency-Key já foi usada com um pedido diferente.")
+            self.resposta = _resposta_repetida(self._guardada)
+
+    def registar(self, db: Session, conteudo: dict, status_code: int = 200):
+        """Prepara a resposta a guardar. Chame antes do commit da alteração."""
+        if self.chave is None:
+            return
+        if self.impressao is None:
+            raise RuntimeError("Pedido multipart com Idempotency-Key: chame definir_conteudo antes de registar.")
+        corpo = json.dumps(conteudo, default=str).encode()
+        self._a_guardar = RespostaGuardada(self.impressao, status_code, corpo, time.monotonic() + TTL_SEGUNDOS)
+        if USAR_DB:
+            # Limpa uma eventual entrada expirada com a mesma chave antes de inserir
+            limite = _agora() - timedelta(seconds=TTL_SEGUNDOS)
+            db.execute(text("DELETE FROM pedidos_idempotentes WHERE chave = :chave AND criado_em < :limite"),
+                       {"chave": self.chave, "limite": limite})
+            db.execute(text("""
+                INSERT INTO pedidos_idempotentes (chave, impressao, status_code, resposta, criado_em)
+                VALUES (:chave, :impressao, :status_code, :resposta, :criado_em)
+            """), {"chave": self.chave, "impressao": self.impressao, "status_code": status_code, "resposta": corpo.decode(), "criado_em": _agora()})
+
+async def pedido_idempotente(
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(seguranca.get_current_user),
+):
+    """Dependência que lê o cabeçalho Idempotency-Key e devolve a resposta guardada, se existir."""
+    chave_cliente = request.headers.get(CABECALHO)
+    if not chave_cliente:
+        yield PedidoIdempotente()
+        return
+    if len(chave_cliente) > TAMANHO_MAXIMO_CHAVE:
+        raise HTTPException(status_code=400, detail=f"O cabeçalho {CABECALHO} excede {TAMANHO_MAXIMO_CHAVE} caracteres.")
+
+    chave = hashlib.sha256(f"{current_user['id']}:{request.method}:{request.url.path}:{chave_cliente}".encode()).hexdigest()
+    try:
+        impressao = hashlib.sha256(await request.body()).hexdigest()
+    except RuntimeError:
+        # Formulários multipart já consumidos pelo FastAPI: o endpoint calcula a impressão
+        # a partir do ficheiro com `definir_conteudo`
+        impressao = None
+
+    if not armazem.reservar(chave):
+        raise HTTPException(status_code=409, detail="Já existe um pedido em processamento com esta Idempotency-Key.")
+    try:
+        guardada = armazem.obter(chave)
+        if guardada is None and USAR_DB:
+            guardada = await run_in_threadpool(_ler_da_bd, db, chave)
+        if guardada is not None and impressao is None:
+            yield PedidoIdempotente(chave, None, guardada=guardada)
+            return
+        if guardada is not None:
+            if guardada.impressao != impressao:
+                raise HTTPException(status_code=422, detail="Esta Idempotency-Key já foi usada com um pedido diferente.")
+            yield PedidoIdempotente(chave, impressao, _resposta_repetida(guardada))
+            return
+
+        pedido = PedidoIdempotente(chave, impressao)
+        yield pedido
+        # Só chega aqui se o endpoint terminou sem exceção (a alteração foi confirmada)
+        if pedido._a_guardar is not None:
+            armazem.guardar(chave, pedido._a_guardar)
+    finally:
+        armazem.libertar(chave)
+
+def limpar_expirados(db: Session):
+    """Remove da tabela as chaves fora do TTL (chamado no arranque com IDEMPOTENCIA_DB=true)."""
+    limite = _agora() - timedelta(seconds=TTL_SEGUNDOS)
+    db.execute(text("DELETE FROM pedidos_idempotentes WHERE criado_em < :limite"), {"limite": limite})
+    db.commit()
@@ -0,0 +1,263 @@
+# indice_catalogo.py
+
+import heapq
+import threading
+import unicodedata
+from typing import Any, Dict, List, Optional, Set
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+import schemas
+import paginacao
+import armazenamento_imagens
+
+# Query base que alimenta o índice. É a mesma junção usada pela busca do catálogo,
+# acrescida dos IDs necessários para saber que entradas atualizar quando há escritas.
+QUERY_VARIACOES = """
+    SELECT ev.id, ev.cor, ev.quantidade, ev.url_foto, ev.disponivel_encomenda, p.nome AS produto_nome,
+           CONCAT(b.nome, ' ', m.nome_modelo) AS modelo_celular, p.preco_venda,
+           p.id AS produto_id, p.tipo, m.id AS modelo_id, b.id AS marca_id
+    FROM estoque_variacoes AS ev
+    JOIN produtos AS p ON ev.id_produto = p.id
+    JOIN modelos_celular AS m ON p.id_modelo_celular = m.id
+    JOIN marcas AS b ON m.id_marca = b.id
+"""
+
+def normalizar(texto: str) -> str:
+    """
+    Converte o texto para minúsculas e remove acentos, imitando a comparação
+    insensível a maiúsculas/acentos do ILIKE/collation da base de dados.
+    """
+    decomposto = unicodedata.normalize("NFKD", texto.lower())
+    return "".join(c for c in decomposto if not unicodedata.combining(c))
+
+def trigramas(texto: str) -> Set[str]:
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+class IndiceCatalogo:
+    """
+    Índice em memória para a busca do catálogo.
+
+    Cada modelo ("marca modelo") é decomposto em trigramas; cada trigrama aponta para
+    os modelos que o contêm e cada modelo aponta para as suas variações. Uma busca
+    intersecta os trigramas do termo e confirma a substring no texto normalizado,
+    devolvendo o mesmo resultado que o `LIKE '%q%'` sem tocar na base de dados.
+
+    O índice vive no processo: com vários workers, cada um mantém a sua cópia.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._quantidades_durante_construcao: Optional[Dict[int, int]] = None
+        self._variacoes: Dict[int, dict] = {}
+        self._modelos: Dict[int, dict] = {}
+        self._trigramas: Dict[str, Set[int]] = {}
+        self.pronto = False
+
+    # --- Construção e manutenção ---
+
+    def construir(self, db: Session):
+        """Carrega todas as variações da base de dados, substituindo o conteúdo atual."""
+        with self._lock:
+            # Vendas deste processo durante a query: a leitura pode ser anterior a elas
+            self._quantidades_durante_construcao = {}
+        try:
+            resultado = db.execute(text(QUERY_VARIACOES)).fetchall()
+        except Exception:
+            with self._lock:
+                self._quantidades_durante_construcao = None
+            raise
+        with self._lock:
+            self._variacoes.clear()
+            self._modelos.clear()
+            self._trigramas.clear()
+            for row in resultado:
+                self._adicionar(row)
+            for variacao_id, quantidade in self._quantidades_durante_construcao.items():
+                if variacao_id in self._variacoes:
+                    self._variacoes[variacao_id]["quantidade"] = quantidade
+            self._quantidades_durante_construcao = None
+            self.pronto = True
+
+    def _adicionar(self, row):
+        variacao = {
+            "id": row.id, "cor": row.cor, "quantidade": row.quantidade, "url_foto": row.url_foto,
+            "disponivel_encomenda": bool(row.disponivel_encomenda), "produto_nome": row.produto_nome,
+            "modelo_celular": row.modelo_celular, "preco_venda": float(row.preco_venda),
+            "produto_id": row.produto_id, "tipo": row.tipo, "modelo_id": row.modelo_id, "marca_id": row.marca_id,
+            "ordem": (normalizar(row.cor), row.id),
+        }
+        self._variacoes[row.id] = variacao
+
+        texto = normalizar(row.modelo_celular)
+        modelo = self._modelos.get(row.modelo_id)
+        if modelo is not None and modelo["texto"] != texto:
+            # O nome da marca ou do modelo mudou: os trigramas antigos deixam de valer.
+            self._desindexar_modelo(row.modelo_id)
+            modelo = None
+        if modelo is None:
+            modelo = {"texto": texto, "variacoes": set()}
+            self._modelos[row.modelo_id] = modelo
+            for trigrama in trigramas(texto):
+                self._trigramas.setdefault(trigrama, set()).add(row.modelo_id)
+        modelo["variacoes"].add(row.id)
+
+    def _desindexar_modelo(self, modelo_id: int):
+        modelo = self._modelos.pop(modelo_id, None)
+        if modelo is None:
+            return
+        for trigrama in trigramas(modelo["texto"]):
+            ids = self._trigramas.get(trigrama)
+            if ids is not None:
+                ids.discard(modelo_id)
+                if not ids:
+                    del self._trigramas[trigrama]
+
+    def _remover(self, variacao_id: int):
+        variacao = self._variacoes.pop(variacao_id, None)
+        if variacao is None:
+            return
+        modelo = self._modelos.get(variacao["modelo_id"])
+        if modelo is not None:
+            modelo["variacoes"].discard(variacao_id)
+            if not modelo["variacoes"]:
+                self._desindexar_modelo(variacao["modelo_id"])
+
+    def _recarregar(self, db: Session, coluna: str, campo: str, valor: int):
+        try:
+            resultado = db.execute(text(f"{QUERY_VARIACOES} WHERE {coluna} = :valor"), {"valor": valor}).fetchall()
+        except Exception as e:
+            print(f"Aviso: não foi possível atualizar o índice do catálogo ({campo}={valor}): {e}")
+            return
+        with self._lock:
+            for variacao_id in [v["id"] for v in self._variacoes.values() if v[campo] == valor]:
+                self._remover(variacao_id)
+            for row in resultado:
+                # Um produto pode ter mudado de modelo; remove a entrada antiga antes de reindexar.
+                self._remover(row.id)
+                self._adicionar(row)
+
+    def recarregar_variacao(self, db: Session, variacao_id: int):
+        self._recarregar(db, "ev.id", "id", variacao_id)
+
+    def recarregar_produto(self, db: Session, produto_id: int):
+        self._recarregar(db, "p.id", "produto_id", produto_id)
+
+    def recarregar_modelo(self, db: Session, modelo_id: int):
+        self._recarregar(db, "m.id", "modelo_id", modelo_id)
+
+    def recarregar_marca(self, db: Session, marca_id: int):
+        self._recarregar(db, "b.id", "marca_id", marca_id)
+
+    def remover_variacao(self, variacao_id: int):
+        with self._lock:
+            self._remover(variacao_id)
+
+    def atualizar_quantidade(self, variacao_id: int, nova_quantidade: int):
+        """Atualiza apenas o estoque de uma variação (caminho das vendas/reposições, sem query)."""
+        with self._lock:
+            if self._quantidades_durante_construcao is not None:
+                self._quantidades_durante_construcao[variacao_id] = nova_quantidade
+            variacao = self._variacoes.get(variacao_id)
+            if variacao is not None:
+                variacao["quantidade"] = nova_quantidade
+
+    # --- Busca ---
+
+    def procurar(
+        self,
+        q: str,
+        id_modelo: Optional[int] = None,
+        tipo: Optional[str] = None,
+        em_estoque: bool = False,
+        apos: Optional[List[Any]] = None,
+        limite: Optional[int] = None,
+    ) -> List[dict]:
+        """
+        Devolve as variações cujo "marca modelo" contém `q`, ordenadas por cor e id.
+        `apos` é a chave (cor, id) do último item da página anterior (paginação keyset).
+        """
+        termo = normalizar(q)
+        tipo = normalizar(tipo) if tipo else None
+        chave_apos = (normalizar(apos[0]), apos[1]) if apos else None
+        with self._lock:
+            if len(termo) >= 3:
+                conjuntos = [self._trigramas.get(t) for t in trigramas(termo)]
+                if not all(conjuntos):
+                    return []
+                conjuntos.sort(key=len)
+                candidatos = set(conjuntos[0]).intersection(*conjuntos[1:])
+            else:
+                candidatos = self._modelos.keys()
+            if id_modelo is not None:
+                candidatos = [id_modelo] if id_modelo in candidatos else []
+            selecionadas = (
+                self._variacoes[variacao_id]
+                for modelo_id in candidatos if termo in self._modelos[modelo_id]["texto"]
+                for variacao_id in self._modelos[modelo_id]["variacoes"]
+            )
+            selecionadas = [
+                v for v in selecionadas
+                if (tipo is None or normalizar(v["tipo"]) == tipo)
+                and (not em_estoque or v["quantidade"] > 0)
+                and (chave_apos is None or v["ordem"] > chave_apos)
+            ]
+            if limite is not None:
+                selecionadas = heapq.nsmallest(limite, selecionadas, key=lambda v: v["ordem"])
+            else:
+                selecionadas.sort(key=lambda v: v["ordem"])
+            return [dict(v) for v in selecionadas]
+
+def query_procurar(
+    q: str,
+    db_type: str,
+    id_modelo: Optional[int] = None,
+    tipo: Optional[str] = None,
+    em_estoque: bool = False,
+    apos: Optional[List[Any]] = None,
+    limite: Optional[int] = None,
+):
+    """
+    Query equivalente à busca do índice, executada diretamente na base de dados. Usada
+    enquanto o índice não está pronto (ex.: BD inacessível no arranque). Devolve (query, params).
+    """
+    like_operator = "ILIKE" if db_type == "postgresql" else "LIKE"
+    condicao, params = paginacao.condicao_keyset(["ev.cor", "ev.id"], apos)
+    filtros = [
+        f"CONCAT(b.nome, ' ', m.nome_modelo) {like_operator} :search_term",
+        "m.id = :id_modelo" if id_modelo is not None else "",
+        "p.tipo = :tipo" if tipo else "",
+        "ev.quantidade > 0" if em_estoque else "",
+        condicao,
+    ]
+    query_sql = f"""
+        {QUERY_VARIACOES}
+        {paginacao.montar_where(filtros)}
+        ORDER BY ev.cor, ev.id
+        {"LIMIT :limite" if limite is not None else ""}
+    """
+    params.update({"search_term": f"%{q}%", "id_modelo": id_modelo, "tipo": tipo, "limite": limite})
+    return text(query_sql), params
+
+def procurar_sql(db: Session, q: str, db_type: str, **filtros) -> List[dict]:
+    query, params = query_procurar(q, db_type, **filtros)
+    return [dict(row._mapping) for row in db.execute(query, params).fetchall()]
+
+def para_resposta(variacoes: List[dict]) -> List[schemas.EstoqueVariacaoResponse]:
+    return [schemas.EstoqueVariacaoResponse(
+        id=v["id"], cor=v["cor"], quantidade=v["quantidade"], url_foto=v["url_foto"],
+        imagens=armazenamento_imagens.imagens_responsivas(v["url_foto"]),
+        disponivel_encomenda=v["disponivel_encomenda"], produto_nome=v["produto_nome"],
+        modelo_celular=v["modelo_celular"], preco_venda=v["preco_venda"]
+    ) for v in variacoes]
+
+# Instância única partilhada pela aplicação e pelos routers
+indice = IndiceCatalogo()
+
+def construir_indice(db: Session):
+    try:
+        indice.construir(db)
+        print(f"Índice do catálogo construído com {len(indice._variacoes)} variações.")
+    except Exception as e:
+        print(f"Aviso: não foi possível construir o índice do catálogo, a busca usará a base de dados: {e}")
@@ -1,40 +1,45 @@
 # main.py
 
-from fastapi import FastAPI, Depends, HTTPException, status, File, UploadFile, Form
+from fastapi import FastAPI, Depends, HTTPException, status, Request
 from sqlalchemy import text
 from sqlalchemy.orm import Session
 from typing import List, Optional
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, RedirectResponse
+from contextlib import asynccontextmanager
+import asyncio
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import RedirectResponse, Response
 from fastapi.security import OAuth2PasswordRequestForm
 import os
+import json
 from dotenv import load_dotenv
-from pydantic import BaseModel # Manter para modelos específicos deste ficheiro
-
-# Importa as bibliotecas do Cloudinary
-import cloudinary
-import cloudinary.uploader
-import cloudinary.api
+from pydantic import BaseModel, TypeAdapter # Manter para modelos específicos deste ficheiro
 
 # Carrega as variáveis de ambiente PRIMEIRO
 load_dotenv()
 
 import seguranca
 import schemas
-from database import get_db, get_engine
-from routers import marcas, modelos, produtos, fornecedores, estoque, pdv, relatorios
-
-# --- Configuração do Cloudinary ---
-cloudinary.config(
-    cloud_name = os.getenv("CLOUDINARY_CLOUD_NAME"),
-    api_key = os.getenv("CLOUDINARY_API_KEY"),
-    api_secret = os.getenv("CLOUDINARY_API_SECRET"),
-    secure = True
-)
+import indice_catalogo
+import autocompletar
+import paginacao
+import cache_http
+import idempotencia
+import historico_diferido
+import armazenamento_imagens
+import tarefas_imagens
+import ativos_estaticos
+from cache_leitura import cache, TAG_BUSCA, TAG_MODELOS, TAG_DETALHES, TAG_EM_ESTOQUE, tag_variacao, tag_produto
+from database import get_db, get_db_leitura, ler_linhas, get_engine, SessionLocal
+from routers import marcas, modelos, produtos, fornecedores, estoque, relatorios, sistema
 
 # --- Definição de Caminhos ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 STATIC_DIR = os.path.join(BASE_DIR, "static")
+# Páginas servidas a partir de memória, pré-comprimidas (ver ativos_estaticos)
+PAGINAS_HTML = ["login.html", "catalogo.html", "produto.html", "index.html", "pdv.html", "relatorio_pdv.html"]
+
+def pagina_html(request: Request, nome: str) -> Response:
+    return ativos_estaticos.responder(request, ativos_estaticos.ativos.obter(os.path.join(BASE_DIR, nome)))
 
 # Modelos Pydantic que são específicos para os endpoints públicos deste ficheiro
 class VariacaoSelecionadaResponse(BaseModel):
@@ -43,11 +48,13 @@ class VariacaoSelecionadaResponse(BaseModel):
     quantidade: int
     disponivel_encomenda: bool
     url_foto: Optional[str] = None
+    imagens: Optional[schemas.ImagensVariacao] = None
 
 class OutraVariacaoResponse(BaseModel):
     id: int
     cor: str
     url_foto: Optional[str] = None
+    imagens: Optional[schemas.ImagensVariacao] = None
 
 class DetalhesProdutoPublicoResponse(BaseModel):
     produto_nome: str
@@ -56,16 +63,72 @@ class DetalhesProdutoPublicoResponse(BaseModel):
     variacao_selecionada: VariacaoSelecionadaResponse
     outras_variacoes: List[OutraVariacaoResponse]
 
+# --- Índices em memória ---
+# Cada processo tem o seu índice (com a quantidade de cada variação) e só atualiza as
+# escritas que ele próprio faz. Com vários workers ou instâncias, ou escritas fora da API
+# (scripts), os outros processos só as veem na reconstrução periódica: este intervalo é o
+# atraso máximo do estoque na busca. 0 desliga a reconstrução (um único worker).
+INDICE_RECONSTRUIR_SEGUNDOS = int(os.getenv("INDICE_CATALOGO_RECONSTRUIR_SEGUNDOS", "300"))
+
+def construir_indices():
+    with SessionLocal() as db:
+        indice_catalogo.construir_indice(db)
+        autocompletar.construir_indice(db)
+
+def limpar_idempotencia():
+    with SessionLocal() as db:
+        try:
+            idempotencia.limpar_expirados(db)
+        except Exception as e:
+            db.rollback()
+            print(f"Aviso: não foi possível limpar a tabela pedidos_idempotentes: {e}")
+
+async def reconstruir_indices_periodicamente():
+    while True:
+        await asyncio.sleep(INDICE_RECONSTRUIR_SEGUNDOS)
+        try:
+            await run_in_threadpool(construir_indices)
+        except Exception as e:
+            # Mantém o índice anterior e tenta de novo no próximo intervalo
+            print(f"Aviso: falha ao reconstruir os índices do catálogo: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await run_in_threadpool(construir_indices)
+    await run_in_threadpool(ativos_estaticos.ativos.precarregar, [os.path.join(BASE_DIR, nome) for nome in PAGINAS_HTML])
+    if idempotencia.USAR_DB:
+        await run_in_threadpool(limpar_idempotencia)
+    if historico_diferido.ATIVO:
+        # Repete no primeiro ciclo o histórico que ficou no spool de uma execução anterior
+        await run_in_threadpool(historico_diferido.iniciar)
+    if tarefas_imagens.ATIVO:
+        tarefas_imagens.iniciar()
+    tarefa_reconstrucao = None
+    if INDICE_RECONSTRUIR_SEGUNDOS > 0:
+        tarefa_reconstrucao = asyncio.create_task(reconstruir_indices_periodicamente())
+    yield
+    if tarefa_reconstrucao:
+        tarefa_reconstrucao.cancel()
+    seguranca.encerrar_executor_hash()
+    await run_in_threadpool(tarefas_imagens.encerrar)
+    armazenamento_imagens.encerrar_executor()
+    await run_in_threadpool(historico_diferido.encerrar)
+
 # --- Início da Aplicação FastAPI ---
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 app.include_router(marcas.router)
 app.include_router(modelos.router)
 app.include_router(produtos.router)
 app.include_router(fornecedores.router)
 app.include_router(estoque.router)
-app.include_router(pdv.router)
 app.include_router(relatorios.router)
-app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
+app.include_router(sistema.router)
+# As fotos locais têm o hash do conteúdo no nome: uma foto nova tem sempre um URL novo,
+# por isso podem ficar em cache indefinidamente. Montado antes de /static para ter prioridade.
+app.mount(armazenamento_imagens.URL_LOCAL.rstrip("/"), cache_http.StaticFilesImutaveis(
+    directory=armazenamento_imagens.DIRETORIO_LOCAL, check_dir=False,
+    padrao_imutavel=armazenamento_imagens.PADRAO_NOME_HASH), name="imagens")
+app.mount("/static", ativos_estaticos.StaticFilesComprimidos(directory=STATIC_DIR), name="static")
 
 # --- Endpoints Públicos ---
 @app.get("/")
@@ -73,75 +136,97 @@ def ler_raiz():
     return RedirectResponse(url="/login")
 
 @app.get("/login", include_in_schema=False)
-def pagina_login():
-    return FileResponse(os.path.join(BASE_DIR, 'login.html'))
+def pagina_login(request: Request):
+    return pagina_html(request, 'login.html')
 
 @app.get("/catalogo", include_in_schema=False)
-def ler_catalogo():
-    return FileResponse(os.path.join(BASE_DIR, 'catalogo.html'))
+def ler_catalogo(request: Request):
+    return pagina_html(request, 'catalogo.html')
 
 @app.get("/produto", include_in_schema=False)
-def ler_pagina_produto():
-    return FileResponse(os.path.join(BASE_DIR, 'produto.html'))
+def ler_pagina_produto(request: Request):
+    return pagina_html(request, 'produto.html')
+
+# Serializadores usados para guardar as respostas públicas já em JSON na cache de leitura
+LISTA_NOMES = TypeAdapter(List[str])
+LISTA_VARIACOES = TypeAdapter(List[schemas.EstoqueVariacaoResponse])
+
+def resposta_json(entrada) -> Response:
+    return Response(content=entrada.conteudo, media_type="application/json", headers=entrada.headers)
 
 @app.get("/modelos/search", response_model=List[str])
-def search_modelos(q: Optional[str] = None, db: Session = Depends(get_db)):
+async def search_modelos(q: Optional[str] = None, db = Depends(get_db_leitura)):
     if not q:
         return []
     
-    search_term = f"%{q}%"
-    engine = get_engine()
-    db_type = engine.dialect.name
-    like_operator = "ILIKE" if db_type == "postgresql" else "LIKE"
-    
-    query_sql = f"""
-        SELECT 
-            CONCAT(b.nome, ' ', m.nome_modelo) AS full_name
-        FROM modelos_celular AS m
-        JOIN marcas AS b ON m.id_marca = b.id
-        WHERE CONCAT(b.nome, ' ', m.nome_modelo) {like_operator} :search_term
-        ORDER BY full_name
-        LIMIT 10
-    """
-    
+    chave = ("modelos/search", q)
+    entrada = cache.obter(chave)
+    if entrada is not None:
+        return resposta_json(entrada)
+    geracao = cache.geracao
     try:
-        resultado = db.execute(text(query_sql), {"search_term": search_term}).fetchall()
-        modelos = [row[0] for row in resultado]
-        return modelos
+        # Sugestões por prefixo de palavra servidas da memória; a query LIKE só é usada
+        # enquanto o índice não estiver pronto.
+        if autocompletar.indice.pronto:
+            modelos = autocompletar.indice.sugerir(q)
+        else:
+            linhas = await ler_linhas(db, *autocompletar.query_sugerir(q, get_engine().dialect.name))
+            modelos = [row.full_name for row in linhas]
     except Exception as e:
         print(f"Erro na busca por autocompletar: {e}")
         return []
+    return resposta_json(cache.guardar(chave, LISTA_NOMES.dump_json(modelos), [TAG_MODELOS], geracao))
 
 @app.get("/catalogo/search", response_model=List[schemas.EstoqueVariacaoResponse])
-def procurar_no_catalogo(q: Optional[str] = None, db: Session = Depends(get_db)):
-    # ... (código existente) ...
-    if not q: return []
-    search_term = f"%{q}%"
-    engine = get_engine()
-    db_type = engine.dialect.name
-    like_operator = "ILIKE" if db_type == "postgresql" else "LIKE"
-    query_sql = f"""
-        SELECT ev.id, ev.cor, ev.quantidade, ev.url_foto, ev.disponivel_encomenda, p.nome as produto_nome,
-               CONCAT(b.nome, ' ', m.nome_modelo) AS modelo_celular, p.preco_venda
-        FROM estoque_variacoes AS ev
-        JOIN produtos AS p ON ev.id_produto = p.id
-        JOIN modelos_celular AS m ON p.id_modelo_celular = m.id
-        JOIN marcas AS b ON m.id_marca = b.id
-        WHERE CONCAT(b.nome, ' ', m.nome_modelo) {like_operator} :search_term
-        ORDER BY ev.cor
-    """
+async def procurar_no_catalogo(
+    response: Response,
+    q: Optional[str] = None,
+    id_modelo: Optional[int] = None,
+    tipo: Optional[str] = None,
+    em_estoque: bool = False,
+    limit: int = paginacao.parametro_limite(),
+    cursor: Optional[str] = paginacao.parametro_cursor(),
+    db = Depends(get_db_leitura)
+):
+    if not q and id_modelo is None: return []
+    chave = ("catalogo/search", q, id_modelo, tipo, em_estoque, limit, cursor)
+    entrada = cache.obter(chave)
+    if entrada is not None:
+        return resposta_json(entrada)
+    geracao = cache.geracao
+    apos = paginacao.decodificar_cursor(cursor, 2)
+    filtros = {"id_modelo": id_modelo, "tipo": tipo, "em_estoque": em_estoque, "apos": apos, "limite": limit + 1}
     try:
-        resultado = db.execute(text(query_sql), {"search_term": search_term}).fetchall()
-        variacoes = [schemas.EstoqueVariacaoResponse(id=row[0], cor=row[1], quantidade=row[2], url_foto=row[3], disponivel_encomenda=row[4], produto_nome=row[5], modelo_celular=row[6], preco_venda=row[7]) for row in resultado]
-        return variacoes
+        # O índice em memória responde sem ir à base de dados; enquanto não estiver
+        # pronto (ex.: BD inacessível no arranque), usamos a query original.
+        if indice_catalogo.indice.pronto:
+            variacoes = indice_catalogo.indice.procurar(q or "", **filtros)
+        else:
+            linhas = await ler_linhas(db, *indice_catalogo.query_procurar(q or "", get_engine().dialect.name, **filtros))
+            variacoes = [dict(row._mapping) for row in linhas]
+        variacoes = paginacao.fechar_pagina(response, variacoes, limit, lambda v: (v["cor"], v["id"]))
+        conteudo = LISTA_VARIACOES.dump_json(indice_catalogo.para_resposta(variacoes))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao buscar no catálogo: {e}")
+    # Cada página fica associada às variações que contém: uma venda só invalida as páginas onde aparece.
+    # Com em_estoque, uma reposição a partir de 0 acrescenta variações: TAG_EM_ESTOQUE.
+    tags = [TAG_BUSCA] + [tag_variacao(v["id"]) for v in variacoes] + ([TAG_EM_ESTOQUE] if em_estoque else [])
+    cursor_seguinte = response.headers.get(paginacao.CABECALHO_CURSOR)
+    cabecalhos = {paginacao.CABECALHO_CURSOR: cursor_seguinte} if cursor_seguinte else {}
+    return resposta_json(cache.guardar(chave, conteudo, tags, geracao, cabecalhos))
 
 # --- Endpoint de Detalhes do Produto (Público) ---
-@app.get("/produto/detalhes/{variacao_id}", response_model=DetalhesProdutoPublicoResponse)
-def get_detalhes_publicos_produto(variacao_id: int, db: Session = Depends(get_db)):
-    # Query 1: Buscar a variação selecionada e os detalhes do produto principal
-    query_principal = text("""
+def query_detalhes_produto(db_type: str):
+    """
+    Uma única query devolve a variação selecionada, o produto e, agregadas em JSON,
+    todas as variações irmãs (subquery correlacionada), evitando um segundo round trip.
+    """
+    if db_type == "postgresql":
+        agregado = "json_agg(json_build_object('id', o.id, 'cor', o.cor, 'url_foto', o.url_foto) ORDER BY o.cor, o.id)"
+    else:
+        # MySQL/MariaDB não garantem ordem no JSON_ARRAYAGG; ordenamos em Python.
+        agregado = "JSON_ARRAYAGG(JSON_OBJECT('id', o.id, 'cor', o.cor, 'url_foto', o.url_foto))"
+    return text(f"""
         SELECT
             p.id as produto_id,
             p.nome as produto_nome,
@@ -150,71 +235,107 @@ def get_detalhes_publicos_produto(variacao_id: int, db: Session = Depends(get_db
             ev.cor,
             ev.quantidade,
             ev.disponivel_encomenda,
-            ev.url_foto
+            ev.url_foto,
+            (SELECT {agregado} FROM estoque_variacoes AS o WHERE o.id_produto = ev.id_produto) AS outras_variacoes
         FROM estoque_variacoes AS ev
         JOIN produtos AS p ON ev.id_produto = p.id
         JOIN modelos_celular AS m ON p.id_modelo_celular = m.id
         JOIN marcas AS b ON m.id_marca = b.id
         WHERE ev.id = :variacao_id
     """)
-    resultado_principal = db.execute(query_principal, {"variacao_id": variacao_id}).first()
 
-    if not resultado_principal:
-        raise HTTPException(status_code=404, detail="Produto não encontrado.")
+@app.get("/produto/detalhes/{variacao_id}", response_model=DetalhesProdutoPublicoResponse)
+async def get_detalhes_publicos_produto(variacao_id: int, request: Request, db = Depends(get_db_leitura)):
+    chave = ("produto/detalhes", variacao_id)
+    entrada = cache.obter(chave)
+    if entrada is not None:
+        return cache_http.resposta_com_etag(request, entrada.conteudo, "application/json")
+    geracao = cache.geracao
 
-    produto_id = resultado_principal[0]
+    db_type = get_engine().dialect.name
+    linhas = await ler_linhas(db, query_detalhes_produto(db_type), {"variacao_id": variacao_id})
 
-    # Query 2: Buscar todas as variações para o mesmo produto
-    query_outras_variacoes = text("""
-        SELECT id, cor, url_foto
-        FROM estoque_variacoes
-        WHERE id_produto = :produto_id
-        ORDER BY cor
-    """)
-    resultado_outras_variacoes = db.execute(query_outras_variacoes, {"produto_id": produto_id}).fetchall()
+    if not linhas:
+        raise HTTPException(status_code=404, detail="Produto não encontrado.")
+
+    resultado = linhas[0]
+    outras_variacoes = resultado.outras_variacoes or []
+    if isinstance(outras_variacoes, (str, bytes)):
+        outras_variacoes = json.loads(outras_variacoes)
+    if db_type != "postgresql":
+        outras_variacoes.sort(key=lambda v: (v["cor"], v["id"]))
 
     # Montar a resposta
-    variacao_selecionada = VariacaoSelecionadaResponse(
-        id=variacao_id,
-        cor=resultado_principal[4],
-        quantidade=resultado_principal[5],
-        disponivel_encomenda=resultado_principal[6],
-        url_foto=resultado_principal[7]
+    detalhes = DetalhesProdutoPublicoResponse(
+        produto_nome=resultado.produto_nome,
+        modelo_celular=resultado.modelo_celular,
+        preco_venda=resultado.preco_venda,
+        variacao_selecionada=VariacaoSelecionadaResponse(
+            id=variacao_id,
+            cor=resultado.cor,
+            quantidade=resultado.quantidade,
+            disponivel_encomenda=resultado.disponivel_encomenda,
+            url_foto=resultado.url_foto,
+            imagens=armazenamento_imagens.imagens_responsivas(resultado.url_foto)
+        ),
+        outras_variacoes=[OutraVariacaoResponse(**v, imagens=armazenamento_imagens.imagens_responsivas(v["url_foto"])) for v in outras_variacoes]
     )
 
-    outras_variacoes = [OutraVariacaoResponse(id=row[0], cor=row[1], url_foto=row[2]) for row in resultado_outras_variacoes]
+    # A página mostra todas as variações do produto, por isso depende de todas elas.
+    tags = [TAG_DETALHES, tag_produto(resultado.produto_id)] + [tag_variacao(v["id"]) for v in outras_variacoes]
+    entrada = cache.guardar(chave, detalhes.model_dump_json().encode(), tags, geracao)
 
-    return DetalhesProdutoPublicoResponse(
-        produto_nome=resultado_principal[1],
-        modelo_celular=resultado_principal[3],
-        preco_venda=resultado_principal[2],
-        variacao_selecionada=variacao_selecionada,
-        outras_variacoes=outras_variacoes
-    )
+    # A ETag é derivada do conteúdo das linhas lidas: visitas repetidas e trocas de cor
+    # para uma variação já vista recebem 304 sem corpo.
+    return cache_http.resposta_com_etag(request, entrada.conteudo, "application/json")
 
 # --- Endpoint de Autenticação ---
+def ler_utilizador_login(db: Session, query, username: str):
+    # A conexão volta ao pool antes da verificação da senha: numa vaga de logins, os pedidos
+    # à espera do bcrypt não podem esgotar as conexões usadas pelo PDV.
+    try:
+        return db.execute(query, {"username": username}).first()
+    finally:
+        db.close()
+
+def atualizar_hash_senha(db: Session, username: str, novo_hash: str):
+    try:
+        db.execute(text("UPDATE usuarios SET senha_hash = :senha_hash WHERE username = :username"), {"senha_hash": novo_hash, "username": username})
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"Aviso: não foi possível atualizar o hash da senha de '{username}': {e}")
+
 @app.post("/token", response_model=schemas.Token, tags=["Autenticação"])
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    query = text("SELECT username, senha_hash, role FROM usuarios WHERE username = :username")
-    result = db.execute(query, {"username": form_data.username}).first()
-    if not result or not seguranca.verificar_senha(form_data.password, result[1]):
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+    query = text("SELECT username, senha_hash, role, id FROM usuarios WHERE username = :username")
+    result = await run_in_threadpool(ler_utilizador_login, db, query, form_data.username)
+    if not result:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Nome de utilizador ou senha incorretos", headers={"WWW-Authenticate": "Bearer"})
-    
+    # O bcrypt corre num executor dedicado e limitado, fora do threadpool das outras rotas.
+    valida, novo_hash = await seguranca.verificar_senha_login(form_data.password, result[1])
+    if not valida:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Nome de utilizador ou senha incorretos", headers={"WWW-Authenticate": "Bearer"})
+    if novo_hash:
+        # Hash com parâmetros desatualizados: substituído de forma transparente.
+        await run_in_threadpool(atualizar_hash_senha, db, form_data.username, novo_hash)
+
     user_role = result[2]
-    access_token = seguranca.criar_access_token(data={"sub": form_data.username, "role": user_role})
+    # O ID numérico vai no token: as escritas no estoque não precisam de consultar `usuarios`.
+    access_token = seguranca.criar_access_token(data={"sub": form_data.username, "role": user_role, "uid": result[3]})
     return {"access_token": access_token, "token_type": "bearer"}
 
 # --- Endpoints Protegidos ---
 
 @app.get("/admin", include_in_schema=False)
-def painel_admin():
-    return FileResponse(os.path.join(BASE_DIR, 'index.html'))
+def painel_admin(request: Request):
+    return pagina_html(request, 'index.html')
 
 # Endpoint do PDV CORRIGIDO - sem dependência de segurança direta
 @app.get("/pdv", include_in_schema=False)
-def painel_pdv():
-    return FileResponse(os.path.join(BASE_DIR, 'pdv.html'))
+def painel_pdv(request: Request):
+    return pagina_html(request, 'pdv.html')
 
 @app.get("/relatorio-pdv", include_in_schema=False)
-def pagina_relatorio_pdv():
-    return FileResponse(os.path.join(BASE_DIR, 'relatorio_pdv.html'))
+def pagina_relatorio_pdv(request: Request):
+    return pagina_html(request, 'relatorio_pdv.html')
@@ -0,0 +1,97 @@
+# metricas_pool.py
+
+import threading
+import time
+from collections import deque
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+class EstatisticasPool:
+    """
+    Contadores de um pool de conexões: tempo de espera no checkout (últimas N amostras),
+    checkouts que esgotaram o pool_timeout, conexões abertas e invalidadas.
+    """
+
+    def __init__(self, amostras: int = 1000):
+        self._lock = threading.Lock()
+        self._esperas_ms = deque(maxlen=amostras)
+        self.checkouts = 0
+        self.esperas_total_ms = 0.0
+        self.espera_maxima_ms = 0.0
+        self.timeouts = 0
+        self.conexoes_abertas = 0
+        self.invalidacoes = 0
+        self.invalidacoes_suaves = 0
+
+    def registar_checkout(self, espera_ms: float):
+        with self._lock:
+            self.checkouts += 1
+            self.esperas_total_ms += espera_ms
+            self.espera_maxima_ms = max(self.espera_maxima_ms, espera_ms)
+            self._esperas_ms.append(espera_ms)
+
+    def registar(self, contador: str):
+        with self._lock:
+            setattr(self, contador, getattr(self, contador) + 1)
+
+    def resumo(self, pool) -> dict:
+        with self._lock:
+            esperas = sorted(self._esperas_ms)
+
+        def percentil(p):
+            return round(esperas[min(len(esperas) - 1, int(len(esperas) * p / 100))], 3) if esperas else 0.0
+
+        return {
+            "tamanho": pool.size(),
+            "em_uso": pool.checkedout(),
+            "livres": pool.checkedin(),
+            "overflow": max(pool.overflow(), 0),
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "espera_media_ms": round(self.esperas_total_ms / self.checkouts, 3) if self.checkouts else 0.0,
+            "espera_maxima_ms": round(self.espera_maxima_ms, 3),
+            "espera_p50_ms": percentil(50),
+            "espera_p95_ms": percentil(95),
+            "espera_p99_ms": percentil(99),
+            "conexoes_abertas": self.conexoes_abertas,
+            "invalidacoes": self.invalidacoes,
+            "invalidacoes_suaves": self.invalidacoes_suaves,
+        }
+
+class _MedirCheckout:
+    """Mixin que cronometra a obtenção de uma conexão, incluindo a espera por uma livre."""
+
+    estatisticas: EstatisticasPool
+
+    def _do_get(self):
+        inicio = time.perf_counter()
+        try:
+            conexao = super()._do_get()
+        except exc.TimeoutError:
+            self.estatisticas.registar("timeouts")
+            raise
+        self.estatisticas.registar_checkout((time.perf_counter() - inicio) * 1000)
+        return conexao
+
+    def recreate(self):
+        # engine.dispose() recria o pool; os contadores passam para o novo.
+        novo = super().recreate()
+        novo.estatisticas = self.estatisticas
+        return novo
+
+class PoolInstrumentado(_MedirCheckout, QueuePool):
+    pass
+
+class PoolAsyncInstrumentado(_MedirCheckout, AsyncAdaptedQueuePool):
+    pass
+
+def instrumentar(engine) -> EstatisticasPool:
+    """Associa contadores ao pool da engine (síncrona ou a sync_engine de uma AsyncEngine)."""
+    pool = engine.pool
+    estatisticas = EstatisticasPool()
+    pool.estatisticas = estatisticas
+    event.listen(pool, "connect", lambda *args: estatisticas.registar("conexoes_abertas"))
+    event.listen(pool, "invalidate", lambda *args: estatisticas.registar("invalidacoes"))
+    event.listen(pool, "soft_invalidate", lambda *args: estatisticas.registar("invalidacoes_suaves"))
+    return estatisticas
@@ -0,0 +1,64 @@
+# paginacao.py
+
+import base64
+import json
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException, Query, Response
+
+# Limites de página partilhados pelos endpoints de listagem
+LIMITE_PADRAO = 100
+LIMITE_MAXIMO = 500
+
+# Cabeçalho onde é devolvido o cursor da página seguinte. O corpo continua a ser uma lista
+# simples, para que os clientes existentes não precisem de mudar para ler a primeira página.
+CABECALHO_CURSOR = "X-Next-Cursor"
+
+def parametro_limite():
+    return Query(LIMITE_PADRAO, ge=1, le=LIMITE_MAXIMO, description="Número máximo de itens por página.")
+
+def parametro_cursor():
+    return Query(None, description="Cursor opaco devolvido no cabeçalho X-Next-Cursor da página anterior.")
+
+def codificar_cursor(valores: Sequence[Any]) -> str:
+    """Codifica os valores da chave de ordenação do último item num cursor opaco."""
+    dados = json.dumps(list(valores), default=str, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(dados).decode().rstrip("=")
+
+def decodificar_cursor(cursor: Optional[str], tamanho: int) -> Optional[List[Any]]:
+    if not cursor:
+        return None
+    try:
+        valores = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor de paginação inválido.")
+    if not isinstance(valores, list) or len(valores) != tamanho:
+        raise HTTPException(status_code=400, detail="Cursor de paginação inválido.")
+    return valores
+
+def condicao_keyset(colunas: Sequence[str], cursor: Optional[List[Any]], descendente: bool = False) -> Tuple[str, dict]:
+    """
+    Gera a condição `(a, b, id) > (:k0, :k1, :k2)` que continua a listagem a seguir ao cursor.
+    As colunas têm de corresponder, pela mesma ordem, ao ORDER BY da query (todas ascendentes,
+    ou todas descendentes com `descendente=True`, e terminando numa chave única, para que a
+    ordem seja estável).
+    """
+    if cursor is None:
+        return "", {}
+    marcadores = ", ".join(f":k{i}" for i in range(len(colunas)))
+    params = {f"k{i}": valor for i, valor in enumerate(cursor)}
+    return f"({', '.join(colunas)}) {'<' if descendente else '>'} ({marcadores})", params
+
+def fechar_pagina(response: Response, linhas: list, limite: int, chave: Callable[[Any], Sequence[Any]]) -> list:
+    """
+    Recebe até `limite + 1` linhas (a linha extra indica que há mais resultados), corta a
+    página e, se houver continuação, publica o cursor no cabeçalho da resposta.
+    """
+    if len(linhas) > limite:
+        linhas = linhas[:limite]
+        response.headers[CABECALHO_CURSOR] = codificar_cursor(chave(linhas[-1]))
+    return linhas
+
+def montar_where(condicoes: Sequence[str]) -> str:
+    condicoes = [c for c in condicoes if c]
+    return f"WHERE {' AND '.join(condicoes)}" if condicoes else ""
@@ -4,16 +4,19 @@ from fastapi import APIRouter, Depends, HTTPException, status, File, UploadFile,
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 from sqlalchemy.exc import IntegrityError
-from typing import List, Optional, Literal
+from typing import List, Optional, Literal, Tuple
 from decimal import Decimal
-import os
-
-# Importa as bibliotecas do Cloudinary
-import cloudinary
-import cloudinary.uploader
+from pydantic import TypeAdapter, ValidationError
+import csv
+import json
 
 import schemas
 import seguranca
+import eventos_catalogo
+import servico_estoque
+import idempotencia
+import armazenamento_imagens
+import tarefas_imagens
 from database import get_db
 
 router = APIRouter(
@@ -37,12 +40,13 @@ async def health_check_head():
     return Response()
 
 
-@router.get("/produto/{produto_id}", response_model=List[schemas.EstoqueVariacaoResponse])
+@router.get("/produto/{produto_id}", response_model=List[schemas.EstoqueVariacaoAdminResponse])
 def listar_variacoes_por_produto(produto_id: int, db: Session = Depends(get_db), current_user: dict = Depends(seguranca.get_current_user)):
     try:
-        query = text("""
+        query = text(f"""
             SELECT ev.id, ev.cor, ev.quantidade, ev.url_foto, ev.disponivel_encomenda, ev.preco_custo, p.nome as produto_nome,
-                   CONCAT(b.nome, ' ', m.nome_modelo) AS modelo_celular, p.preco_venda
+                   CONCAT(b.nome, ' ', m.nome_modelo) AS modelo_celular, p.preco_venda,
+                   {tarefas_imagens.foto_pendente_sql("ev")} AS foto_pendente
             FROM estoque_variacoes AS ev
             JOIN produtos AS p ON ev.id_produto = p.id
             JOIN modelos_celular AS m ON p.id_modelo_celular = m.id
@@ -54,7 +58,7 @@ def listar_variacoes_por_produto(produto_id: int, db: Session = Depends(get_db),
         if not resultado:
             produto_existe = db.execute(text("SELECT id FROM produtos WHERE id = :id"), {"id": produto_id}).first()
             if not produto_existe: raise HTTPException(status_code=404, detail="Produto não encontrado.")
-        variacoes = [schemas.EstoqueVariacaoResponse(
+        variacoes = [schemas.EstoqueVariacaoAdminResponse(
             id=row.id, 
             cor=row.cor, 
             quantidade=row.quantidade, 
@@ -63,7 +67,8 @@ def listar_variacoes_por_produto(produto_id: int, db: Session = Depends(get_db),
             preco_custo=row.preco_custo,
             produto_nome=row.produto_nome, 
             modelo_celular=row.modelo_celular, 
-            preco_venda=row.preco_venda
+            preco_venda=row.preco_venda,
+            foto_pendente=bool(row.foto_pendente)
         ) for row in resultado]
         return variacoes
     except Exception as e:
@@ -73,20 +78,28 @@ def listar_variacoes_por_produto(produto_id: int, db: Session = Depends(get_db),
 @router.post("/", status_code=status.HTTP_201_CREATED, response_model=dict)
 def criar_variacao_estoque(id_produto: int = Form(...), cor: str = Form(...), quantidade: int = Form(...), preco_custo: float = Form(...), disponivel_encomenda: bool = Form(...), foto: Optional[UploadFile] = File(None), db: Session = Depends(get_db), current_user: dict = Depends(seguranca.get_current_admin_user)):
     url_foto_final = None
-    if foto and foto.filename:
+    # Em segundo plano, a variação é gravada já e a foto enviada depois
+    foto_pendente = bool(foto and foto.filename) and tarefas_imagens.ATIVO
+    if foto and foto.filename and not foto_pendente:
         try:
-            upload_result = cloudinary.uploader.upload(foto.file, folder="catalogo_api")
-            url_foto_final = upload_result.get("secure_url")
+            url_foto_final = armazenamento_imagens.armazenamento.enviar(foto.file, foto.filename)
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Erro ao fazer upload da imagem: {e}")
     try:
-        query = text("""
+        query = """
             INSERT INTO estoque_variacoes (id_produto, cor, quantidade, preco_custo, disponivel_encomenda, url_foto)
             VALUES (:id_produto, :cor, :quantidade, :preco_custo, :disponivel_encomenda, :url_foto)
-        """)
-        db.execute(query, {"id_produto": id_produto, "cor": cor.strip(), "quantidade": quantidade, "preco_custo": preco_custo, "disponivel_encomenda": disponivel_encomenda, "url_foto": url_foto_final})
+        """
+        postgres = db.get_bind().dialect.name == "postgresql"
+        resultado = db.execute(text(query + (" RETURNING id" if postgres else "")), {"id_produto": id_produto, "cor": cor.strip(), "quantidade": quantidade, "preco_custo": preco_custo, "disponivel_encomenda": disponivel_encomenda, "url_foto": url_foto_final})
+        if foto_pendente:
+            variacao_id = resultado.scalar() if postgres else resultado.lastrowid
+            tarefas_imagens.agendar_envio(db, variacao_id, foto.file, foto.filename)
         db.commit()
-        return {"mensagem": "Variação de estoque criada com sucesso."}
+        eventos_catalogo.variacoes_criadas(db, id_produto)
+        if foto_pendente:
+            tarefas_imagens.acordar()
+        return {"mensagem": "Variação de estoque criada com sucesso.", "foto_pendente": foto_pendente}
     except IntegrityError:
         db.rollback()
         raise HTTPException(status_code=400, detail="Não foi possível criar a variação. Verifique se o ID do produto é válido ou se a cor já existe para este produto.")
@@ -94,6 +107,91 @@ def criar_variacao_estoque(id_produto: int = Form(...), cor: str = Form(...), qu
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Erro ao criar variação: {e}")
 
+LISTA_VARIACOES_LOTE = TypeAdapter(List[schemas.VariacaoLote])
+
+@router.post("/lote", status_code=status.HTTP_201_CREATED, response_model=dict)
+def criar_variacoes_lote(
+    id_produto: int = Form(...),
+    variacoes: str = Form(..., description='JSON: [{"cor", "quantidade", "preco_custo", "disponivel_encomenda", "foto": índice em fotos}]'),
+    fotos: List[UploadFile] = File([]),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(seguranca.get_current_admin_user)
+):
+    """
+    Cria várias variações de um produto (e respetivas fotos) num único pedido. As fotos são
+    enviadas em paralelo e as variações inseridas numa só transação; se a inserção falhar,
+    as fotos já enviadas são apagadas. Com as imagens em segundo plano, as variações são
+    gravadas já e cada foto fica agendada na mesma transação.
+    """
+    try:
+        novas = LISTA_VARIACOES_LOTE.validate_json(variacoes)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False))
+    if not novas:
+        raise HTTPException(status_code=400, detail="Nenhuma variação indicada.")
+    cores = [v.cor.lower() for v in novas]
+    if len(set(cores)) != len(cores):
+        raise HTTPException(status_code=400, detail="Há cores repetidas no pedido.")
+    indices_fotos = sorted({v.foto for v in novas if v.foto is not None})
+    if any(i < 0 or i >= len(fotos) or not fotos[i].filename for i in indices_fotos):
+        raise HTTPException(status_code=400, detail="Índice de foto inválido.")
+
+    fotos_pendentes = bool(indices_fotos) and tarefas_imagens.ATIVO
+    urls = []
+    if not fotos_pendentes:
+        try:
+            urls = armazenamento_imagens.enviar_varias([(fotos[i].file, fotos[i].filename) for i in indices_fotos], db)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Erro ao fazer upload das imagens: {e}")
+    url_por_indice = dict(zip(indices_fotos, urls))
+
+    params = {"id_produto": id_produto}
+    linhas = []
+    for i, v in enumerate(novas):
+        linhas.append(f"(:id_produto, :cor{i}, :qtd{i}, :custo{i}, :encomenda{i}, :foto{i})")
+        params.update({f"cor{i}": v.cor, f"qtd{i}": v.quantidade, f"custo{i}": v.preco_custo,
+                       f"encomenda{i}": v.disponivel_encomenda, f"foto{i}": url_por_indice.get(v.foto)})
+    try:
+        db.execute(text(f"""
+            INSERT INTO estoque_variacoes (id_produto, cor, quantidade, preco_custo, disponivel_encomenda, url_foto)
+            VALUES {", ".join(linhas)}
+        """), params)
+        criadas = db.execute(text("SELECT id, cor FROM estoque_variacoes WHERE id_produto = :id_produto ORDER BY cor"), params).fetchall()
+        if fotos_pendentes:
+            id_por_cor = {row.cor.lower(): row.id for row in criadas}
+            for v in novas:
+                if v.foto is not None:
+                    # A mesma foto pode servir várias variações: cada agendamento lê-a do início
+                    fotos[v.foto].file.seek(0)
+                    tarefas_imagens.agendar_envio(db, id_por_cor[v.cor.lower()], fotos[v.foto].file, fotos[v.foto].filename)
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        armazenamento_imagens.apagar_varias(urls, db)
+        raise HTTPException(status_code=400, detail="Não foi possível criar as variações. Verifique se o ID do produto é válido ou se alguma cor já existe para este produto.")
+    except Exception as e:
+        db.rollback()
+        armazenamento_imagens.apagar_varias(urls, db)
+        raise HTTPException(status_code=500, detail=f"Erro ao criar variações: {e}")
+
+    eventos_catalogo.variacoes_criadas(db, id_produto)
+    if fotos_pendentes:
+        tarefas_imagens.acordar()
+    cores_criadas = set(cores)
+    return {
+        "mensagem": f"{len(novas)} variações criadas com sucesso.",
+        "variacoes": [{"id": row.id, "cor": row.cor} for row in criadas if row.cor.lower() in cores_criadas],
+        "fotos_pendentes": fotos_pendentes,
+    }
+
+def _apagar_se_nao_usada(db: Session, url: Optional[str]):
+    # Com nomes por hash do conteúdo, a mesma foto pode estar noutra variação
+    try:
+        if not armazenamento_imagens.imagem_em_uso(db, url):
+            armazenamento_imagens.armazenamento.apagar(url)
+    except Exception as e:
+        print(f"Aviso: não foi possível apagar a imagem {url}: {e}")
+
 @router.put("/{variacao_id}", response_model=dict)
 def atualizar_variacao_estoque(variacao_id: int, cor: str = Form(...), disponivel_encomenda: bool = Form(...), foto: Optional[UploadFile] = File(None), db: Session = Depends(get_db), current_user: dict = Depends(seguranca.get_current_admin_user)):
     # NOTA: A quantidade e o preço de custo não são editados aqui diretamente.
@@ -103,17 +201,10 @@ def atualizar_variacao_estoque(variacao_id: int, cor: str = Form(...), disponive
         raise HTTPException(status_code=404, detail="Variação de estoque não encontrada.")
     url_foto_antiga, id_produto = variacao_existente
     url_foto_final = url_foto_antiga
-    if foto and foto.filename:
-        if url_foto_antiga and "cloudinary" in url_foto_antiga:
-            try:
-                public_id_with_folder = "/".join(url_foto_antiga.split("/")[-2:])
-                public_id = os.path.splitext(public_id_with_folder)[0]
-                cloudinary.uploader.destroy(public_id)
-            except Exception as e:
-                print(f"Aviso: não foi possível apagar a imagem antiga do Cloudinary: {e}")
+    foto_pendente = bool(foto and foto.filename) and tarefas_imagens.ATIVO
+    if foto and foto.filename and not foto_pendente:
         try:
-            upload_result = cloudinary.uploader.upload(foto.file, folder="catalogo_api")
-            url_foto_final = upload_result.get("secure_url")
+            url_foto_final = armazenamento_imagens.armazenamento.enviar(foto.file, foto.filename)
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Erro ao fazer upload da nova imagem: {e}")
     try:
@@ -122,8 +213,16 @@ def atualizar_variacao_estoque(variacao_id: int, cor: str = Form(...), disponive
             WHERE id = :id
         """)
         db.execute(query, {"cor": cor.strip(), "disponivel_encomenda": disponivel_encomenda, "url_foto": url_foto_final, "id": variacao_id})
+        if foto_pendente:
+            # A foto atual continua visível até a nova estar disponível; só então é apagada
+            tarefas_imagens.agendar_envio(db, variacao_id, foto.file, foto.filename, url_anterior=url_foto_antiga)
         db.commit()
-        return {"mensagem": "Variação de estoque atualizada com sucesso."}
+        eventos_catalogo.variacao_alterada(db, variacao_id, id_produto)
+        if foto_pendente:
+            tarefas_imagens.acordar()
+        elif url_foto_final != url_foto_antiga:
+            _apagar_se_nao_usada(db, url_foto_antiga)
+        return {"mensagem": "Variação de estoque atualizada com sucesso.", "foto_pendente": foto_pendente}
     except IntegrityError:
         db.rollback()
         raise HTTPException(status_code=400, detail="Já existe uma variação com esta cor para este produto.")
@@ -133,21 +232,22 @@ def atualizar_variacao_estoque(variacao_id: int, cor: str = Form(...), disponive
 
 @router.delete("/{variacao_id}", status_code=status.HTTP_204_NO_CONTENT)
 def deletar_variacao_estoque(variacao_id: int, db: Session = Depends(get_db), current_user: dict = Depends(seguranca.get_current_admin_user)):
-    variacao = db.execute(text("SELECT url_foto FROM estoque_variacoes WHERE id = :id"), {"id": variacao_id}).first()
+    variacao = db.execute(text("SELECT url_foto, id_produto FROM estoque_variacoes WHERE id = :id"), {"id": variacao_id}).first()
     if not variacao:
         raise HTTPException(status_code=404, detail="Variação de estoque não encontrada.")
-    url_foto_para_apagar = variacao[0]
+    url_foto_para_apagar, id_produto = variacao
     try:
         query = text("DELETE FROM estoque_variacoes WHERE id = :id")
         db.execute(query, {"id": variacao_id})
+        if tarefas_imagens.ATIVO:
+            tarefas_imagens.cancelar_envios(db, variacao_id)
+            tarefas_imagens.agendar_remocao(db, url_foto_para_apagar)
         db.commit()
-        if url_foto_para_apagar and "cloudinary" in url_foto_para_apagar:
-            try:
-                public_id_with_folder = "/".join(url_foto_para_apagar.split("/")[-2:])
-                public_id = os.path.splitext(public_id_with_folder)[0]
-                cloudinary.uploader.destroy(public_id)
-            except Exception as e:
-                print(f"Aviso: não foi possível apagar a imagem do Cloudinary: {e}")
+        eventos_catalogo.variacao_removida(variacao_id, id_produto)
+        if tarefas_imagens.ATIVO:
+            tarefas_imagens.acordar()
+            return
+        _apagar_se_nao_usada(db, url_foto_para_apagar)
         return
     except Exception as e:
         db.rollback()
@@ -158,51 +258,122 @@ def registrar_compra_estoque(
     variacao_id: int,
     compra: schemas.CompraEstoque,
     db: Session = Depends(get_db),
-    current_user: dict = Depends(seguranca.get_current_user)
+    current_user: dict = Depends(seguranca.get_current_user),
+    idem: idempotencia.PedidoIdempotente = Depends(idempotencia.pedido_idempotente)
 ):
     """
     Registra a entrada de novos itens no estoque (compra), recalculando o preço de custo médio ponderado.
     """
+    if idem.resposta:
+        return idem.resposta
     try:
-        # Bloqueia a linha para evitar condições de corrida
-        variacao_query = text("SELECT quantidade, preco_custo FROM estoque_variacoes WHERE id = :id FOR UPDATE")
-        variacao_atual = db.execute(variacao_query, {"id": variacao_id}).first()
+        # Converte o custo da compra (float) para Decimal para precisão
+        custo_unitario_compra = Decimal(str(compra.custo_unitario))
+        nova_qtd_total, novo_custo_medio = servico_estoque.registar_compra(
+            db, variacao_id, compra.quantidade, custo_unitario_compra, current_user['id'])
+        resultado = {"mensagem": "Compra registrada e estoque atualizado com sucesso.", "nova_quantidade": nova_qtd_total, "novo_custo_medio": round(float(novo_custo_medio), 2)}
+        idem.registar(db, resultado)
+        db.commit()
+        eventos_catalogo.estoque_alterado(variacao_id, nova_qtd_total, compra.quantidade)
+        return resultado
 
-        if not variacao_atual:
-            raise HTTPException(status_code=404, detail="Variação de estoque não encontrada.")
+    except HTTPException as http_exc:
+        db.rollback()
+        raise http_exc
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"Ocorreu um erro interno: {e}")
 
-        qtd_antiga, custo_antigo = variacao_atual
-        qtd_antiga = qtd_antiga or 0
-        # Garante que o custo antigo seja um Decimal, mesmo que seja nulo no banco
-        custo_antigo = custo_antigo or Decimal('0.00')
+# Limite de linhas por ficheiro de compras em lote
+MAX_LINHAS_COMPRA = 5000
 
-        # Converte o custo da compra (float) para Decimal para precisão
-        custo_unitario_compra = Decimal(str(compra.custo_unitario))
+def _ler_ficheiro_compras(conteudo: bytes) -> Tuple[list, list]:
+    """
+    Lê um ficheiro CSV (cabeçalho variacao_id,quantidade,custo_unitario; separador ',' ou ';'
+    com vírgula decimal) ou JSON lines. Devolve ([(linha, variacao_id, quantidade, custo)], [erros]).
+    """
+    try:
+        texto = conteudo.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="O ficheiro deve estar codificado em UTF-8.")
+    linhas = texto.splitlines()
+    primeira = next((l.strip() for l in linhas if l.strip()), "")
+    if not primeira:
+        raise HTTPException(status_code=400, detail="O ficheiro está vazio.")
 
-        # Calcula o novo custo médio ponderado usando Decimal
-        valor_estoque_antigo = Decimal(qtd_antiga) * custo_antigo
-        valor_compra_nova = Decimal(compra.quantidade) * custo_unitario_compra
-        
-        nova_qtd_total = qtd_antiga + compra.quantidade
-        novo_valor_total_estoque = valor_estoque_antigo + valor_compra_nova
-        
-        novo_custo_medio = novo_valor_total_estoque / Decimal(nova_qtd_total) if nova_qtd_total > 0 else Decimal('0.00')
+    registos = []
+    if primeira.startswith("{"):
+        for numero, linha in enumerate(linhas, start=1):
+            if linha.strip():
+                try:
+                    registos.append((numero, json.loads(linha)))
+                except json.JSONDecodeError:
+                    registos.append((numero, None))
+    else:
+        separador = ";" if ";" in primeira else ","
+        leitor = csv.DictReader(linhas, delimiter=separador)
+        em_falta = {"variacao_id", "quantidade", "custo_unitario"} - {c.strip() for c in leitor.fieldnames or []}
+        if em_falta:
+            raise HTTPException(status_code=400, detail=f"Colunas em falta no CSV: {', '.join(sorted(em_falta))}.")
+        for dados in leitor:
+            dados = {k.strip(): (v or "").strip() for k, v in dados.items() if k is not None}
+            if separador == ";":
+                dados["custo_unitario"] = dados["custo_unitario"].replace(",", ".")
+            registos.append((leitor.line_num, dados))
+    if len(registos) > MAX_LINHAS_COMPRA:
+        raise HTTPException(status_code=400, detail=f"O ficheiro excede {MAX_LINHAS_COMPRA} linhas.")
 
-        # Atualiza a variação do estoque com os novos valores
-        update_query = text("UPDATE estoque_variacoes SET quantidade = :qtd, preco_custo = :custo WHERE id = :id")
-        db.execute(update_query, {"qtd": nova_qtd_total, "custo": novo_custo_medio, "id": variacao_id})
+    compras, erros = [], []
+    for numero, dados in registos:
+        if not isinstance(dados, dict):
+            erros.append({"linha": numero, "erro": "Linha JSON inválida."})
+            continue
+        try:
+            item = schemas.ItemCompraLote(**dados)
+        except ValidationError as e:
+            erro = e.errors()[0]
+            campo = ".".join(str(parte) for parte in erro["loc"])
+            erros.append({"linha": numero, "erro": f"{campo}: {erro['msg']}" if campo else erro["msg"]})
+            continue
+        compras.append((numero, item.variacao_id, item.quantidade, item.custo_unitario))
+    return compras, erros
 
-        # Registra no histórico o custo unitário desta compra específica
-        user_id = db.execute(text("SELECT id FROM usuarios WHERE username = :username"), {"username": current_user['username']}).scalar()
-        history_query = text("""
-            INSERT INTO historico_estoque (id_variacao_estoque, id_usuario, tipo_movimento, quantidade_alterada, nova_quantidade_estoque, preco_custo_momento)
-            VALUES (:id_variacao, :id_usuario, 'incremento', :qtd_alterada, :nova_qtd, :custo_compra)
-        """)
-        db.execute(history_query, {"id_variacao": variacao_id, "id_usuario": user_id, "qtd_alterada": compra.quantidade, "nova_qtd": nova_qtd_total, "custo_compra": custo_unitario_compra})
+@router.post("/compras/lote", response_model=dict, dependencies=[Depends(seguranca.get_current_admin_user)])
+def registrar_compras_lote(
+    ficheiro: UploadFile = File(...),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(seguranca.get_current_user),
+    idem: idempotencia.PedidoIdempotente = Depends(idempotencia.pedido_idempotente)
+):
+    """
+    Regista as compras de uma remessa de uma só vez, a partir de um ficheiro CSV ou JSON lines
+    com (variacao_id, quantidade, custo_unitario). Os custos médios são calculados num só passo,
+    as variações atualizadas em lote e o histórico inserido de uma vez, numa única transação.
+    As linhas válidas são registadas; as restantes são devolvidas em "erros" com o número da linha.
+    """
+    conteudo = ficheiro.file.read()
+    idem.definir_conteudo(conteudo)
+    if idem.resposta:
+        return idem.resposta
+    compras, erros = _ler_ficheiro_compras(conteudo)
+    if not compras:
+        raise HTTPException(status_code=400, detail={"mensagem": "Nenhuma linha válida no ficheiro.", "erros": erros})
 
+    try:
+        variacoes, erros_variacao = servico_estoque.registar_compras(db, compras, current_user['id'])
+        erros = sorted(erros + erros_variacao, key=lambda erro: erro["linha"])
+        if not variacoes:
+            db.rollback()
+            raise HTTPException(status_code=400, detail={"mensagem": "Nenhuma linha válida no ficheiro.", "erros": erros})
+        resultado = {
+            "mensagem": "Compras registradas e estoque atualizado com sucesso.",
+            "linhas_registradas": len(compras) - len(erros_variacao),
+            "variacoes": [{"variacao_id": variacao_id, "nova_quantidade": quantidade, "novo_custo_medio": round(float(custo), 2)}
+                          for variacao_id, (quantidade, custo) in variacoes.items()],
+            "erros": erros,
+        }
+        idem.registar(db, resultado)
         db.commit()
-        return {"mensagem": "Compra registrada e estoque atualizado com sucesso.", "nova_quantidade": nova_qtd_total, "novo_custo_medio": round(float(novo_custo_medio), 2)}
-
     except HTTPException as http_exc:
         db.rollback()
         raise http_exc
@@ -210,76 +381,79 @@ def registrar_compra_estoque(
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Ocorreu um erro interno: {e}")
 
+    compradas = {}
+    for _, variacao_id, quantidade, _ in compras:
+        compradas[variacao_id] = compradas.get(variacao_id, 0) + quantidade
+    for variacao_id, (quantidade, _) in variacoes.items():
+        eventos_catalogo.estoque_alterado(variacao_id, quantidade, compradas[variacao_id])
+    return resultado
+
+@router.post("/checkout", response_model=dict, tags=["PDV"])
+def finalizar_venda_pdv(
+    checkout: schemas.CheckoutPDV,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(seguranca.get_current_user),
+    idem: idempotencia.PedidoIdempotente = Depends(idempotencia.pedido_idempotente)
+):
+    """
+    Regista a venda de um carrinho inteiro numa única transação: valida o estoque de todos
+    os itens, atualiza-os num só UPDATE e insere o histórico de uma vez.
+    Envie um cabeçalho Idempotency-Key para poder repetir o pedido sem duplicar a venda.
+    """
+    if idem.resposta:
+        return idem.resposta
+    # Agrupa linhas repetidas da mesma variação
+    quantidades = {}
+    for item in checkout.itens:
+        quantidades[item.variacao_id] = quantidades.get(item.variacao_id, 0) + item.quantidade
+
+    try:
+        novas_quantidades, total = servico_estoque.vender_carrinho(db, quantidades, current_user['id'])
+        resultado = {
+            "mensagem": "Venda registrada com sucesso.",
+            "total": round(float(total), 2),
+            "itens": [{"variacao_id": variacao_id, "quantidade": quantidades[variacao_id], "nova_quantidade": nova_quantidade} for variacao_id, nova_quantidade in novas_quantidades.items()],
+        }
+        idem.registar(db, resultado)
+        db.commit()
+    except HTTPException as http_exc:
+        db.rollback()
+        raise http_exc
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"Ocorreu um erro interno no servidor: {e}")
+
+    for variacao_id, nova_quantidade in novas_quantidades.items():
+        eventos_catalogo.estoque_alterado(variacao_id, nova_quantidade, -quantidades[variacao_id])
+    return resultado
+
 @router.post("/{variacao_id}/{acao}", response_model=dict, tags=["PDV"])
 def atualizar_estoque_pdv(
     variacao_id: int,
     acao: Literal['incrementar', 'decrementar'],
     db: Session = Depends(get_db),
-    current_user: dict = Depends(seguranca.get_current_user)
+    current_user: dict = Depends(seguranca.get_current_user),
+    idem: idempotencia.PedidoIdempotente = Depends(idempotencia.pedido_idempotente)
 ):
     """
     Incrementa ou decrementa o estoque de uma variação a partir do PDV,
     registando o histórico da transação com os preços do momento para vendas.
     """
+    if idem.resposta:
+        return idem.resposta
     try:
-        # 1. Obter dados da variação e do produto, e bloquear a linha para atualização (FOR UPDATE)
-        # para evitar condições de corrida em vendas simultâneas.
-        variacao_query = text("""
-            SELECT ev.quantidade, ev.preco_custo, p.preco_venda
-            FROM estoque_variacoes ev
-            JOIN produtos p ON ev.id_produto = p.id
-            WHERE ev.id = :id FOR UPDATE
-        """)
-        variacao = db.execute(variacao_query, {"id": variacao_id}).first()
-
-        if not variacao:
-            raise HTTPException(status_code=404, detail="Variação de estoque não encontrada.")
-
-        quantidade_atual, preco_custo_atual, preco_venda_atual = variacao
-        quantidade_alterada = 1  # PDV altera de 1 em 1
-        
-        if acao == 'decrementar':
-            if quantidade_atual < quantidade_alterada:
-                raise HTTPException(status_code=400, detail="Estoque insuficiente para realizar a venda.")
-            nova_quantidade = quantidade_atual - quantidade_alterada
-            tipo_movimento = 'decremento'
-            mensagem = "Venda registrada com sucesso."
-            preco_venda_transacao = preco_venda_atual
-            preco_custo_transacao = preco_custo_atual
-        else:  # incrementar
-            nova_quantidade = quantidade_atual + quantidade_alterada
-            tipo_movimento = 'incremento'
-            mensagem = "Reposição de estoque registrada com sucesso."
-            preco_venda_transacao = None
-            preco_custo_transacao = None
-
-        # 2. Atualizar a quantidade no estoque
-        db.execute(text("UPDATE estoque_variacoes SET quantidade = :nova_quantidade WHERE id = :id"), 
-                   {"nova_quantidade": nova_quantidade, "id": variacao_id})
-
-        # 3. Obter ID do usuário
-        user_id = db.execute(text("SELECT id FROM usuarios WHERE username = :username"), 
-                             {"username": current_user['username']}).scalar()
-        if not user_id:
-            raise HTTPException(status_code=404, detail="Usuário da sessão não encontrado.")
-
-        # 4. Inserir no histórico com os preços do momento
-        history_query = text("""
-            INSERT INTO historico_estoque (id_variacao_estoque, id_usuario, tipo_movimento, quantidade_alterada, nova_quantidade_estoque, preco_venda_momento, preco_custo_momento)
-            VALUES (:id_variacao, :id_usuario, :tipo_movimento, :qtd_alterada, :nova_qtd, :preco_venda, :preco_custo)
-        """)
-        db.execute(history_query, {
-            "id_variacao": variacao_id, "id_usuario": user_id, "tipo_movimento": tipo_movimento,
-            "qtd_alterada": quantidade_alterada, "nova_qtd": nova_quantidade,
-            "preco_venda": preco_venda_transacao, "preco_custo": preco_custo_transacao,
-        })
-        
+        # PDV altera de 1 em 1; a venda só é aplicada se ainda houver estoque
+        quantidade_alterada = -1 if acao == 'decrementar' else 1
+        nova_quantidade = servico_estoque.registar_movimento(db, variacao_id, quantidade_alterada, current_user['id'])
+        mensagem = "Venda registrada com sucesso." if acao == 'decrementar' else "Reposição de estoque registrada com sucesso."
+        resultado = {"mensagem": mensagem, "nova_quantidade": nova_quantidade}
+        idem.registar(db, resultado)
         db.commit()
-        
-        return {"mensagem": mensagem, "nova_quantidade": nova_quantidade}
+        eventos_catalogo.estoque_alterado(variacao_id, nova_quantidade, quantidade_alterada)
+        return resultado
     except HTTPException as http_exc:
         db.rollback()
         raise http_exc # Re-lança exceções HTTP para o FastAPI tratar
     except Exception as e:
         db.rollback()
-        raise HTTPException(status_code=500, detail=f"Ocorreu um erro interno no servidor: {e}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Ocorreu um erro interno no servidor: {e}")
@@ -1,13 +1,14 @@
 # routers/fornecedores.py
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Response
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 from sqlalchemy.exc import IntegrityError
-from typing import List
+from typing import List, Optional
 
 import schemas
 import seguranca
+import paginacao
 from database import get_db
 
 router = APIRouter(
@@ -18,10 +19,18 @@ router = APIRouter(
 )
 
 @router.get("/", response_model=List[schemas.FornecedorResponse])
-def listar_fornecedores(db: Session = Depends(get_db)):
+def listar_fornecedores(response: Response, limit: int = paginacao.parametro_limite(), cursor: Optional[str] = paginacao.parametro_cursor(), db: Session = Depends(get_db)):
+    apos = paginacao.decodificar_cursor(cursor, 2)
     try:
-        query = text("SELECT id, nome, contato_telefone, contato_email FROM fornecedores ORDER BY nome")
-        resultado = db.execute(query).fetchall()
+        condicao, params = paginacao.condicao_keyset(["nome", "id"], apos)
+        query = text(f"""
+            SELECT id, nome, contato_telefone, contato_email FROM fornecedores
+            {paginacao.montar_where([condicao])}
+            ORDER BY nome, id
+            LIMIT :limite
+        """)
+        resultado = db.execute(query, {**params, "limite": limit + 1}).fetchall()
+        resultado = paginacao.fechar_pagina(response, resultado, limit, lambda row: (row.nome, row.id))
         fornecedores = [schemas.FornecedorResponse(id=row[0], nome=row[1], contato_telefone=row[2], contato_email=row[3]) for row in resultado]
         return fornecedores
     except Exception as e:
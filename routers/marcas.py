@@ -1,13 +1,15 @@
 # routers/marcas.py
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Response
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 from sqlalchemy.exc import IntegrityError
-from typing import List
+from typing import List, Optional
 
 import schemas
 import seguranca
+import paginacao
+import eventos_catalogo
 from database import get_db
 
 router = APIRouter(
@@ -18,10 +20,13 @@ router = APIRouter(
 )
 
 @router.get("/", response_model=List[schemas.MarcaResponse])
-def listar_marcas(db: Session = Depends(get_db)):
+def listar_marcas(response: Response, limit: int = paginacao.parametro_limite(), cursor: Optional[str] = paginacao.parametro_cursor(), db: Session = Depends(get_db)):
+    apos = paginacao.decodificar_cursor(cursor, 2)
     try:
-        query = text("SELECT id, nome FROM marcas ORDER BY nome")
-        resultado = db.execute(query).fetchall()
+        condicao, params = paginacao.condicao_keyset(["nome", "id"], apos)
+        query = text(f"SELECT id, nome FROM marcas {paginacao.montar_where([condicao])} ORDER BY nome, id LIMIT :limite")
+        resultado = db.execute(query, {**params, "limite": limit + 1}).fetchall()
+        resultado = paginacao.fechar_pagina(response, resultado, limit, lambda row: (row.nome, row.id))
         marcas = [schemas.MarcaResponse(id=row[0], nome=row[1]) for row in resultado]
         return marcas
     except Exception as e:
@@ -49,6 +54,7 @@ def atualizar_marca(marca_id: int, marca: schemas.MarcaBase, db: Session = Depen
         if resultado.rowcount == 0:
             raise HTTPException(status_code=404, detail="Marca não encontrada.")
         db.commit()
+        eventos_catalogo.marca_alterada(db, marca_id)
         return {"mensagem": f"Marca ID {marca_id} atualizada para '{marca.nome}'."}
     except IntegrityError:
         db.rollback()
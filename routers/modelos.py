@@ -1,13 +1,15 @@
 # routers/modelos.py
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Response
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 from sqlalchemy.exc import IntegrityError
-from typing import List
+from typing import List, Optional
 
 import schemas
 import seguranca
+import paginacao
+import eventos_catalogo
 from database import get_db
 
 router = APIRouter(
@@ -18,15 +20,27 @@ router = APIRouter(
 )
 
 @router.get("/", response_model=List[schemas.ModeloResponse])
-def listar_modelos(db: Session = Depends(get_db)):
+def listar_modelos(
+    response: Response,
+    id_marca: Optional[int] = None,
+    limit: int = paginacao.parametro_limite(),
+    cursor: Optional[str] = paginacao.parametro_cursor(),
+    db: Session = Depends(get_db)
+):
+    apos = paginacao.decodificar_cursor(cursor, 3)
     try:
-        query = text("""
+        condicao, params = paginacao.condicao_keyset(["b.nome", "m.nome_modelo", "m.id"], apos)
+        filtro_marca = "m.id_marca = :id_marca" if id_marca is not None else ""
+        query = text(f"""
             SELECT m.id, m.nome_modelo, b.nome as marca_nome
             FROM modelos_celular AS m
             JOIN marcas AS b ON m.id_marca = b.id
-            ORDER BY b.nome, m.nome_modelo
+            {paginacao.montar_where([filtro_marca, condicao])}
+            ORDER BY b.nome, m.nome_modelo, m.id
+            LIMIT :limite
         """)
-        resultado = db.execute(query).fetchall()
+        resultado = db.execute(query, {**params, "id_marca": id_marca, "limite": limit + 1}).fetchall()
+        resultado = paginacao.fechar_pagina(response, resultado, limit, lambda row: (row.marca_nome, row.nome_modelo, row.id))
         modelos = [schemas.ModeloResponse(id=row[0], nome_modelo=row[1], marca_nome=row[2]) for row in resultado]
         return modelos
     except Exception as e:
@@ -38,6 +52,7 @@ def criar_modelo(modelo: schemas.ModeloBase, db: Session = Depends(get_db)):
         query = text("INSERT INTO modelos_celular (nome_modelo, id_marca) VALUES (:nome_modelo, :id_marca)")
         db.execute(query, modelo.model_dump())
         db.commit()
+        eventos_catalogo.modelo_criado(db, modelo.id_marca)
         return {"mensagem": f"Modelo '{modelo.nome_modelo}' criado com sucesso."}
     except IntegrityError:
         db.rollback()
@@ -56,6 +71,7 @@ def atualizar_modelo(modelo_id: int, modelo: schemas.ModeloBase, db: Session = D
         if resultado.rowcount == 0:
             raise HTTPException(status_code=404, detail="Modelo não encontrado.")
         db.commit()
+        eventos_catalogo.modelo_alterado(db, modelo_id)
         return {"mensagem": f"Modelo ID {modelo_id} atualizado com sucesso."}
     except IntegrityError:
         db.rollback()
@@ -72,6 +88,7 @@ def deletar_modelo(modelo_id: int, db: Session = Depends(get_db)):
         if resultado.rowcount == 0:
             raise HTTPException(status_code=404, detail="Modelo não encontrado.")
         db.commit()
+        eventos_catalogo.modelo_removido(modelo_id)
         return
     except IntegrityError:
         db.rollback()
@@ -1,13 +1,15 @@
 # routers/produtos.py
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Response
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 from sqlalchemy.exc import IntegrityError
-from typing import List
+from typing import List, Optional
 
 import schemas
 import seguranca
+import paginacao
+import eventos_catalogo
 from database import get_db
 
 router = APIRouter(
@@ -18,16 +20,37 @@ router = APIRouter(
 )
 
 @router.get("/", response_model=List[schemas.ProdutoResponse])
-def listar_produtos(db: Session = Depends(get_db)):
+def listar_produtos(
+    response: Response,
+    id_modelo_celular: Optional[int] = None,
+    tipo: Optional[str] = None,
+    em_estoque: bool = False,
+    limit: int = paginacao.parametro_limite(),
+    cursor: Optional[str] = paginacao.parametro_cursor(),
+    db: Session = Depends(get_db)
+):
+    apos = paginacao.decodificar_cursor(cursor, 4)
     try:
-        query = text("""
-            SELECT p.id, p.nome, p.tipo, p.material, p.preco_venda, CONCAT(b.nome, ' ', m.nome_modelo) AS modelo_celular
+        condicao, params = paginacao.condicao_keyset(["b.nome", "m.nome_modelo", "p.nome", "p.id"], apos)
+        filtros = [
+            "p.id_modelo_celular = :id_modelo_celular" if id_modelo_celular is not None else "",
+            "p.tipo = :tipo" if tipo else "",
+            "EXISTS (SELECT 1 FROM estoque_variacoes ev WHERE ev.id_produto = p.id AND ev.quantidade > 0)" if em_estoque else "",
+            condicao,
+        ]
+        query = text(f"""
+            SELECT p.id, p.nome, p.tipo, p.material, p.preco_venda, CONCAT(b.nome, ' ', m.nome_modelo) AS modelo_celular,
+                   b.nome AS marca_nome, m.nome_modelo
             FROM produtos AS p
             JOIN modelos_celular AS m ON p.id_modelo_celular = m.id
             JOIN marcas AS b ON m.id_marca = b.id
-            ORDER BY modelo_celular, p.nome
+            {paginacao.montar_where(filtros)}
+            ORDER BY b.nome, m.nome_modelo, p.nome, p.id
+            LIMIT :limite
         """)
-        resultado = db.execute(query).fetchall()
+        params.update({"id_modelo_celular": id_modelo_celular, "tipo": tipo, "limite": limit + 1})
+        resultado = db.execute(query, params).fetchall()
+        resultado = paginacao.fechar_pagina(response, resultado, limit, lambda row: (row.marca_nome, row.nome_modelo, row.nome, row.id))
         produtos = [schemas.ProdutoResponse(id=row[0], nome=row[1], tipo=row[2], material=row[3], preco_venda=row[4], modelo_celular=row[5]) for row in resultado]
         return produtos
     except Exception as e:
@@ -72,6 +95,7 @@ def atualizar_produto(produto_id: int, produto: schemas.ProdutoBase, db: Session
         if resultado.rowcount == 0:
             raise HTTPException(status_code=404, detail="Produto não encontrado.")
         db.commit()
+        eventos_catalogo.produto_alterado(db, produto_id)
         return {"mensagem": f"Produto ID {produto_id} atualizado com sucesso."}
     except IntegrityError:
         db.rollback()
@@ -88,6 +112,7 @@ def deletar_produto(produto_id: int, db: Session = Depends(get_db)):
         if resultado.rowcount == 0:
             raise HTTPException(status_code=404, detail="Produto não encontrado.")
         db.commit()
+        eventos_catalogo.produto_removido(produto_id)
         return
     except IntegrityError:
         db.rollback()
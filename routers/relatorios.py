@@ -1,14 +1,23 @@
 # routers/relatorios.py
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import text
-from typing import List, Optional
+from typing import List, Literal, Optional
 from datetime import date, datetime, time, timedelta
+import csv
+import io
+import json
+import os
+import asyncio
 
 import schemas
 import seguranca
-from database import get_db, get_engine
+import paginacao
+import vendas_diarias
+from cache_leitura import CacheLeitura
+from database import get_db, get_db_leitura, ler_linhas, get_engine, sessao_leitura
 
 router = APIRouter(
     prefix="/relatorios",
@@ -17,144 +26,339 @@ router = APIRouter(
     responses={404: {"description": "Não encontrado"}},
 )
 
-@router.get("/movimentacoes-pdv", response_model=List[schemas.RelatorioMovimentacaoResponse])
-def get_relatorio_movimentacoes_pdv(
-    data_inicio: Optional[date] = None,
-    data_fim: Optional[date] = None,
-    db: Session = Depends(get_db)
-):
-    # Define o período padrão para os últimos 7 dias se não for especificado
+# Máximo de pontos numa série de vendas (ex.: ~3 anos por dia)
+MAX_PONTOS_SERIE = 1100
+
+def _periodo(data_inicio: Optional[date], data_fim: Optional[date]):
+    """Período do dashboard: por omissão, os últimos 7 dias até hoje."""
     if data_fim is None:
         data_fim = date.today()
     if data_inicio is None:
         data_inicio = data_fim - timedelta(days=6)
+    if data_inicio > data_fim:
+        raise HTTPException(status_code=400, detail="data_inicio tem de ser anterior ou igual a data_fim.")
+    return data_inicio, data_fim
 
-    # Combina data com tempo para criar um datetime completo para a query
-    datetime_inicio = datetime.combine(data_inicio, time.min)
-    datetime_fim = datetime.combine(data_fim, time.max)
+def _inicio_intervalo(dia: date, granularidade: str) -> date:
+    if granularidade == "semana":
+        return dia - timedelta(days=dia.weekday())  # segunda-feira, como date_trunc('week')
+    if granularidade == "mes":
+        return dia.replace(day=1)
+    return dia
 
-    query = text("""
+def _intervalos(data_inicio: date, data_fim: date, granularidade: str) -> List[date]:
+    intervalos, atual = [], _inicio_intervalo(data_inicio, granularidade)
+    while atual <= data_fim:
+        intervalos.append(atual)
+        if granularidade == "semana":
+            atual += timedelta(days=7)
+        elif granularidade == "mes":
+            atual = date(atual.year + atual.month // 12, atual.month % 12 + 1, 1)
+        else:
+            atual += timedelta(days=1)
+    return intervalos
+
+def _expressao_intervalo(granularidade: str, db_type: str) -> str:
+    if granularidade == "dia":
+        return "dia"
+    if db_type == "postgresql":
+        return "CAST(date_trunc('week', dia) AS DATE)" if granularidade == "semana" else "CAST(date_trunc('month', dia) AS DATE)"
+    if granularidade == "semana":
+        return "DATE_SUB(dia, INTERVAL WEEKDAY(dia) DAY)"
+    return "DATE_SUB(dia, INTERVAL DAYOFMONTH(dia) - 1 DAY)"
+
+def _como_data(valor) -> date:
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, str):
+        return date.fromisoformat(valor[:10])
+    return valor
+
+# Exportação em streaming: linhas lidas com um cursor do lado do servidor e formatadas em
+# blocos, por isso a memória não depende do tamanho do período.
+BLOCO_EXPORTACAO = 1000
+
+def query_movimentacoes(condicao_keyset: str = "", limite: bool = False):
+    """
+    Movimentações do período, da mais recente para a mais antiga (data_hora, id). A
+    quantidade anterior e a descrição do movimento são calculadas na própria query.
+    """
+    return text(f"""
         SELECT
+            h.id,
             h.data_hora,
             p.nome AS produto_nome,
             ev.cor AS cor_variacao,
             CONCAT(b.nome, ' ', m.nome_modelo) AS modelo_celular,
             u.username AS usuario,
-            h.tipo_movimento,
-            h.nova_quantidade_estoque,
-            h.quantidade_alterada
+            CASE WHEN h.tipo_movimento = 'decremento' THEN 'Venda (Decremento)' ELSE 'Reposição (Incremento)' END AS tipo_movimento,
+            CASE WHEN h.tipo_movimento = 'decremento'
+                 THEN h.nova_quantidade_estoque + h.quantidade_alterada
+                 ELSE h.nova_quantidade_estoque - h.quantidade_alterada END AS quantidade_anterior,
+            h.nova_quantidade_estoque AS nova_quantidade
         FROM historico_estoque h
         JOIN usuarios u ON h.id_usuario = u.id
         JOIN estoque_variacoes ev ON h.id_variacao_estoque = ev.id
         JOIN produtos p ON ev.id_produto = p.id
         JOIN modelos_celular m ON p.id_modelo_celular = m.id
         JOIN marcas b ON m.id_marca = b.id
-        WHERE h.data_hora BETWEEN :inicio AND :fim
-        ORDER BY h.data_hora DESC
+        WHERE h.data_hora >= :inicio AND h.data_hora < :fim {"AND " + condicao_keyset if condicao_keyset else ""}
+        ORDER BY h.data_hora DESC, h.id DESC
+        {"LIMIT :limite" if limite else ""}
     """)
 
+COLUNAS_EXPORTACAO = ["data_hora", "produto_nome", "cor_variacao", "modelo_celular", "usuario",
+                      "tipo_movimento", "quantidade_anterior", "nova_quantidade"]
+
+def _exportar_movimentacoes(params: dict, formato: str):
+    """
+    Gerador das linhas exportadas. Usa uma conexão própria (a sessão do pedido já foi
+    fechada quando o corpo é enviado) com stream_results: o psycopg2 usa um cursor com nome
+    e o driver MySQL lê sem buffer; as linhas chegam em blocos de BLOCO_EXPORTACAO.
+    """
+    with get_engine().connect() as conexao:
+        resultado = conexao.execution_options(stream_results=True, yield_per=BLOCO_EXPORTACAO).execute(query_movimentacoes(), params)
+        if formato == "csv":
+            # BOM para o Excel reconhecer UTF-8; ';' é o separador esperado em pt-BR
+            buffer = io.StringIO()
+            escritor = csv.writer(buffer, delimiter=";", lineterminator="\r\n")
+            escritor.writerow(COLUNAS_EXPORTACAO)
+            yield ("\ufeff" + buffer.getvalue()).encode()
+        for bloco in resultado.partitions():
+            if formato == "csv":
+                buffer = io.StringIO()
+                csv.writer(buffer, delimiter=";", lineterminator="\r\n").writerows(
+                    (row.data_hora.isoformat(sep=" ", timespec="seconds"), *row[2:]) for row in bloco)
+                yield buffer.getvalue().encode()
+            else:
+                yield "".join(
+                    json.dumps({"data_hora": row.data_hora.isoformat(timespec="seconds"),
+                                **dict(zip(COLUNAS_EXPORTACAO[1:], row[2:]))}, ensure_ascii=False) + "\n"
+                    for row in bloco).encode()
+
+@router.get("/movimentacoes-pdv", response_model=List[schemas.RelatorioMovimentacaoResponse])
+def get_relatorio_movimentacoes_pdv(
+    response: Response,
+    data_inicio: Optional[date] = None,
+    data_fim: Optional[date] = None,
+    formato: Literal["json", "csv", "ndjson"] = "json",
+    limit: int = paginacao.parametro_limite(),
+    cursor: Optional[str] = paginacao.parametro_cursor(),
+    db: Session = Depends(get_db)
+):
+    """
+    Movimentações de estoque do período (por omissão, os últimos 7 dias), da mais recente
+    para a mais antiga. Em JSON, paginado por keyset (cursor em X-Next-Cursor); com
+    formato=csv ou ndjson, o período inteiro é enviado em streaming.
+    """
+    # Define o período padrão para os últimos 7 dias se não for especificado
+    if data_fim is None:
+        data_fim = date.today()
+    if data_inicio is None:
+        data_inicio = data_fim - timedelta(days=6)
+
+    # [início do primeiro dia, início do dia seguinte ao último): comparação direta com data_hora
+    params = {"inicio": datetime.combine(data_inicio, time.min), "fim": datetime.combine(data_fim + timedelta(days=1), time.min)}
+
+    if formato != "json":
+        db.close()  # a exportação usa a sua própria conexão
+        nome = f"movimentacoes_{data_inicio.isoformat()}_{data_fim.isoformat()}.{formato}"
+        media_type = "text/csv; charset=utf-8" if formato == "csv" else "application/x-ndjson"
+        return StreamingResponse(_exportar_movimentacoes(params, formato), media_type=media_type,
+                                 headers={"Content-Disposition": f'attachment; filename="{nome}"'})
+
+    apos = paginacao.decodificar_cursor(cursor, 2)
+    if apos is not None:
+        try:
+            apos = [datetime.fromisoformat(apos[0]), int(apos[1])]
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Cursor de paginação inválido.")
+    condicao, params_keyset = paginacao.condicao_keyset(["h.data_hora", "h.id"], apos, descendente=True)
+
     try:
-        resultados = db.execute(query, {"inicio": datetime_inicio, "fim": datetime_fim}).fetchall()
-        relatorio = []
-        for row in resultados:
-            nova_qtd = row[6]
-            qtd_alterada = row[7]
-            tipo_mov = row[5]
-            qtd_anterior = (nova_qtd + qtd_alterada) if tipo_mov == 'decremento' else (nova_qtd - qtd_alterada)
-            relatorio.append(schemas.RelatorioMovimentacaoResponse(data_hora=row[0].strftime('%d/%m/%Y %H:%M:%S'), produto_nome=row[1], cor_variacao=row[2], modelo_celular=row[3], usuario=row[4], tipo_movimento='Venda (Decremento)' if tipo_mov == 'decremento' else 'Reposição (Incremento)', quantidade_anterior=qtd_anterior, nova_quantidade=nova_qtd))
-        return relatorio
+        resultados = db.execute(query_movimentacoes(condicao, limite=True), {**params, **params_keyset, "limite": limit + 1}).fetchall()
+        resultados = paginacao.fechar_pagina(response, resultados, limit, lambda row: (row.data_hora.isoformat(), row.id))
+        return [schemas.RelatorioMovimentacaoResponse(
+            data_hora=row.data_hora.strftime('%d/%m/%Y %H:%M:%S'), produto_nome=row.produto_nome, cor_variacao=row.cor_variacao,
+            modelo_celular=row.modelo_celular, usuario=row.usuario, tipo_movimento=row.tipo_movimento,
+            quantidade_anterior=row.quantidade_anterior, nova_quantidade=row.nova_quantidade
+        ) for row in resultados]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao gerar relatório: {e}")
 
+# --- Dashboard ---
+# Cada widget é calculado por uma função que recebe a sessão, usada pelo seu endpoint e
+# por GET /relatorios/dashboard, que junta todos num só pedido.
+
+async def _metricas_financeiras(db, data_inicio: date, data_fim: date) -> schemas.MetricasFinanceirasResponse:
+    query = text("""
+        SELECT
+            SUM(vd.faturacao) AS faturacao_total,
+            SUM(vd.faturacao - vd.custo) AS lucro_total,
+            SUM(vd.vendas) AS total_vendas
+        FROM vendas_diarias vd
+        WHERE vd.dia BETWEEN :inicio AND :fim
+    """)
+    resultado = (await ler_linhas(db, query, {"inicio": data_inicio, "fim": data_fim}))[0]
+
+    faturacao = float(resultado[0] or 0.0)
+    lucro = float(resultado[1] or 0.0)
+    vendas = int(resultado[2] or 0)
+
+    ticket_medio = faturacao / vendas if vendas > 0 else 0.0
+
+    return schemas.MetricasFinanceirasResponse(
+        faturacao_total=faturacao,
+        lucro_total=lucro,
+        total_vendas=vendas,
+        ticket_medio=ticket_medio
+    )
+
+def _intervalos_serie(data_inicio: date, data_fim: date, granularidade: str) -> List[date]:
+    intervalos = _intervalos(data_inicio, data_fim, granularidade)
+    if len(intervalos) > MAX_PONTOS_SERIE:
+        raise HTTPException(status_code=400, detail=f"Período demasiado longo para a granularidade '{granularidade}' (máximo {MAX_PONTOS_SERIE} pontos).")
+    return intervalos
+
+async def _vendas_por_intervalo(db, data_inicio: date, data_fim: date, granularidade: str,
+                                intervalos: List[date]) -> schemas.VendasDiariasResponse:
+    formato = "%m/%Y" if granularidade == "mes" else "%d/%m" if (data_inicio.year == data_fim.year) else "%d/%m/%Y"
+    labels = [d.strftime(formato) for d in intervalos]
+
+    intervalo = _expressao_intervalo(granularidade, get_engine().dialect.name)
+    query_sql = text(f"""
+        SELECT {intervalo} AS intervalo, SUM(faturacao)
+        FROM vendas_diarias
+        WHERE dia BETWEEN :inicio AND :fim
+        GROUP BY {intervalo}
+    """)
+    por_intervalo = {_como_data(row[0]): row[1] for row in await ler_linhas(db, query_sql, {"inicio": data_inicio, "fim": data_fim})}
+    faturacao_data = [float(por_intervalo.get(d) or 0.0) for d in intervalos]
+    return schemas.VendasDiariasResponse(labels=labels, data=faturacao_data)
+
+# Janelas pré-definidas do top de produtos (em dias, incluindo hoje)
+JANELAS_TOP = {"hoje": 1, "7d": 7, "30d": 30}
+
+def _janela_top(periodo: str, data_inicio: Optional[date], data_fim: Optional[date]):
+    """(inicio, fim) do top de produtos, ou (None, None) para todo o resumo."""
+    if periodo == "personalizado":
+        return _periodo(data_inicio, data_fim)
+    if periodo == "total":
+        return None, None
+    fim = date.today()
+    return fim - timedelta(days=JANELAS_TOP[periodo] - 1), fim
+
+async def _top_produtos(db, inicio: Optional[date], fim: Optional[date], ordenar: str,
+                        limite: int) -> List[schemas.TopProdutoResponse]:
+    params = {"limite": limite, "inicio": inicio, "fim": fim}
+    query = vendas_diarias.query_mais_vendidas(ordenar, desde=inicio is not None)
+    resultados = await ler_linhas(db, query, params)
+    return [schemas.TopProdutoResponse(
+        produto=f"{row.produto_nome} ({row.cor})", vendas=int(row.vendas), variacao_id=row.id_variacao_estoque,
+        unidades=int(row.unidades), faturacao=float(row.faturacao), margem=float(row.margem)
+    ) for row in resultados]
+
 @router.get("/dashboard/metricas-financeiras", response_model=schemas.MetricasFinanceirasResponse)
-def get_metricas_financeiras(db: Session = Depends(get_db)):
+async def get_metricas_financeiras(
+    data_inicio: Optional[date] = None,
+    data_fim: Optional[date] = None,
+    db = Depends(get_db_leitura)
+):
     """
-    Calcula métricas financeiras chave para os últimos 7 dias.
+    Calcula métricas financeiras chave para o período (por omissão, os últimos 7 dias).
     - Faturação Total (Receita)
     - Lucro Total
     - Total de Vendas (transações de decremento)
     - Ticket Médio
+    Lidas do resumo vendas_diarias: o custo depende do número de dias, não de vendas.
     """
-    data_fim = date.today()
-    data_inicio = data_fim - timedelta(days=6)
-    datetime_inicio = datetime.combine(data_inicio, time.min)
-    datetime_fim = datetime.combine(data_fim, time.max)
-
-    query = text("""
-        SELECT
-            SUM(h.preco_venda_momento * h.quantidade_alterada) AS faturacao_total,
-            SUM((h.preco_venda_momento - COALESCE(h.preco_custo_momento, 0)) * h.quantidade_alterada) AS lucro_total,
-            COUNT(h.id) AS total_vendas
-        FROM historico_estoque h
-        WHERE h.tipo_movimento = 'decremento'
-          AND h.data_hora BETWEEN :inicio AND :fim
-    """)
-
+    data_inicio, data_fim = _periodo(data_inicio, data_fim)
     try:
-        resultado = db.execute(query, {"inicio": datetime_inicio, "fim": datetime_fim}).first()
-        
-        faturacao = resultado[0] or 0.0
-        lucro = resultado[1] or 0.0
-        vendas = resultado[2] or 0
-
-        ticket_medio = faturacao / vendas if vendas > 0 else 0.0
-
-        return schemas.MetricasFinanceirasResponse(
-            faturacao_total=faturacao,
-            lucro_total=lucro,
-            total_vendas=vendas,
-            ticket_medio=ticket_medio
-        )
-
+        return await _metricas_financeiras(db, data_inicio, data_fim)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao calcular métricas financeiras: {e}")
 
 @router.get("/dashboard/vendas-por-dia", response_model=schemas.VendasDiariasResponse)
-def get_vendas_resumo_diario(db: Session = Depends(get_db)):
+async def get_vendas_resumo_diario(
+    data_inicio: Optional[date] = None,
+    data_fim: Optional[date] = None,
+    granularidade: Literal["dia", "semana", "mes"] = "dia",
+    db = Depends(get_db_leitura)
+):
     """
-    Retorna a FATURAÇÃO (receita) para cada um dos últimos 7 dias.
+    Retorna a FATURAÇÃO (receita) por dia, semana (a começar à segunda-feira) ou mês do
+    período (por omissão, os últimos 7 dias). Uma única query com GROUP BY sobre o
+    intervalo de `dia` (chave primária do resumo); os intervalos sem vendas ficam a 0.
+    As semanas e meses nas pontas contam só os dias dentro do período.
     """
-    data_fim = date.today()
-    data_inicio = data_fim - timedelta(days=6)
-    
-    dias = [(data_inicio + timedelta(days=i)) for i in range(7)]
-    labels = [d.strftime("%d/%m") for d in dias]
-    faturacao_data = []
-
-    query_sql = text("""
-        SELECT SUM(preco_venda_momento * quantidade_alterada)
-        FROM historico_estoque h
-        WHERE tipo_movimento = 'decremento' AND DATE(data_hora) = :dia
-    """)
+    data_inicio, data_fim = _periodo(data_inicio, data_fim)
+    intervalos = _intervalos_serie(data_inicio, data_fim, granularidade)
     try:
-        for dia in dias:
-            faturacao_dia = db.execute(query_sql, {"dia": dia}).scalar()
-            faturacao_data.append(faturacao_dia or 0.0)
-        return schemas.VendasDiariasResponse(labels=labels, data=faturacao_data)
+        return await _vendas_por_intervalo(db, data_inicio, data_fim, granularidade, intervalos)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao gerar resumo de vendas: {e}")
 
 
 @router.get("/dashboard/top-produtos", response_model=List[schemas.TopProdutoResponse])
-def get_top_produtos_vendidos(db: Session = Depends(get_db)):
+async def get_top_produtos_vendidos(
+    periodo: Literal["hoje", "7d", "30d", "total", "personalizado"] = "total",
+    data_inicio: Optional[date] = None,
+    data_fim: Optional[date] = None,
+    ordenar: Literal["vendas", "unidades", "faturacao", "margem"] = "vendas",
+    limite: int = Query(5, ge=1, le=50),
+    db = Depends(get_db_leitura)
+):
     """
-    Retorna os 5 produtos (variações) mais vendidos.
+    Retorna as N variações mais vendidas (por omissão, as 5 com mais vendas de sempre),
+    com unidades, faturação e margem. `periodo` escolhe a janela: hoje, 7d, 30d, total ou
+    personalizado (data_inicio/data_fim). Lido do resumo vendas_diarias, agrupado por ID.
     """
-    query = text("""
-        SELECT 
-            CONCAT(p.nome, ' (', ev.cor, ')') as produto,
-            COUNT(h.id) as vendas
-        FROM historico_estoque h
-        JOIN estoque_variacoes ev ON h.id_variacao_estoque = ev.id
-        JOIN produtos p ON ev.id_produto = p.id
-        WHERE h.tipo_movimento = 'decremento'
-        GROUP BY produto
-        ORDER BY vendas DESC
-        LIMIT 5;
-    """)
+    inicio, fim = _janela_top(periodo, data_inicio, data_fim)
     try:
-        resultados = db.execute(query).fetchall()
-        top_produtos = [schemas.TopProdutoResponse(produto=row[0], vendas=row[1]) for row in resultados]
-        return top_produtos
+        return await _top_produtos(db, inicio, fim, ordenar, limite)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao buscar top produtos: {e}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Erro ao buscar top produtos: {e}")
+
+# Respostas de GET /relatorios/dashboard por período. Sem invalidação: uma venda aparece
+# no dashboard, no máximo, CACHE_DASHBOARD_TTL_SEGUNDOS depois (0 desliga a cache).
+cache_dashboard = CacheLeitura(float(os.getenv("CACHE_DASHBOARD_TTL_SEGUNDOS", "30")), 200, 4 * 1024 * 1024)
+
+async def _em_sessao_propria(calcular, *args):
+    async with sessao_leitura() as db:
+        return await calcular(db, *args)
+
+@router.get("/dashboard", response_model=schemas.DashboardResponse)
+async def get_dashboard(
+    data_inicio: Optional[date] = None,
+    data_fim: Optional[date] = None,
+    granularidade: Literal["dia", "semana", "mes"] = "dia",
+    periodo_top: Literal["hoje", "7d", "30d", "total", "personalizado"] = "30d",
+    limite_top: int = Query(5, ge=1, le=50),
+):
+    """
+    Todos os widgets do dashboard num só pedido (uma autenticação em vez de três): as
+    métricas e a série de vendas do período (por omissão, os últimos 7 dias) e o top de
+    produtos de `periodo_top` (com "personalizado", o mesmo período). As três queries
+    correm em paralelo, cada uma na sua conexão do pool; a resposta fica na cache por período.
+    """
+    data_inicio, data_fim = _periodo(data_inicio, data_fim)
+    intervalos = _intervalos_serie(data_inicio, data_fim, granularidade)
+    inicio_top, fim_top = _janela_top(periodo_top, data_inicio, data_fim)
+
+    chave = (data_inicio, data_fim, granularidade, inicio_top, fim_top, limite_top)
+    entrada = cache_dashboard.obter(chave)
+    if entrada is None:
+        geracao = cache_dashboard.geracao
+        try:
+            metricas, vendas, top = await asyncio.gather(
+                _em_sessao_propria(_metricas_financeiras, data_inicio, data_fim),
+                _em_sessao_propria(_vendas_por_intervalo, data_inicio, data_fim, granularidade, intervalos),
+                _em_sessao_propria(_top_produtos, inicio_top, fim_top, "vendas", limite_top),
+            )
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Erro ao carregar o dashboard: {e}")
+        dashboard = schemas.DashboardResponse(
+            data_inicio=data_inicio, data_fim=data_fim, metricas=metricas, vendas=vendas, top_produtos=top
+        )
+        entrada = cache_dashboard.guardar(chave, dashboard.model_dump_json().encode(), [], geracao)
+    return Response(content=entrada.conteudo, media_type="application/json")
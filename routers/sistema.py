@@ -0,0 +1,84 @@
+# routers/sistema.py
+
+from fastapi import APIRouter, Depends
+from sqlalchemy.orm import Session
+
+import seguranca
+import historico_diferido
+import tarefas_imagens
+import ativos_estaticos
+from cache_leitura import cache
+from database import estatisticas_pool, get_db
+
+router = APIRouter(
+    prefix="/sistema",
+    tags=["Sistema"],
+    dependencies=[Depends(seguranca.get_current_admin_user)],
+    responses={404: {"description": "Não encontrado"}},
+)
+
+@router.get("/cache", response_model=dict)
+def get_estatisticas_cache():
+    """
+    Estatísticas da cache de leitura dos endpoints públicos (hits, misses, ocupação),
+    para dimensionar CACHE_MAX_ENTRADAS, CACHE_MAX_BYTES e CACHE_TTL_SEGUNDOS.
+    """
+    return cache.estatisticas()
+
+@router.delete("/cache", response_model=dict)
+def limpar_cache():
+    cache.limpar()
+    return {"mensagem": "Cache de leitura limpa com sucesso."}
+
+@router.delete("/cache/utilizadores/{username}", response_model=dict)
+def invalidar_cache_utilizador(username: str):
+    """
+    Descarta o utilizador da cache de autenticação. Chamado pelos scripts de manutenção
+    depois de alterarem a senha ou a função de um utilizador.
+
+    A cache é por processo, por isso só o worker que atende o pedido fica limpo; os
+    restantes continuam a usar a entrada antiga até expirar. `ttl_segundos` é esse limite.
+    """
+    removidas = seguranca.invalidar_utilizador(username)
+    ttl = seguranca.cache_utilizadores.ttl
+    return {
+        "mensagem": (
+            f"Cache do utilizador '{username}' invalidada neste processo; "
+            f"os restantes workers veem a alteração em até {ttl:g} s."
+        ),
+        "entradas_removidas": removidas,
+        "apenas_este_processo": True,
+        "ttl_segundos": ttl,
+    }
+
+@router.get("/pool", response_model=dict)
+def get_estatisticas_pool():
+    """
+    Estado do pool de conexões: conexões em uso e em overflow, tempo de espera no checkout
+    (média, máximo e percentis das últimas amostras), timeouts e invalidações.
+    """
+    return estatisticas_pool()
+
+@router.get("/historico", response_model=dict)
+def get_estatisticas_historico():
+    """
+    Estado da gravação diferida do histórico de estoque (HISTORICO_DIFERIDO=true): linhas
+    à espera no spool, lotes por gravar após falhas, linhas e lotes gravados.
+    """
+    return historico_diferido.estatisticas()
+
+@router.get("/ativos", response_model=dict)
+def get_estatisticas_ativos():
+    """Páginas e ficheiros de /static em memória: quantidade, bytes originais e com as versões comprimidas."""
+    return ativos_estaticos.ativos.estatisticas()
+
+@router.get("/imagens", response_model=dict)
+def get_estatisticas_imagens(db: Session = Depends(get_db)):
+    """Tarefas de envio/remoção de fotos em segundo plano, por estado (IMAGENS_SEGUNDO_PLANO=true)."""
+    return tarefas_imagens.estatisticas(db)
+
+@router.post("/imagens/repetir", response_model=dict)
+def repetir_tarefas_imagens(db: Session = Depends(get_db)):
+    """Volta a pôr na fila as tarefas de imagens que esgotaram as tentativas."""
+    repetidas = tarefas_imagens.repetir_falhadas(db)
+    return {"mensagem": f"{repetidas} tarefas de imagens voltaram à fila.", "tarefas": repetidas}
@@ -3,6 +3,8 @@
 from pydantic import BaseModel, field_validator
 import re
 from typing import List, Optional, Literal
+from decimal import Decimal
+from datetime import date
 
 # --- Modelos Pydantic ---
 class MarcaBase(BaseModel):
@@ -55,17 +57,39 @@ class EstoqueVariacaoBase(BaseModel):
     @field_validator('cor')
     def trim_whitespace(cls, v): return v.strip()
 
+class VariacaoLote(BaseModel):
+    cor: str
+    quantidade: int
+    preco_custo: float
+    disponivel_encomenda: bool = True
+    foto: Optional[int] = None  # índice em `fotos` no pedido multipart
+    @field_validator('cor')
+    def trim_whitespace(cls, v): return v.strip()
+
+class ImagensVariacao(BaseModel):
+    # URLs da foto em cada tamanho (JPEG) e em WebP, para <picture>/srcset
+    miniatura: str
+    cartao: str
+    detalhe: str
+    miniatura_webp: str
+    cartao_webp: str
+    detalhe_webp: str
+
 class EstoqueVariacaoResponse(BaseModel):
     id: int
     cor: str
     quantidade: int
     disponivel_encomenda: bool
     url_foto: Optional[str] = None
+    imagens: Optional[ImagensVariacao] = None
     produto_nome: str
     modelo_celular: str
     preco_venda: float
     preco_custo: Optional[float] = None
 
+class EstoqueVariacaoAdminResponse(EstoqueVariacaoResponse):
+    foto_pendente: bool = False
+
 class FornecedorBase(BaseModel):
     nome: str
     contato_telefone: Optional[str] = None
@@ -111,6 +135,10 @@ class VendasDiariasResponse(BaseModel):
 class TopProdutoResponse(BaseModel):
     produto: str
     vendas: int
+    variacao_id: Optional[int] = None
+    unidades: int = 0
+    faturacao: float = 0.0
+    margem: float = 0.0
 
 class MetricasFinanceirasResponse(BaseModel):
     faturacao_total: float
@@ -118,10 +146,45 @@ class MetricasFinanceirasResponse(BaseModel):
     total_vendas: int
     ticket_medio: float
 
+class DashboardResponse(BaseModel):
+    data_inicio: date
+    data_fim: date
+    metricas: MetricasFinanceirasResponse
+    vendas: VendasDiariasResponse
+    top_produtos: List[TopProdutoResponse]
+
 class CompraEstoque(BaseModel):
     quantidade: int
     custo_unitario: float
 
+class ItemCompraLote(BaseModel):
+    variacao_id: int
+    quantidade: int
+    custo_unitario: Decimal
+    @field_validator('quantidade')
+    def validar_quantidade(cls, v):
+        if v <= 0: raise ValueError('A quantidade deve ser maior que zero.')
+        return v
+    @field_validator('custo_unitario')
+    def validar_custo(cls, v):
+        if v < 0: raise ValueError('O custo unitário não pode ser negativo.')
+        return v
+
+class ItemCheckout(BaseModel):
+    variacao_id: int
+    quantidade: int = 1
+    @field_validator('quantidade')
+    def validar_quantidade(cls, v):
+        if v <= 0: raise ValueError('A quantidade deve ser maior que zero.')
+        return v
+
+class CheckoutPDV(BaseModel):
+    itens: List[ItemCheckout]
+    @field_validator('itens')
+    def validar_itens(cls, v):
+        if not v: raise ValueError('O carrinho está vazio.')
+        return v
+
 # Os modelos para a página pública de detalhes do produto podem ser movidos para cá também
 # se forem usados em mais algum lugar, ou podem ficar em main.py se forem muito específicos.
 # Por agora, vamos mantê-los em main.py para simplificar.
\ No newline at end of file
@@ -0,0 +1,52 @@
+# alterar_funcao_usuario.py
+
+import os
+import sys
+
+# Adiciona o diretório raiz do projeto ao sys.path
+# Isso permite que o script encontre módulos como 'seguranca' e 'database'
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from dotenv import load_dotenv
+
+# Carrega as variáveis de ambiente PRIMEIRO
+load_dotenv()
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from scripts.utils import get_database_url, invalidar_utilizador_na_api
+
+def alterar_funcao_usuario():
+    DATABASE_URL = get_database_url()
+    if not DATABASE_URL: return
+    engine = create_engine(DATABASE_URL)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    db = SessionLocal()
+    print("\n--- Alteração da Função de Utilizador ---")
+    try:
+        username = input("Digite o nome do utilizador que deseja alterar: ").strip()
+        while True:
+            role = input("Digite a nova função do utilizador (admin/atendente): ").strip().lower()
+            if role in ['admin', 'atendente']:
+                break
+            else:
+                print("Função inválida. Por favor, escolha 'admin' ou 'atendente'.")
+
+        query = text("UPDATE usuarios SET role = :role WHERE username = :username")
+        resultado = db.execute(query, {"role": role, "username": username})
+        if resultado.rowcount == 0:
+            print(f"\nErro: Utilizador '{username}' não encontrado.")
+        else:
+            db.commit()
+            print(f"\nFunção do utilizador '{username}' alterada para '{role}' com sucesso!")
+            print("Nota: com AUTH_CONFIAR_CLAIMS=true, os tokens já emitidos mantêm a função antiga até expirarem.")
+            invalidar_utilizador_na_api(username)
+    except Exception as e:
+        db.rollback()
+        print(f"\nOcorreu um erro: {e}")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    alterar_funcao_usuario()
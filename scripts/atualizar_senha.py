@@ -18,7 +18,7 @@ from sqlalchemy.orm import sessionmaker
 
 # Importa a nossa função de hashing
 from seguranca import gerar_hash_senha
-from scripts.utils import get_database_url
+from scripts.utils import get_database_url, invalidar_utilizador_na_api
 
 def atualizar_senha_usuario():
     DATABASE_URL = get_database_url()
@@ -38,6 +38,7 @@ def atualizar_senha_usuario():
         else:
             db.commit()
             print(f"\nSenha do utilizador '{username}' atualizada com sucesso!")
+            invalidar_utilizador_na_api(username)
     except Exception as e:
         db.rollback()
         print(f"\nOcorreu um erro: {e}")
@@ -0,0 +1,86 @@
+# scripts/benchmark_busca_catalogo.py
+
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+
+# Adiciona o diretório raiz do projeto ao sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import sessionmaker
+
+from indice_catalogo import IndiceCatalogo, procurar_sql
+
+MARCAS = ["Samsung", "Apple", "Motorola", "Xiaomi", "Realme", "Asus", "LG", "Nokia", "Sony", "Poco"]
+LINHAS = ["Galaxy", "iPhone", "Moto G", "Redmi Note", "Edge", "Zenfone", "Xperia", "Pixel", "Mi", "One"]
+CORES = ["Preto", "Azul", "Rosa", "Incolor", "Verde", "Vermelho", "Lilás", "Amarelo"]
+TERMOS = ["galaxy s2", "iphone 15", "moto g 5", "redmi", "xperia 1", "pixel", "samsung galaxy 10", "ed", "zzz"]
+
+def criar_catalogo_sintetico(engine, total_variacoes: int):
+    """
+    Cria um catálogo sintético (SQLite) com o esquema usado pela busca.
+    Cada produto tem 4 cores; cada modelo tem 25 produtos.
+    """
+    random.seed(42)
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE marcas (id INTEGER PRIMARY KEY, nome TEXT NOT NULL)"))
+        conn.execute(text("CREATE TABLE modelos_celular (id INTEGER PRIMARY KEY, id_marca INTEGER NOT NULL, nome_modelo TEXT NOT NULL)"))
+        conn.execute(text("CREATE TABLE produtos (id INTEGER PRIMARY KEY, id_modelo_celular INTEGER NOT NULL, nome TEXT NOT NULL, tipo TEXT NOT NULL, material TEXT, preco_venda DECIMAL(10, 2) NOT NULL)"))
+        conn.execute(text("CREATE TABLE estoque_variacoes (id INTEGER PRIMARY KEY, id_produto INTEGER NOT NULL, cor TEXT NOT NULL, url_foto TEXT, quantidade INTEGER NOT NULL, preco_custo DECIMAL(10, 2), disponivel_encomenda BOOLEAN NOT NULL)"))
+
+        total_produtos = total_variacoes // 4
+        total_modelos = max(1, total_produtos // 25)
+        conn.execute(text("INSERT INTO marcas (id, nome) VALUES (:id, :nome)"),
+                     [{"id": i + 1, "nome": nome} for i, nome in enumerate(MARCAS)])
+        conn.execute(text("INSERT INTO modelos_celular (id, id_marca, nome_modelo) VALUES (:id, :id_marca, :nome)"),
+                     [{"id": i + 1, "id_marca": (i % len(MARCAS)) + 1, "nome": f"{LINHAS[i % len(LINHAS)]} {i // len(LINHAS)}"} for i in range(total_modelos)])
+        conn.execute(text("INSERT INTO produtos (id, id_modelo_celular, nome, tipo, preco_venda) VALUES (:id, :id_modelo, :nome, 'Capinha', :preco)"),
+                     [{"id": i + 1, "id_modelo": (i % total_modelos) + 1, "nome": f"Capinha {i}", "preco": round(random.uniform(20, 120), 2)} for i in range(total_produtos)])
+        conn.execute(text("INSERT INTO estoque_variacoes (id, id_produto, cor, quantidade, disponivel_encomenda) VALUES (:id, :id_produto, :cor, :qtd, 1)"),
+                     [{"id": i + 1, "id_produto": (i // 4) + 1, "cor": CORES[i % len(CORES)], "qtd": random.randint(0, 20)} for i in range(total_produtos * 4)])
+
+def medir(funcao, repeticoes: int):
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = funcao()
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    return statistics.median(tempos), len(resultado)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara a busca do catálogo via SQL com o índice em memória.")
+    parser.add_argument("--variacoes", type=int, default=100_000)
+    parser.add_argument("--repeticoes", type=int, default=5)
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite://")
+
+    # O SQLite não tem CONCAT nativo nas versões mais antigas; registamos um equivalente.
+    @event.listens_for(engine, "connect")
+    def registar_concat(dbapi_connection, connection_record):
+        dbapi_connection.create_function("CONCAT", -1, lambda *partes: "".join("" if p is None else str(p) for p in partes))
+
+    print(f"A criar catálogo sintético com {args.variacoes} variações...")
+    criar_catalogo_sintetico(engine, args.variacoes)
+    db = sessionmaker(bind=engine)()
+
+    inicio = time.perf_counter()
+    indice = IndiceCatalogo()
+    indice.construir(db)
+    print(f"Índice construído em {(time.perf_counter() - inicio) * 1000:.0f} ms\n")
+
+    print(f"{'termo':<20}{'resultados':>12}{'SQL (ms)':>12}{'índice (ms)':>14}{'ganho':>10}")
+    for termo in TERMOS:
+        t_sql, n_sql = medir(lambda: procurar_sql(db, termo, engine.dialect.name), args.repeticoes)
+        t_idx, n_idx = medir(lambda: indice.procurar(termo), args.repeticoes)
+        if n_sql != n_idx:
+            print(f"AVISO: resultados diferentes para '{termo}' (SQL={n_sql}, índice={n_idx})")
+        print(f"{termo:<20}{n_idx:>12}{t_sql:>12.2f}{t_idx:>14.3f}{t_sql / max(t_idx, 1e-6):>9.0f}x")
+    db.close()
+
+if __name__ == "__main__":
+    main()
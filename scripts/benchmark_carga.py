@@ -0,0 +1,73 @@
+# scripts/benchmark_carga.py
+
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import statistics
+
+# Ferramenta de desenvolvimento: o httpx não faz parte das dependências da aplicação.
+try:
+    import httpx
+except ImportError:
+    print("Este script requer o httpx: pip install httpx")
+    sys.exit(1)
+
+# Compara o modo síncrono e o assíncrono dos endpoints de leitura. Inicie a API duas vezes,
+# com DB_ASYNC=false e DB_ASYNC=true (e CACHE_TTL_SEGUNDOS=0 para medir a base de dados),
+# e execute este script contra cada uma, por exemplo:
+#
+#   DB_ASYNC=true CACHE_TTL_SEGUNDOS=0 uvicorn main:app --port 8000
+#   python scripts/benchmark_carga.py --url http://localhost:8000 --clientes 200 --duracao 30
+
+async def cliente(http: httpx.AsyncClient, caminhos, fim: float, latencias: list, erros: list):
+    while time.perf_counter() < fim:
+        caminho = random.choice(caminhos)
+        inicio = time.perf_counter()
+        try:
+            resposta = await http.get(caminho)
+            if resposta.status_code >= 500:
+                erros.append(resposta.status_code)
+            else:
+                latencias.append((time.perf_counter() - inicio) * 1000)
+        except httpx.HTTPError as e:
+            erros.append(type(e).__name__)
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p / 100))]
+
+async def executar(args):
+    caminhos = [f"/produto/detalhes/{i}" for i in range(1, args.max_variacao + 1)]
+    if args.token:
+        caminhos += ["/relatorios/dashboard/metricas-financeiras", "/relatorios/dashboard/top-produtos"]
+    headers = {"Authorization": f"Bearer {args.token}"} if args.token else {}
+    limites = httpx.Limits(max_connections=args.clientes, max_keepalive_connections=args.clientes)
+    latencias, erros = [], []
+    async with httpx.AsyncClient(base_url=args.url, headers=headers, limits=limites, timeout=60) as http:
+        fim = time.perf_counter() + args.duracao
+        inicio = time.perf_counter()
+        await asyncio.gather(*(cliente(http, caminhos, fim, latencias, erros) for _ in range(args.clientes)))
+        duracao = time.perf_counter() - inicio
+
+    print(f"Clientes simultâneos: {args.clientes} | duração: {duracao:.1f} s")
+    print(f"Pedidos concluídos:   {len(latencias)} ({len(latencias) / duracao:.0f} req/s)")
+    print(f"Erros:                {len(erros)}")
+    if latencias:
+        print(f"Latência (ms):        p50={statistics.median(latencias):.1f}  p95={percentil(latencias, 95):.1f}  p99={percentil(latencias, 99):.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga dos endpoints de leitura.")
+    parser.add_argument("--url", default=os.getenv("BENCHMARK_URL", "http://localhost:8000"))
+    parser.add_argument("--clientes", type=int, default=200)
+    parser.add_argument("--duracao", type=float, default=30)
+    parser.add_argument("--max-variacao", type=int, default=100, help="Os pedidos de detalhe usam IDs de 1 até este valor.")
+    parser.add_argument("--token", default=os.getenv("BENCHMARK_TOKEN"), help="Token de admin para incluir os endpoints do dashboard.")
+    asyncio.run(executar(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# scripts/benchmark_estoque.py
+
+import os
+import sys
+import time
+import argparse
+import statistics
+import threading
+
+# Adiciona o diretório raiz do projeto ao sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from fastapi import HTTPException
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+import servico_estoque
+
+# Vendas simultâneas da MESMA variação (o pior caso: todas disputam a mesma linha).
+# Compara a sequência anterior de atualizar_estoque_pdv (SELECT ... FOR UPDATE, UPDATE,
+# SELECT do utilizador, INSERT) com o UPDATE condicional de servico_estoque.
+# Use uma base de dados de desenvolvimento: o script altera a quantidade da variação e
+# apaga no fim as linhas de histórico que criou.
+#
+#   python scripts/benchmark_estoque.py --url postgresql+psycopg2://... --variacao 1 --utilizador admin
+
+def venda_anterior(db, args):
+    variacao_id, username = args.variacao, args.utilizador
+    variacao = db.execute(text("""
+        SELECT ev.quantidade, ev.preco_custo, p.preco_venda
+        FROM estoque_variacoes ev
+        JOIN produtos p ON ev.id_produto = p.id
+        WHERE ev.id = :id FOR UPDATE
+    """), {"id": variacao_id}).first()
+    quantidade_atual, preco_custo, preco_venda = variacao
+    if quantidade_atual < 1:
+        raise HTTPException(status_code=400, detail="Estoque insuficiente para realizar a venda.")
+    nova_quantidade = quantidade_atual - 1
+    db.execute(text("UPDATE estoque_variacoes SET quantidade = :nova_quantidade WHERE id = :id"),
+               {"nova_quantidade": nova_quantidade, "id": variacao_id})
+    user_id = db.execute(text("SELECT id FROM usuarios WHERE username = :username"), {"username": username}).scalar()
+    db.execute(text("""
+        INSERT INTO historico_estoque (id_variacao_estoque, id_usuario, tipo_movimento, quantidade_alterada, nova_quantidade_estoque, preco_venda_momento, preco_custo_momento)
+        VALUES (:id_variacao, :id_usuario, 'decremento', 1, :nova_qtd, :preco_venda, :preco_custo)
+    """), {"id_variacao": variacao_id, "id_usuario": user_id, "nova_qtd": nova_quantidade, "preco_venda": preco_venda, "preco_custo": preco_custo})
+    return nova_quantidade
+
+def venda_servico(db, args):
+    # O ID do utilizador vem do token na API; aqui é lido uma vez no início.
+    return servico_estoque.registar_movimento(db, args.variacao, -1, args.id_usuario)
+
+def executar(SessionLocal, funcao, args):
+    latencias, erros = [], []
+    fim = time.perf_counter() + args.duracao
+
+    def cliente():
+        with SessionLocal() as db:
+            while time.perf_counter() < fim:
+                inicio = time.perf_counter()
+                try:
+                    funcao(db, args)
+                    db.commit()
+                    latencias.append((time.perf_counter() - inicio) * 1000)
+                except Exception as e:
+                    db.rollback()
+                    erros.append(type(e).__name__)
+
+    inicio = time.perf_counter()
+    threads = [threading.Thread(target=cliente) for _ in range(args.clientes)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencias, erros, time.perf_counter() - inicio
+
+def percentil(valores, p):
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p / 100))] if valores else 0.0
+
+def main():
+    parser = argparse.ArgumentParser(description="Débito de vendas simultâneas da mesma variação.")
+    parser.add_argument("--url", default=os.getenv("BENCHMARK_DATABASE_URL"), required=not os.getenv("BENCHMARK_DATABASE_URL"))
+    parser.add_argument("--variacao", type=int, required=True)
+    parser.add_argument("--utilizador", required=True)
+    parser.add_argument("--clientes", type=int, default=16)
+    parser.add_argument("--duracao", type=float, default=10)
+    args = parser.parse_args()
+
+    engine = create_engine(args.url, pool_size=args.clientes, max_overflow=0)
+    SessionLocal = sessionmaker(bind=engine, autoflush=False)
+    with engine.begin() as conn:
+        quantidade_original = conn.execute(text("SELECT quantidade FROM estoque_variacoes WHERE id = :id"), {"id": args.variacao}).scalar()
+        ultimo_historico = conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM historico_estoque")).scalar()
+        args.id_usuario = conn.execute(text("SELECT id FROM usuarios WHERE username = :username"), {"username": args.utilizador}).scalar()
+    if quantidade_original is None or args.id_usuario is None:
+        print(f"Variação {args.variacao} ou utilizador '{args.utilizador}' não encontrado.")
+        return
+
+    print(f"{args.clientes} clientes a vender a variação {args.variacao} durante {args.duracao:.0f} s ({engine.dialect.name})")
+    try:
+        for nome, funcao in (("anterior", venda_anterior), ("serviço", venda_servico)):
+            with engine.begin() as conn:
+                conn.execute(text("UPDATE estoque_variacoes SET quantidade = 1000000 WHERE id = :id"), {"id": args.variacao})
+            latencias, erros, duracao = executar(SessionLocal, funcao, args)
+            print(f"  {nome:<9} {len(latencias) / duracao:8.1f} vendas/s | erros: {len(erros):3d} | "
+                  f"p50={statistics.median(latencias) if latencias else 0:.2f} ms  p95={percentil(latencias, 95):.2f} ms  p99={percentil(latencias, 99):.2f} ms")
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text("DELETE FROM historico_estoque WHERE id > :id"), {"id": ultimo_historico})
+            conn.execute(text("UPDATE estoque_variacoes SET quantidade = :q WHERE id = :id"), {"q": quantidade_original, "id": args.variacao})
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# scripts/benchmark_login.py
+
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import statistics
+
+# Ferramenta de desenvolvimento: o httpx não faz parte das dependências da aplicação.
+try:
+    import httpx
+except ImportError:
+    print("Este script requer o httpx: pip install httpx")
+    sys.exit(1)
+
+# Mede o efeito de uma vaga de logins (início de turno) sobre o tráfego do PDV.
+# Fase 1: só tráfego do PDV. Fase 2: o mesmo tráfego com logins simultâneos.
+# Compare a latência do PDV entre as fases e com AUTH_HASH_WORKERS/AUTH_HASH_PROCESSOS diferentes:
+#
+#   AUTH_HASH_WORKERS=2 uvicorn main:app --port 8000
+#   python scripts/benchmark_login.py --utilizador caixa --senha ... --logins 50 --clientes-pdv 20
+
+async def cliente_pdv(http: httpx.AsyncClient, args, fim: float, latencias: list, erros: list):
+    while time.perf_counter() < fim:
+        if random.random() < 0.5:
+            caminho = f"/catalogo/search?q={random.choice(args.termos)}&limit=20"
+        else:
+            caminho = f"/estoque/produto/{random.randint(1, args.max_produto)}"
+        inicio = time.perf_counter()
+        try:
+            resposta = await http.get(caminho)
+            if resposta.status_code >= 500:
+                erros.append(resposta.status_code)
+            else:
+                latencias.append((time.perf_counter() - inicio) * 1000)
+        except httpx.HTTPError as e:
+            erros.append(type(e).__name__)
+
+async def cliente_login(http: httpx.AsyncClient, args, fim: float, latencias: list, erros: list):
+    dados = {"username": args.utilizador, "password": args.senha}
+    while time.perf_counter() < fim:
+        inicio = time.perf_counter()
+        try:
+            resposta = await http.post("/token", data=dados)
+            if resposta.status_code != 200:
+                erros.append(resposta.status_code)
+            else:
+                latencias.append((time.perf_counter() - inicio) * 1000)
+        except httpx.HTTPError as e:
+            erros.append(type(e).__name__)
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p / 100))]
+
+def mostrar(nome: str, latencias: list, erros: list, duracao: float):
+    print(f"  {nome:<7} {len(latencias) / duracao:7.1f} req/s | erros: {len(erros):4d}", end="")
+    if latencias:
+        print(f" | p50={statistics.median(latencias):.1f} ms  p95={percentil(latencias, 95):.1f} ms  p99={percentil(latencias, 99):.1f} ms")
+    else:
+        print()
+
+async def fase(args, token: str, logins: int):
+    limites = httpx.Limits(max_connections=args.clientes_pdv + logins + 1)
+    headers = {"Authorization": f"Bearer {token}"}
+    pdv, erros_pdv, login, erros_login = [], [], [], []
+    async with httpx.AsyncClient(base_url=args.url, headers=headers, limits=limites, timeout=120) as http:
+        fim = time.perf_counter() + args.duracao
+        inicio = time.perf_counter()
+        tarefas = [cliente_pdv(http, args, fim, pdv, erros_pdv) for _ in range(args.clientes_pdv)]
+        tarefas += [cliente_login(http, args, fim, login, erros_login) for _ in range(logins)]
+        await asyncio.gather(*tarefas)
+        duracao = time.perf_counter() - inicio
+    mostrar("PDV", pdv, erros_pdv, duracao)
+    if logins:
+        mostrar("Login", login, erros_login, duracao)
+
+async def executar(args):
+    async with httpx.AsyncClient(base_url=args.url, timeout=60) as http:
+        resposta = await http.post("/token", data={"username": args.utilizador, "password": args.senha})
+        resposta.raise_for_status()
+        token = resposta.json()["access_token"]
+
+    print(f"Fase 1: {args.clientes_pdv} clientes do PDV, sem logins ({args.duracao:.0f} s)")
+    await fase(args, token, 0)
+    print(f"Fase 2: {args.clientes_pdv} clientes do PDV + {args.logins} logins simultâneos ({args.duracao:.0f} s)")
+    await fase(args, token, args.logins)
+
+def main():
+    parser = argparse.ArgumentParser(description="Débito de logins face ao tráfego simultâneo do PDV.")
+    parser.add_argument("--url", default=os.getenv("BENCHMARK_URL", "http://localhost:8000"))
+    parser.add_argument("--utilizador", required=True)
+    parser.add_argument("--senha", required=True)
+    parser.add_argument("--logins", type=int, default=50, help="Clientes a fazer login em ciclo na fase 2.")
+    parser.add_argument("--clientes-pdv", type=int, default=20)
+    parser.add_argument("--duracao", type=float, default=20)
+    parser.add_argument("--max-produto", type=int, default=100, help="Os pedidos de estoque usam IDs de produto de 1 até este valor.")
+    parser.add_argument("--termos", nargs="+", default=["preto", "azul", "capinha", "pelicula", "samsung"])
+    asyncio.run(executar(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
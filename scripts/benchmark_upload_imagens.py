@@ -0,0 +1,64 @@
+# scripts/benchmark_upload_imagens.py
+
+import os
+import io
+import sys
+import time
+import argparse
+import tempfile
+
+# Adiciona o diretório raiz do projeto ao sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+os.environ.setdefault("IMAGENS_ARMAZENAMENTO", "local")
+
+import armazenamento_imagens
+
+# Compara o envio sequencial das fotos de um produto (um pedido por variação, como em
+# criar_variacao_estoque) com o envio em paralelo de criar_variacoes_lote. Usa o armazenamento
+# local num diretório temporário, com uma latência simulada por envio no lugar da rede do
+# Cloudinary, por isso não precisa de credenciais nem de base de dados:
+#
+#   python scripts/benchmark_upload_imagens.py --fotos 12 --latencia-ms 300
+#   IMAGENS_UPLOAD_WORKERS=8 python scripts/benchmark_upload_imagens.py --fotos 12
+
+class ArmazenamentoComLatencia(armazenamento_imagens.ArmazenamentoLocal):
+    def __init__(self, diretorio: str, latencia: float):
+        super().__init__(diretorio, "/static/images")
+        self.latencia = latencia
+
+    def enviar(self, ficheiro, nome):
+        time.sleep(self.latencia)
+        return super().enviar(ficheiro, nome)
+
+def ficheiros(args):
+    conteudo = os.urandom(args.tamanho_kb * 1024)
+    return [(io.BytesIO(conteudo), f"foto_{i}.jpg") for i in range(args.fotos)]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fotos", type=int, default=12)
+    parser.add_argument("--latencia-ms", type=float, default=300)
+    parser.add_argument("--tamanho-kb", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as diretorio:
+        armazenamento = ArmazenamentoComLatencia(diretorio, args.latencia_ms / 1000)
+        armazenamento_imagens.armazenamento = armazenamento
+
+        inicio = time.perf_counter()
+        for ficheiro, nome in ficheiros(args):
+            armazenamento.enviar(ficheiro, nome)
+        sequencial = time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        urls = armazenamento_imagens.enviar_varias(ficheiros(args))
+        paralelo = time.perf_counter() - inicio
+        armazenamento_imagens.encerrar_executor()
+
+    print(f"{args.fotos} fotos, {args.latencia_ms:.0f} ms por envio, {armazenamento_imagens.UPLOAD_WORKERS} workers")
+    print(f"  Sequencial: {sequencial * 1000:8.1f} ms")
+    print(f"  Paralelo:   {paralelo * 1000:8.1f} ms  ({len(urls)} URLs, {sequencial / paralelo:.1f}x)")
+
+if __name__ == "__main__":
+    main()
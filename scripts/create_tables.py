@@ -8,6 +8,168 @@ from sqlalchemy import create_engine, text
 # Isso permite que o script encontre módulos como 'seguranca' e 'database' no futuro, se necessário.
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from scripts.utils import get_database_url
+from scripts.migracoes import criar_indice
+
+def criar_tabelas(connection):
+    """
+    Cria (se não existirem) todas as tabelas e índices do esquema, na transação da
+    conexão recebida. Usada por este script e pela migração 0001 (scripts/migrar.py).
+    """
+    # SQL para criar as tabelas (sintaxe comum a PostgreSQL e MySQL/MariaDB)
+    # SERIAL é o equivalente ao AUTO_INCREMENT
+    # BOOLEAN é o equivalente ao TINYINT(1)
+    # Os índices secundários são criados com criar_indice (o MySQL não aceita
+    # CREATE INDEX IF NOT EXISTS) e os tipos específicos de um dialeto têm um ramo próprio
+    # (ex.: tarefas_imagens.conteudo).
+    connection.execute(text("""
+    CREATE TABLE IF NOT EXISTS marcas (
+        id SERIAL PRIMARY KEY,
+        nome VARCHAR(100) NOT NULL UNIQUE
+    );
+    """))
+    print("Tabela 'marcas' criada ou já existente.")
+
+    connection.execute(text("""
+    CREATE TABLE IF NOT EXISTS modelos_celular (
+        id SERIAL PRIMARY KEY,
+        id_marca INTEGER NOT NULL REFERENCES marcas(id) ON DELETE RESTRICT ON UPDATE CASCADE,
+        nome_modelo VARCHAR(150) NOT NULL
+    );
+    """))
+    print("Tabela 'modelos_celular' criada ou já existente.")
+
+    connection.execute(text("""
+    CREATE TABLE IF NOT EXISTS produtos (
+        id SERIAL PRIMARY KEY,
+        id_modelo_celular INTEGER NOT NULL REFERENCES modelos_celular(id) ON DELETE RESTRICT ON UPDATE CASCADE,
+        nome VARCHAR(255) NOT NULL,
+        tipo VARCHAR(50) NOT NULL,
+        material VARCHAR(100),
+        preco_venda DECIMAL(10, 2) NOT NULL
+    );
+    """))
+    print("Tabela 'produtos' criada ou já existente.")
+
+    connection.execute(text("""
+    CREATE TABLE IF NOT EXISTS estoque_variacoes (
+        id SERIAL PRIMARY KEY,
+        id_produto INTEGER NOT NULL REFERENCES produtos(id) ON DELETE RESTRICT ON UPDATE CASCADE,
+        cor VARCHAR(50) NOT NULL DEFAULT 'N/A',
+        url_foto VARCHAR(255),
+        quantidade INTEGER NOT NULL DEFAULT 0,
+        preco_custo DECIMAL(10, 2),
+        disponivel_encomenda BOOLEAN NOT NULL DEFAULT TRUE,
+        UNIQUE(id_produto, cor)
+    );
+    """))
+    print("Tabela 'estoque_variacoes' criada ou já existente.")
+
+    connection.execute(text("""
+    CREATE TABLE IF NOT EXISTS fornecedores (
+        id SERIAL PRIMARY KEY,
+        nome VARCHAR(150) NOT NULL,
+        contato_telefone VARCHAR(25),
+        contato_email VARCHAR(100)
+    );
+    """))
+    print("Tabela 'fornecedores' criada ou já existente.")
+
+    connection.execute(text("""
+    CREATE TABLE IF NOT EXISTS produtos_fornecedores (
+        id_produto INTEGER NOT NULL REFERENCES produtos(id) ON DELETE RESTRICT ON UPDATE CASCADE,
+        id_fornecedor INTEGER NOT NULL REFERENCES fornecedores(id) ON DELETE RESTRICT ON UPDATE CASCADE,
+        PRIMARY KEY (id_produto, id_fornecedor)
+    );
+    """))
+    print("Tabela 'produtos_fornecedores' criada ou já existente.")
+
+    connection.execute(text("""
+    CREATE TABLE IF NOT EXISTS usuarios (
+        id SERIAL PRIMARY KEY,
+        username VARCHAR(100) NOT NULL UNIQUE,
+        senha_hash VARCHAR(255) NOT NULL,
+        role VARCHAR(50) NOT NULL CHECK (role IN ('admin', 'atendente'))
+    );
+    """))
+    print("Tabela 'usuarios' criada ou já existente.")
+
+    connection.execute(text("""
+    CREATE TABLE IF NOT EXISTS historico_estoque (
+        id SERIAL PRIMARY KEY,
+        id_variacao_estoque INTEGER NOT NULL REFERENCES estoque_variacoes(id) ON DELETE CASCADE,
+        id_usuario INTEGER NOT NULL REFERENCES usuarios(id) ON DELETE RESTRICT,
+        tipo_movimento VARCHAR(20) NOT NULL CHECK (tipo_movimento IN ('incremento', 'decremento')),
+        quantidade_alterada INTEGER NOT NULL DEFAULT 1,
+        preco_venda_momento DECIMAL(10, 2),
+        preco_custo_momento DECIMAL(10, 2),
+        data_hora TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        nova_quantidade_estoque INTEGER NOT NULL
+    );
+    """))
+    print("Tabela 'historico_estoque' criada ou já existente.")
+
+    # Respostas guardadas por Idempotency-Key (usada com IDEMPOTENCIA_DB=true)
+    connection.execute(text("""
+    CREATE TABLE IF NOT EXISTS pedidos_idempotentes (
+        chave CHAR(64) PRIMARY KEY,
+        impressao CHAR(64) NOT NULL,
+        status_code INTEGER NOT NULL,
+        resposta TEXT NOT NULL,
+        criado_em TIMESTAMP NOT NULL
+    );
+    """))
+    criar_indice(connection, "idx_pedidos_idempotentes_criado_em", "pedidos_idempotentes", ["criado_em"], concorrente=False)
+    print("Tabela 'pedidos_idempotentes' criada ou já existente.")
+
+    # Lotes de histórico já gravados (usada com HISTORICO_DIFERIDO=true)
+    connection.execute(text("""
+    CREATE TABLE IF NOT EXISTS historico_lotes_aplicados (
+        id_lote CHAR(32) PRIMARY KEY,
+        aplicado_em TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+    """))
+    print("Tabela 'historico_lotes_aplicados' criada ou já existente.")
+
+    # Envios e remoções de fotos em segundo plano (usada com IMAGENS_SEGUNDO_PLANO=true)
+    tipo_binario = "BYTEA" if connection.dialect.name == "postgresql" else "LONGBLOB"
+    connection.execute(text(f"""
+    CREATE TABLE IF NOT EXISTS tarefas_imagens (
+        id SERIAL PRIMARY KEY,
+        tipo VARCHAR(10) NOT NULL CHECK (tipo IN ('enviar', 'apagar')),
+        id_variacao INTEGER,
+        ficheiro VARCHAR(500),
+        conteudo {tipo_binario},
+        nome_original VARCHAR(255),
+        url VARCHAR(500),
+        chave CHAR(64) UNIQUE,
+        estado VARCHAR(12) NOT NULL CHECK (estado IN ('pendente', 'em_curso', 'concluida', 'cancelada', 'falhada')),
+        tentativas INTEGER NOT NULL DEFAULT 0,
+        proxima_tentativa TIMESTAMP NOT NULL,
+        reservada_em TIMESTAMP,
+        erro TEXT,
+        criado_em TIMESTAMP NOT NULL
+    );
+    """))
+    criar_indice(connection, "idx_tarefas_imagens_estado", "tarefas_imagens", ["estado", "proxima_tentativa"], concorrente=False)
+    criar_indice(connection, "idx_tarefas_imagens_variacao", "tarefas_imagens", ["id_variacao"], concorrente=False)
+    print("Tabela 'tarefas_imagens' criada ou já existente.")
+
+    # Resumo das vendas por dia e variação, mantido a cada venda (dashboard)
+    connection.execute(text("""
+    CREATE TABLE IF NOT EXISTS vendas_diarias (
+        dia DATE NOT NULL,
+        id_variacao_estoque INTEGER NOT NULL REFERENCES estoque_variacoes(id) ON DELETE CASCADE,
+        vendas INTEGER NOT NULL DEFAULT 0,
+        unidades INTEGER NOT NULL DEFAULT 0,
+        faturacao DECIMAL(14, 2) NOT NULL DEFAULT 0,
+        custo DECIMAL(14, 2) NOT NULL DEFAULT 0,
+        PRIMARY KEY (dia, id_variacao_estoque)
+    );
+    """))
+    criar_indice(connection, "idx_vendas_diarias_variacao", "vendas_diarias", ["id_variacao_estoque"], concorrente=False)
+    print("Tabela 'vendas_diarias' criada ou já existente.")
+    print("  Para preencher com as vendas já registadas: python scripts/reconstruir_vendas_diarias.py")
+
 
 def create_tables():
     DATABASE_URL = get_database_url()
@@ -21,95 +183,7 @@ def create_tables():
             # Usamos uma transação para garantir que todas as tabelas sejam criadas ou nenhuma.
             trans = connection.begin()
             try:
-                # SQL para criar as tabelas (sintaxe para PostgreSQL)
-                # SERIAL é o equivalente ao AUTO_INCREMENT
-                # BOOLEAN é o equivalente ao TINYINT(1)
-                connection.execute(text("""
-                CREATE TABLE IF NOT EXISTS marcas (
-                    id SERIAL PRIMARY KEY,
-                    nome VARCHAR(100) NOT NULL UNIQUE
-                );
-                """))
-                print("Tabela 'marcas' criada ou já existente.")
-
-                connection.execute(text("""
-                CREATE TABLE IF NOT EXISTS modelos_celular (
-                    id SERIAL PRIMARY KEY,
-                    id_marca INTEGER NOT NULL REFERENCES marcas(id) ON DELETE RESTRICT ON UPDATE CASCADE,
-                    nome_modelo VARCHAR(150) NOT NULL
-                );
-                """))
-                print("Tabela 'modelos_celular' criada ou já existente.")
-
-                connection.execute(text("""
-                CREATE TABLE IF NOT EXISTS produtos (
-                    id SERIAL PRIMARY KEY,
-                    id_modelo_celular INTEGER NOT NULL REFERENCES modelos_celular(id) ON DELETE RESTRICT ON UPDATE CASCADE,
-                    nome VARCHAR(255) NOT NULL,
-                    tipo VARCHAR(50) NOT NULL,
-                    material VARCHAR(100),
-                    preco_venda DECIMAL(10, 2) NOT NULL
-                );
-                """))
-                print("Tabela 'produtos' criada ou já existente.")
-
-                connection.execute(text("""
-                CREATE TABLE IF NOT EXISTS estoque_variacoes (
-                    id SERIAL PRIMARY KEY,
-                    id_produto INTEGER NOT NULL REFERENCES produtos(id) ON DELETE RESTRICT ON UPDATE CASCADE,
-                    cor VARCHAR(50) NOT NULL DEFAULT 'N/A',
-                    url_foto VARCHAR(255),
-                    quantidade INTEGER NOT NULL DEFAULT 0,
-                    preco_custo DECIMAL(10, 2),
-                    disponivel_encomenda BOOLEAN NOT NULL DEFAULT TRUE,
-                    UNIQUE(id_produto, cor)
-                );
-                """))
-                print("Tabela 'estoque_variacoes' criada ou já existente.")
-
-                connection.execute(text("""
-                CREATE TABLE IF NOT EXISTS fornecedores (
-                    id SERIAL PRIMARY KEY,
-                    nome VARCHAR(150) NOT NULL,
-                    contato_telefone VARCHAR(25),
-                    contato_email VARCHAR(100)
-                );
-                """))
-                print("Tabela 'fornecedores' criada ou já existente.")
-
-                connection.execute(text("""
-                CREATE TABLE IF NOT EXISTS produtos_fornecedores (
-                    id_produto INTEGER NOT NULL REFERENCES produtos(id) ON DELETE RESTRICT ON UPDATE CASCADE,
-                    id_fornecedor INTEGER NOT NULL REFERENCES fornecedores(id) ON DELETE RESTRICT ON UPDATE CASCADE,
-                    PRIMARY KEY (id_produto, id_fornecedor)
-                );
-                """))
-                print("Tabela 'produtos_fornecedores' criada ou já existente.")
-
-                connection.execute(text("""
-                CREATE TABLE IF NOT EXISTS usuarios (
-                    id SERIAL PRIMARY KEY,
-                    username VARCHAR(100) NOT NULL UNIQUE,
-                    senha_hash VARCHAR(255) NOT NULL,
-                    role VARCHAR(50) NOT NULL CHECK (role IN ('admin', 'atendente'))
-                );
-                """))
-                print("Tabela 'usuarios' criada ou já existente.")
-
-                connection.execute(text("""
-                CREATE TABLE IF NOT EXISTS historico_estoque (
-                    id SERIAL PRIMARY KEY,
-                    id_variacao_estoque INTEGER NOT NULL REFERENCES estoque_variacoes(id) ON DELETE CASCADE,
-                    id_usuario INTEGER NOT NULL REFERENCES usuarios(id) ON DELETE RESTRICT,
-                    tipo_movimento VARCHAR(20) NOT NULL CHECK (tipo_movimento IN ('incremento', 'decremento')),
-                    quantidade_alterada INTEGER NOT NULL DEFAULT 1,
-                    preco_venda_momento DECIMAL(10, 2),
-                    preco_custo_momento DECIMAL(10, 2),
-                    data_hora TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                    nova_quantidade_estoque INTEGER NOT NULL
-                );
-                """))
-                print("Tabela 'historico_estoque' criada ou já existente.")
+                criar_tabelas(connection)
 
                 trans.commit()
                 print("\nTodas as tabelas foram criadas/verificadas com sucesso!")
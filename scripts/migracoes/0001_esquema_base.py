@@ -0,0 +1,10 @@
+# scripts/migracoes/0001_esquema_base.py
+
+from scripts.create_tables import criar_tabelas
+
+DESCRICAO = "Esquema base (tabelas de scripts/create_tables.py)"
+
+def aplicar(conexao):
+    # Idempotente (CREATE TABLE IF NOT EXISTS): numa base de dados já existente só
+    # regista a versão.
+    criar_tabelas(conexao)
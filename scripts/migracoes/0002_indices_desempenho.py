@@ -0,0 +1,30 @@
+# scripts/migracoes/0002_indices_desempenho.py
+
+from scripts.migracoes import criar_indice
+
+DESCRICAO = "Índices das queries mais frequentes (relatórios, histórico, catálogo)"
+TRANSACIONAL = False  # CREATE INDEX CONCURRENTLY
+
+# (nome, tabela, colunas, para que serve)
+INDICES = [
+    ("idx_historico_data_tipo", "historico_estoque", ["data_hora", "tipo_movimento"],
+     "relatório de movimentações por período e reconstrução de vendas_diarias"),
+    ("idx_historico_variacao", "historico_estoque", ["id_variacao_estoque"],
+     "histórico de uma variação e ON DELETE CASCADE ao apagar variações"),
+    ("idx_historico_usuario", "historico_estoque", ["id_usuario"],
+     "verificação do ON DELETE RESTRICT ao apagar utilizadores"),
+    ("idx_variacoes_produto", "estoque_variacoes", ["id_produto"],
+     "variações de um produto (detalhes, painel); normalmente já coberto pelo UNIQUE (id_produto, cor)"),
+    ("idx_variacoes_cor_id", "estoque_variacoes", ["cor", "id"],
+     "ordem e keyset (cor, id) da busca do catálogo na base de dados"),
+    ("idx_produtos_modelo", "produtos", ["id_modelo_celular"],
+     "junção modelo -> produtos na busca do catálogo e no autocompletar"),
+    ("idx_modelos_marca", "modelos_celular", ["id_marca"],
+     "junção marca -> modelos"),
+    ("idx_produtos_fornecedores_fornecedor", "produtos_fornecedores", ["id_fornecedor"],
+     "produtos de um fornecedor (a chave primária começa por id_produto)"),
+]
+
+def aplicar(conexao):
+    for nome, tabela, colunas, _ in INDICES:
+        criar_indice(conexao, nome, tabela, colunas)
@@ -0,0 +1,17 @@
+# scripts/migracoes/0003_conteudo_tarefas_imagens.py
+
+from sqlalchemy import text
+
+DESCRICAO = "Bytes da foto na própria tarefa de envio (tarefas_imagens.conteudo)"
+
+def aplicar(conexao):
+    # Idempotente: as bases de dados criadas depois desta versão já têm a coluna (0001)
+    if conexao.dialect.name == "postgresql":
+        conexao.execute(text("ALTER TABLE tarefas_imagens ADD COLUMN IF NOT EXISTS conteudo BYTEA"))
+        return
+    existe = conexao.execute(text("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = 'tarefas_imagens' AND column_name = 'conteudo'
+    """)).scalar()
+    if not existe:
+        conexao.execute(text("ALTER TABLE tarefas_imagens ADD COLUMN conteudo LONGBLOB"))
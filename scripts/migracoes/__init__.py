@@ -0,0 +1,51 @@
+# scripts/migracoes/__init__.py
+
+# Migrações versionadas aplicadas por scripts/migrar.py. Cada ficheiro NNNN_descricao.py
+# define `DESCRICAO` e `aplicar(conexao)`; com `TRANSACIONAL = False` corre em autocommit
+# (necessário para CREATE INDEX CONCURRENTLY no PostgreSQL). As versões aplicadas ficam
+# na tabela migracoes_aplicadas; uma migração nunca é alterada depois de publicada.
+
+from typing import List, Sequence
+
+from sqlalchemy import text
+
+def colunas_dos_indices(conexao, tabela: str) -> List[List[str]]:
+    """Colunas (por ordem) de cada índice existente na tabela, incluindo chaves primárias e UNIQUE."""
+    if conexao.dialect.name == "postgresql":
+        linhas = conexao.execute(text("""
+            SELECT i.indexrelid, a.attname
+            FROM pg_index i
+            JOIN pg_class t ON t.oid = i.indrelid
+            CROSS JOIN LATERAL unnest(i.indkey) WITH ORDINALITY AS k(attnum, posicao)
+            JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = k.attnum
+            WHERE t.relname = :tabela AND t.relnamespace = current_schema()::regnamespace
+            ORDER BY i.indexrelid, k.posicao
+        """), {"tabela": tabela}).all()
+    else:
+        linhas = conexao.execute(text("""
+            SELECT index_name, column_name
+            FROM information_schema.statistics
+            WHERE table_schema = DATABASE() AND table_name = :tabela
+            ORDER BY index_name, seq_in_index
+        """), {"tabela": tabela}).all()
+    indices = {}
+    for indice, coluna in linhas:
+        indices.setdefault(indice, []).append(coluna)
+    return list(indices.values())
+
+def criar_indice(conexao, nome: str, tabela: str, colunas: Sequence[str], concorrente: bool = True):
+    """
+    Cria o índice se nenhum índice existente já começar por estas colunas (ex.: o UNIQUE
+    (id_produto, cor) já serve as procuras por id_produto). No PostgreSQL usa CONCURRENTLY,
+    para não bloquear escritas em tabelas grandes (a migração tem de ser não transacional);
+    concorrente=False para tabelas novas, dentro de uma transação (criar_tabelas).
+    """
+    colunas = list(colunas)
+    if any(existentes[:len(colunas)] == colunas for existentes in colunas_dos_indices(conexao, tabela)):
+        print(f"  {tabela} ({', '.join(colunas)}): já coberto por um índice existente.")
+        return
+    if conexao.dialect.name == "postgresql":
+        conexao.execute(text(f"CREATE INDEX {'CONCURRENTLY ' if concorrente else ''}IF NOT EXISTS {nome} ON {tabela} ({', '.join(colunas)})"))
+    else:
+        conexao.execute(text(f"CREATE INDEX {nome} ON {tabela} ({', '.join(colunas)})"))
+    print(f"  Índice '{nome}' criado em {tabela} ({', '.join(colunas)}).")
@@ -0,0 +1,240 @@
+# scripts/migrar.py
+
+import os
+import sys
+import json
+import argparse
+import importlib.util
+from datetime import date, datetime, timedelta
+from sqlalchemy import create_engine, text
+
+# Adiciona o diretório raiz do projeto ao sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from scripts.utils import get_database_url, get_database_url_env
+
+# Aplica as migrações de scripts/migracoes/ que ainda não constam de migracoes_aplicadas,
+# por ordem de versão, sem perguntas (URL em MIGRACOES_DATABASE_URL ou DATABASE_URL), para
+# poder correr no deploy antes de a API arrancar. Um bloqueio na base de dados impede que
+# duas instâncias apliquem migrações ao mesmo tempo. Termina com código 1 se algo falhar.
+#
+#   python scripts/migrar.py                 # aplica as pendentes
+#   python scripts/migrar.py --estado        # lista aplicadas e pendentes
+#   python scripts/migrar.py --verificar     # EXPLAIN das queries críticas (ver abaixo)
+#   python scripts/migrar.py --interativo    # escolhe a base de dados como os outros scripts
+
+DIRETORIO_MIGRACOES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migracoes")
+CHAVE_BLOQUEIO = 72_617_001  # pg_advisory_lock; no MySQL, GET_LOCK('catalogo_migracoes')
+
+def carregar_migracoes():
+    """[(versao, modulo)] por ordem, a partir dos ficheiros NNNN_descricao.py."""
+    migracoes = []
+    for nome in sorted(os.listdir(DIRETORIO_MIGRACOES)):
+        if not nome.endswith(".py") or not nome[:4].isdigit():
+            continue
+        spec = importlib.util.spec_from_file_location(f"migracao_{nome[:-3]}", os.path.join(DIRETORIO_MIGRACOES, nome))
+        modulo = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(modulo)
+        migracoes.append((nome[:-3], modulo))
+    return migracoes
+
+def versoes_aplicadas(engine) -> dict:
+    with engine.begin() as conexao:
+        conexao.execute(text("""
+            CREATE TABLE IF NOT EXISTS migracoes_aplicadas (
+                versao VARCHAR(100) PRIMARY KEY,
+                descricao VARCHAR(255) NOT NULL,
+                aplicada_em TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+        """))
+        return {row.versao: row.aplicada_em for row in conexao.execute(text("SELECT versao, aplicada_em FROM migracoes_aplicadas"))}
+
+def _bloquear(conexao):
+    if conexao.dialect.name == "postgresql":
+        conexao.execute(text("SELECT pg_advisory_lock(:chave)"), {"chave": CHAVE_BLOQUEIO})
+    elif not conexao.execute(text("SELECT GET_LOCK('catalogo_migracoes', 600)")).scalar():
+        raise RuntimeError("Outra instância está a aplicar migrações (GET_LOCK expirou).")
+
+def _desbloquear(conexao):
+    if conexao.dialect.name == "postgresql":
+        conexao.execute(text("SELECT pg_advisory_unlock(:chave)"), {"chave": CHAVE_BLOQUEIO})
+    else:
+        conexao.execute(text("SELECT RELEASE_LOCK('catalogo_migracoes')"))
+
+def _registar(conexao, versao: str, modulo):
+    conexao.execute(text("INSERT INTO migracoes_aplicadas (versao, descricao) VALUES (:versao, :descricao)"),
+                    {"versao": versao, "descricao": getattr(modulo, "DESCRICAO", versao)[:255]})
+
+def aplicar_pendentes(engine) -> bool:
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as bloqueio:
+        _bloquear(bloqueio)
+        try:
+            # Lido depois do bloqueio: outra instância pode ter acabado de aplicar migrações
+            aplicadas = versoes_aplicadas(engine)
+            pendentes = [(versao, modulo) for versao, modulo in carregar_migracoes() if versao not in aplicadas]
+            if not pendentes:
+                print("Nenhuma migração pendente.")
+                return True
+            for versao, modulo in pendentes:
+                print(f"A aplicar {versao}: {getattr(modulo, 'DESCRICAO', '')}")
+                try:
+                    if getattr(modulo, "TRANSACIONAL", True):
+                        with engine.begin() as conexao:
+                            modulo.aplicar(conexao)
+                            _registar(conexao, versao, modulo)
+                    else:
+                        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conexao:
+                            modulo.aplicar(conexao)
+                            _registar(conexao, versao, modulo)
+                except Exception as e:
+                    print(f"ERRO na migração {versao}: {e}")
+                    return False
+            print(f"\n{len(pendentes)} migração(ões) aplicada(s) com sucesso!")
+            return True
+        finally:
+            _desbloquear(bloqueio)
+
+def mostrar_estado(engine):
+    aplicadas = versoes_aplicadas(engine)
+    for versao, modulo in carregar_migracoes():
+        estado = f"aplicada em {aplicadas[versao]}" if versao in aplicadas else "PENDENTE"
+        print(f"  {versao:<40} {estado}  {getattr(modulo, 'DESCRICAO', '')}")
+
+# --- Verificação dos planos de execução ---
+# As queries mais frequentes da API (com parâmetros representativos). Numa tabela grande,
+# um Seq Scan (PostgreSQL) ou type=ALL (MySQL) significa que falta um índice. As tabelas
+# com menos de --limiar-linhas linhas estimadas são ignoradas: aí o planner prefere, com
+# razão, ler a tabela inteira. O top de produtos com periodo=total lê a tabela toda por
+# natureza; só a janela de 30 dias do dashboard está incluída.
+TABELAS_GRANDES = {"historico_estoque", "estoque_variacoes", "produtos", "vendas_diarias", "produtos_fornecedores"}
+
+def consultas_criticas():
+    hoje = date.today()
+    periodo = {"inicio": datetime.combine(hoje - timedelta(days=6), datetime.min.time()),
+               "fim": datetime.combine(hoje + timedelta(days=1), datetime.min.time())}
+    return [
+        ("relatório de movimentações (GET /relatorios/movimentacoes-pdv)", """
+            SELECT h.id, h.data_hora, p.nome, ev.cor, u.username
+            FROM historico_estoque h
+            JOIN usuarios u ON h.id_usuario = u.id
+            JOIN estoque_variacoes ev ON h.id_variacao_estoque = ev.id
+            JOIN produtos p ON ev.id_produto = p.id
+            WHERE h.data_hora >= :inicio AND h.data_hora < :fim
+            ORDER BY h.data_hora DESC, h.id DESC
+            LIMIT 101
+        """, periodo),
+        ("histórico de uma variação (ON DELETE CASCADE)",
+         "SELECT id FROM historico_estoque WHERE id_variacao_estoque = :id", {"id": 1}),
+        ("variações de um produto (GET /estoque/produto/{id}, detalhes)",
+         "SELECT id, cor FROM estoque_variacoes WHERE id_produto = :id ORDER BY cor", {"id": 1}),
+        ("detalhes de uma variação (GET /produto/detalhes/{id})", """
+            SELECT ev.id, ev.cor, p.nome, m.nome_modelo
+            FROM estoque_variacoes ev
+            JOIN produtos p ON ev.id_produto = p.id
+            JOIN modelos_celular m ON p.id_modelo_celular = m.id
+            WHERE ev.id = :id
+        """, {"id": 1}),
+        ("busca do catálogo por modelo (GET /catalogo/search, sem índice em memória)", """
+            SELECT ev.id
+            FROM estoque_variacoes ev
+            JOIN produtos p ON ev.id_produto = p.id
+            JOIN modelos_celular m ON p.id_modelo_celular = m.id
+            WHERE m.id = :id_modelo
+            ORDER BY ev.cor, ev.id
+            LIMIT 101
+        """, {"id_modelo": 1}),
+        ("vendas por dia do dashboard (GET /relatorios/dashboard/vendas-por-dia)", """
+            SELECT dia, SUM(faturacao) FROM vendas_diarias
+            WHERE dia BETWEEN :inicio AND :fim
+            GROUP BY dia
+        """, {"inicio": hoje - timedelta(days=6), "fim": hoje}),
+        ("top de produtos do dashboard (GET /relatorios/dashboard/top-produtos?periodo=30d)", """
+            SELECT id_variacao_estoque, SUM(vendas) AS vendas FROM vendas_diarias
+            WHERE dia BETWEEN :inicio AND :fim
+            GROUP BY id_variacao_estoque
+            ORDER BY vendas DESC, id_variacao_estoque
+            LIMIT 5
+        """, {"inicio": hoje - timedelta(days=29), "fim": hoje}),
+        ("produtos de um fornecedor",
+         "SELECT id_produto FROM produtos_fornecedores WHERE id_fornecedor = :id", {"id": 1}),
+    ]
+
+def _linhas_estimadas(conexao) -> dict:
+    if conexao.dialect.name == "postgresql":
+        query = "SELECT relname, reltuples FROM pg_class WHERE relkind = 'r' AND relnamespace = current_schema()::regnamespace"
+    else:
+        query = "SELECT table_name, table_rows FROM information_schema.tables WHERE table_schema = DATABASE()"
+    return {nome: float(linhas or 0) for nome, linhas in conexao.execute(text(query))}
+
+def _tabelas_lidas_inteiras(conexao, sql: str, params: dict) -> list:
+    if conexao.dialect.name == "postgresql":
+        plano = conexao.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"), params).scalar()
+        if isinstance(plano, str):
+            plano = json.loads(plano)
+        tabelas, pilha = [], [plano[0]["Plan"]]
+        while pilha:
+            no = pilha.pop()
+            if no.get("Node Type") == "Seq Scan":
+                tabelas.append(no["Relation Name"])
+            pilha.extend(no.get("Plans", []))
+        return tabelas
+    return [row._mapping["table"] for row in conexao.execute(text(f"EXPLAIN {sql}"), params)
+            if row._mapping["type"] == "ALL"]
+
+def verificar_planos(engine, limiar: int, forcar_indices: bool) -> bool:
+    """
+    EXPLAIN de cada query crítica. Com --forcar-indices (PostgreSQL), desliga o Seq Scan no
+    planner e ignora o limiar: qualquer Seq Scan que reste numa tabela grande é um índice em falta,
+    mesmo numa base de dados de desenvolvimento com poucas linhas.
+    """
+    ok = True
+    with engine.connect() as conexao:
+        postgres = conexao.dialect.name == "postgresql"
+        if forcar_indices and postgres:
+            conexao.execute(text("SET LOCAL enable_seqscan = off"))
+            limiar = 0
+        linhas = _linhas_estimadas(conexao)
+        for descricao, sql, params in consultas_criticas():
+            lidas = sorted({t for t in _tabelas_lidas_inteiras(conexao, sql, params)
+                            if t in TABELAS_GRANDES and linhas.get(t, 0) >= limiar})
+            if lidas:
+                ok = False
+                print(f"  FALHA  {descricao}: leitura completa de {', '.join(lidas)}")
+            else:
+                print(f"  OK     {descricao}")
+        conexao.rollback()
+    print("\nPlanos verificados: " + ("sem leituras completas de tabelas grandes." if ok else "há queries sem índice adequado (ver FALHA)."))
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--estado", action="store_true", help="lista as migrações aplicadas e pendentes")
+    parser.add_argument("--verificar", action="store_true", help="verifica os planos das queries críticas")
+    parser.add_argument("--limiar-linhas", type=int, default=int(os.getenv("MIGRACOES_LIMIAR_LINHAS", "10000")),
+                        help="tamanho mínimo (linhas estimadas) para uma tabela contar como grande")
+    parser.add_argument("--forcar-indices", action="store_true", help="PostgreSQL: SET enable_seqscan = off na verificação")
+    parser.add_argument("--interativo", action="store_true", help="pergunta qual a base de dados (scripts/utils.py)")
+    args = parser.parse_args()
+
+    db_url = get_database_url() if args.interativo else get_database_url_env()
+    if not db_url:
+        sys.exit(1)
+    engine = create_engine(db_url)
+
+    try:
+        if args.estado:
+            mostrar_estado(engine)
+            return
+        if args.verificar:
+            if not verificar_planos(engine, args.limiar_linhas, args.forcar_indices):
+                sys.exit(1)
+            return
+        if not aplicar_pendentes(engine):
+            sys.exit(1)
+    except SystemExit:
+        raise
+    except Exception as e:
+        print(f"Falha ao conectar ao banco de dados: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
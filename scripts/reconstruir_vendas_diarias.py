@@ -0,0 +1,45 @@
+# scripts/reconstruir_vendas_diarias.py
+
+import os
+import sys
+import argparse
+from datetime import date
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+# Adiciona o diretório raiz do projeto ao sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from scripts.utils import get_database_url
+import vendas_diarias
+
+# Preenche (ou volta a calcular) o resumo vendas_diarias a partir de historico_estoque.
+# Sem argumentos, reconstrói tudo; com --desde/--ate, só esses dias:
+#
+#   python scripts/reconstruir_vendas_diarias.py
+#   python scripts/reconstruir_vendas_diarias.py --desde 2025-09-01 --ate 2025-09-30
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--desde", type=date.fromisoformat, default=None, help="primeiro dia (AAAA-MM-DD)")
+    parser.add_argument("--ate", type=date.fromisoformat, default=None, help="último dia (AAAA-MM-DD)")
+    args = parser.parse_args()
+
+    db_url = get_database_url()
+    if not db_url: return
+
+    try:
+        engine = create_engine(db_url)
+        with Session(engine) as db:
+            print("Conexão com o banco de dados estabelecida com sucesso!")
+            try:
+                linhas = vendas_diarias.reconstruir(db, args.desde, args.ate)
+                db.commit()
+                print(f"\nResumo reconstruído: {linhas} linhas (dia, variação) em 'vendas_diarias'.")
+            except Exception as e:
+                print(f"Ocorreu um erro ao reconstruir o resumo: {e}")
+                db.rollback()
+    except Exception as e:
+        print(f"Falha ao conectar ao banco de dados: {e}")
+
+if __name__ == "__main__":
+    run()
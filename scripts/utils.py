@@ -1,6 +1,10 @@
 # scripts/utils.py
 
+import json
 import os
+import urllib.error
+import urllib.parse
+import urllib.request
 from dotenv import load_dotenv
 
 # Carrega as variáveis de ambiente do ficheiro .env
@@ -30,4 +34,47 @@ def get_database_url():
             final_url = DATABASE_URL_ENV.replace("postgres://", "postgresql+psycopg2://", 1)
             return final_url + ("?sslmode=require" if "?sslmode=require" not in final_url else "")
         else:
-            print("Opção inválida. Por favor, digite '1' para Local ou '2' para Produção.")
\ No newline at end of file
+            print("Opção inválida. Por favor, digite '1' para Local ou '2' para Produção.")
+
+def get_database_url_env():
+    """
+    URL da base de dados sem perguntas, para execuções automáticas (deploy, CI):
+    MIGRACOES_DATABASE_URL ou, se não existir, DATABASE_URL. As URLs postgres:// são
+    convertidas para o driver psycopg2 e, com APP_ENV=production, exigem SSL (como database.py).
+    """
+    url = os.getenv("MIGRACOES_DATABASE_URL") or os.getenv("DATABASE_URL")
+    if not url:
+        print("ERRO: defina MIGRACOES_DATABASE_URL ou DATABASE_URL.")
+        return None
+    if url.startswith("postgres://") or url.startswith("postgresql://"):
+        url = url.replace("postgres://", "postgresql://", 1).replace("postgresql://", "postgresql+psycopg2://", 1)
+        if os.getenv("APP_ENV") == "production" and "sslmode" not in url:
+            url += ("&" if "?" in url else "?") + "sslmode=require"
+    return url
+
+def invalidar_utilizador_na_api(username: str):
+    """
+    Pede à API em execução que descarte o utilizador da sua cache de autenticação.
+    A invalidação só chega ao worker que atende o pedido; nos restantes a alteração é
+    vista quando a entrada expirar, e o tempo máximo é o `ttl_segundos` da resposta.
+    Requer API_URL e API_ADMIN_TOKEN no .env; sem eles, a alteração é vista pela API
+    quando a entrada expirar (AUTH_USER_CACHE_TTL, 60 s por defeito).
+    """
+    api_url = os.getenv("API_URL")
+    token = os.getenv("API_ADMIN_TOKEN")
+    if not api_url or not token:
+        print("Aviso: API_URL/API_ADMIN_TOKEN não definidos; a API verá a alteração quando a cache de utilizadores expirar.")
+        return
+    url = f"{api_url.rstrip('/')}/sistema/cache/utilizadores/{urllib.parse.quote(username)}"
+    pedido = urllib.request.Request(url, method="DELETE", headers={"Authorization": f"Bearer {token}"})
+    try:
+        with urllib.request.urlopen(pedido, timeout=10) as resposta:
+            corpo = json.loads(resposta.read() or b"{}")
+    except (urllib.error.URLError, OSError, ValueError) as e:
+        print(f"Aviso: não foi possível invalidar a cache da API ({e}); a alteração será vista quando a entrada expirar.")
+        return
+    ttl = corpo.get("ttl_segundos")
+    if ttl is None:
+        print("Cache de utilizadores da API invalidada.")
+    else:
+        print(f"Cache de utilizadores da API invalidada num worker; os restantes veem a alteração em até {ttl:g} s.")
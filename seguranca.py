@@ -1,14 +1,20 @@
 # seguranca.py
 
 import os
+import time
+import uuid
+import asyncio
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from typing import Optional, Tuple
 
 # Imports para as novas funções de dependência
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 from database import get_db
@@ -23,8 +29,34 @@ if SECRET_KEY is None:
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 480 # 8 horas
 
+# --- Cache de utilizadores autenticados ---
+# Evita o SELECT em `usuarios` a cada pedido protegido. As entradas expiram após o TTL,
+# por isso uma alteração feita fora da API (ex.: scripts) é vista no máximo após esse tempo.
+USER_CACHE_TTL_SEGUNDOS = float(os.getenv("AUTH_USER_CACHE_TTL", "60"))
+USER_CACHE_MAX_ENTRADAS = int(os.getenv("AUTH_USER_CACHE_MAX", "10000"))
+# Com AUTH_CONFIAR_CLAIMS=true, o papel assinado no token é aceite sem consultar a BD.
+# Uma mudança de papel só tem efeito quando o utilizador voltar a fazer login.
+CONFIAR_CLAIMS = os.getenv("AUTH_CONFIAR_CLAIMS", "false").lower() in ("1", "true", "sim")
+
+# --- Verificação de senhas no login ---
+# O bcrypt é deliberadamente lento (~0,2 s por verificação). Corre num executor próprio e
+# limitado, para que uma vaga de logins no início do turno não ocupe o threadpool usado
+# pelas vendas. AUTH_HASH_PROCESSOS=true usa processos em vez de threads.
+HASH_WORKERS = int(os.getenv("AUTH_HASH_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+HASH_PROCESSOS = os.getenv("AUTH_HASH_PROCESSOS", "false").lower() in ("1", "true", "sim")
+# Logins à espera de verificação acima deste limite recebem 503 em vez de se acumularem.
+LOGIN_MAX_PENDENTES = int(os.getenv("AUTH_LOGIN_MAX_PENDENTES", "64"))
+
+# Custo do bcrypt. Hashes guardados com um custo inferior são refeitos no próximo login.
+BCRYPT_ROUNDS = int(os.getenv("AUTH_BCRYPT_ROUNDS", "12"))
+
 # --- Hashing de Senhas ---
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+)
 
 # --- OAuth2 Scheme ---
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
@@ -41,51 +73,174 @@ def gerar_hash_senha(senha: str) -> str:
     """
     return pwd_context.hash(senha)
 
+def verificar_e_atualizar_senha(senha_plana: str, senha_hash: str) -> Tuple[bool, Optional[str]]:
+    """
+    Verifica a senha e, se o hash usar parâmetros desatualizados (ex.: custo do bcrypt
+    inferior ao atual), devolve também um novo hash para substituir o guardado.
+    """
+    return pwd_context.verify_and_update(senha_plana, senha_hash)
+
+_executor_hash: Optional[Executor] = None
+_executor_lock = threading.Lock()
+_logins_pendentes = 0
+
+def _obter_executor_hash() -> Executor:
+    global _executor_hash
+    with _executor_lock:
+        if _executor_hash is None:
+            if HASH_PROCESSOS:
+                _executor_hash = ProcessPoolExecutor(max_workers=HASH_WORKERS)
+            else:
+                _executor_hash = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="bcrypt")
+        return _executor_hash
+
+async def verificar_senha_login(senha_plana: str, senha_hash: str) -> Tuple[bool, Optional[str]]:
+    """
+    Versão assíncrona de `verificar_e_atualizar_senha` para o endpoint /token, executada no
+    executor dedicado. Recusa com 503 quando há demasiados logins à espera.
+    """
+    global _logins_pendentes
+    if _logins_pendentes >= LOGIN_MAX_PENDENTES:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Demasiados pedidos de login em simultâneo. Tente novamente dentro de instantes.",
+            headers={"Retry-After": "1"},
+        )
+    _logins_pendentes += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_obter_executor_hash(), verificar_e_atualizar_senha, senha_plana, senha_hash)
+    finally:
+        _logins_pendentes -= 1
+
+def encerrar_executor_hash():
+    global _executor_hash
+    with _executor_lock:
+        if _executor_hash is not None:
+            _executor_hash.shutdown(wait=False, cancel_futures=True)
+            _executor_hash = None
+
 # --- Funções de Token JWT ---
 
 def criar_access_token(data: dict) -> str:
     """
-    Cria um novo token de acesso (JWT).
+    Cria um novo token de acesso (JWT), com um identificador único (jti).
     """
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "jti": uuid.uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def verificar_token(token: str) -> Optional[str]:
+def decodificar_token(token: str) -> Optional[dict]:
     """
-    Verifica um token e devolve o nome de utilizador (subject) se for válido.
+    Verifica um token e devolve as suas claims se for válido e tiver um subject.
     """
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            return None
-        return username
     except JWTError:
         return None
+    if payload.get("sub") is None:
+        return None
+    return payload
+
+def verificar_token(token: str) -> Optional[str]:
+    """
+    Verifica um token e devolve o nome de utilizador (subject) se for válido.
+    """
+    payload = decodificar_token(token)
+    return payload["sub"] if payload else None
+
+class CacheUtilizadores:
+    """
+    Cache em memória de (username, jti) -> utilizador, com TTL curto e tamanho limitado.
+
+    A cache é por processo: invalidar() só limpa o worker que a executa. Com vários
+    workers, o TTL é o limite real para uma alteração de senha ou de função ser vista.
+    """
+
+    def __init__(self, ttl: float, max_entradas: int):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self._lock = threading.Lock()
+        self._entradas = {}
+
+    def obter(self, username: str, jti: Optional[str]) -> Optional[dict]:
+        with self._lock:
+            entrada = self._entradas.get((username, jti))
+            if entrada is None:
+                return None
+            if entrada[0] <= time.monotonic():
+                del self._entradas[(username, jti)]
+                return None
+            return entrada[1]
+
+    def guardar(self, username: str, jti: Optional[str], utilizador: dict):
+        if self.ttl <= 0:
+            return
+        agora = time.monotonic()
+        with self._lock:
+            if len(self._entradas) >= self.max_entradas:
+                self._entradas = {k: v for k, v in self._entradas.items() if v[0] > agora}
+                if len(self._entradas) >= self.max_entradas:
+                    self._entradas.pop(next(iter(self._entradas)))
+            self._entradas[(username, jti)] = (agora + self.ttl, utilizador)
+
+    def invalidar(self, username: str) -> int:
+        """Remove todas as entradas de um utilizador (todas as sessões/tokens)."""
+        with self._lock:
+            chaves = [chave for chave in self._entradas if chave[0] == username]
+            for chave in chaves:
+                del self._entradas[chave]
+            return len(chaves)
+
+    def limpar(self):
+        with self._lock:
+            self._entradas.clear()
+
+cache_utilizadores = CacheUtilizadores(USER_CACHE_TTL_SEGUNDOS, USER_CACHE_MAX_ENTRADAS)
+
+def invalidar_utilizador(username: str) -> int:
+    """
+    Deve ser chamada sempre que a senha, o papel ou a existência de um utilizador mudam.
+    Só afeta este processo; os restantes workers veem a alteração ao fim de USER_CACHE_TTL_SEGUNDOS.
+    """
+    return cache_utilizadores.invalidar(username)
 
 # --- Funções de Dependência de Utilizador ---
 
 def get_user_from_db(db: Session, username: str):
     """Função auxiliar para obter o utilizador da BD."""
-    query = text("SELECT username, role FROM usuarios WHERE username = :username")
+    query = text("SELECT username, role, id FROM usuarios WHERE username = :username")
     return db.execute(query, {"username": username}).first()
 
 async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    """Dependência para obter o utilizador atual a partir do token."""
-    username = verificar_token(token)
-    if username is None:
+    """
+    Dependência para obter o utilizador atual a partir do token: {"username", "role", "id"}.
+    Tokens emitidos antes da claim `uid` obtêm o ID pela cache/BD.
+    """
+    payload = decodificar_token(token)
+    if payload is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Token inválido ou expirado",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    user = get_user_from_db(db, username)
+    username = payload["sub"]
+    if CONFIAR_CLAIMS and payload.get("role") and payload.get("uid"):
+        return {"username": username, "role": payload["role"], "id": payload["uid"]}
+
+    jti = payload.get("jti")
+    utilizador = cache_utilizadores.obter(username, jti)
+    if utilizador is not None:
+        return dict(utilizador)
+    # A consulta é síncrona: corre no threadpool para não bloquear o event loop.
+    user = await run_in_threadpool(get_user_from_db, db, username)
     if user is None:
         raise HTTPException(status_code=401, detail="Utilizador não encontrado")
-    return {"username": user[0], "role": user[1]}
+    utilizador = {"username": user[0], "role": user[1], "id": user[2]}
+    cache_utilizadores.guardar(username, jti, utilizador)
+    return dict(utilizador)
 
 async def get_current_admin_user(current_user: dict = Depends(get_current_user)):
     """Dependência para garantir que o utilizador é um administrador."""
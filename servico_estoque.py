@@ -0,0 +1,299 @@
+# servico_estoque.py
+
+# Todas as alterações de quantidade em estoque_variacoes passam por aqui. Cada operação é
+# um UPDATE condicional (só altera a linha se houver estoque suficiente) seguido do registo
+# em historico_estoque, sem SELECT ... FOR UPDATE prévio. O ID do utilizador vem do token.
+# No PostgreSQL, UPDATE e INSERT vão juntos numa CTE (uma ida à base de dados); no MySQL,
+# que não tem UPDATE ... RETURNING, o INSERT lê a linha já bloqueada pelo UPDATE.
+# As funções não fazem commit: a transação pertence ao router que as chama.
+# Com HISTORICO_DIFERIDO=true, as linhas de histórico (com preços e data/hora lidos na
+# transação) não são inseridas aqui: seguem para historico_diferido depois do commit.
+# As vendas somam-se também ao resumo vendas_diarias, sempre na própria transação.
+
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Dict, List, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+import historico_diferido
+import vendas_diarias
+
+COLUNAS_HISTORICO = """
+    historico_estoque (id_variacao_estoque, id_usuario, tipo_movimento, quantidade_alterada,
+                       nova_quantidade_estoque, preco_venda_momento, preco_custo_momento)
+"""
+# Máximo de variações (ou linhas de histórico) por instrução nas operações em lote
+TAMANHO_BLOCO = 500
+
+def _postgres(db: Session) -> bool:
+    return db.get_bind().dialect.name == 'postgresql'
+
+def _linha_historico(variacao_id: int, id_usuario: int, tipo: str, quantidade: int, nova_quantidade: int,
+                     preco_venda, preco_custo, data_hora) -> dict:
+    """Linha de historico_estoque entregue a historico_diferido e a vendas_diarias."""
+    return {
+        "id_variacao_estoque": variacao_id, "id_usuario": id_usuario, "tipo_movimento": tipo,
+        "quantidade_alterada": quantidade, "nova_quantidade_estoque": nova_quantidade,
+        "preco_venda_momento": preco_venda, "preco_custo_momento": preco_custo, "data_hora": data_hora,
+    }
+
+def _erro_sem_alteracao(db: Session, variacao_id: int):
+    """O UPDATE condicional não alterou nada: distingue variação inexistente de estoque insuficiente."""
+    existe = db.execute(text("SELECT 1 FROM estoque_variacoes WHERE id = :id"), {"id": variacao_id}).scalar()
+    if not existe:
+        raise HTTPException(status_code=404, detail="Variação de estoque não encontrada.")
+    raise HTTPException(status_code=400, detail="Estoque insuficiente para realizar a venda.")
+
+def registar_movimento(db: Session, variacao_id: int, quantidade: int, id_usuario: int) -> int:
+    """
+    Venda (quantidade negativa) ou reposição (positiva) de uma variação. As vendas guardam
+    no histórico o preço de venda e de custo do momento. Devolve a nova quantidade.
+    """
+    venda = quantidade < 0
+    params = {
+        "id": variacao_id, "delta": quantidade, "minimo": -quantidade if venda else 0,
+        "id_usuario": id_usuario, "tipo": 'decremento' if venda else 'incremento', "qtd": abs(quantidade),
+    }
+    precos = "p.preco_venda, ev.preco_custo" if venda else "NULL, NULL"
+    diferido = historico_diferido.ATIVO
+    # Nas vendas e com o histórico diferido, a mesma leitura devolve os valores da linha de histórico
+    colunas_historico = "ev.quantidade, p.preco_venda AS preco_venda, ev.preco_custo AS preco_custo, LOCALTIMESTAMP AS data_hora"
+    if not venda:
+        colunas_historico = "ev.quantidade, NULL AS preco_venda, NULL AS preco_custo, LOCALTIMESTAMP AS data_hora"
+
+    if _postgres(db):
+        historico = "" if diferido else f""", historico AS (
+                INSERT INTO {COLUNAS_HISTORICO}
+                SELECT ev.id, :id_usuario, :tipo, :qtd, ev.quantidade, {precos}
+                FROM alterada ev JOIN produtos p ON p.id = ev.id_produto
+            )"""
+        query = text(f"""
+            WITH alterada AS (
+                UPDATE estoque_variacoes SET quantidade = quantidade + :delta
+                WHERE id = :id AND quantidade >= :minimo
+                RETURNING id, quantidade, preco_custo, id_produto
+            ){historico}
+            SELECT {colunas_historico if diferido or venda else "ev.quantidade"}
+            FROM alterada ev JOIN produtos p ON p.id = ev.id_produto
+        """)
+        linha = db.execute(query, params).first()
+        if linha is None:
+            _erro_sem_alteracao(db, variacao_id)
+    else:
+        resultado = db.execute(text("""
+            UPDATE estoque_variacoes SET quantidade = quantidade + :delta
+            WHERE id = :id AND quantidade >= :minimo
+        """), params)
+        if resultado.rowcount == 0:
+            _erro_sem_alteracao(db, variacao_id)
+        if not diferido:
+            db.execute(text(f"""
+                INSERT INTO {COLUNAS_HISTORICO}
+                SELECT ev.id, :id_usuario, :tipo, :qtd, ev.quantidade, {precos}
+                FROM estoque_variacoes ev JOIN produtos p ON p.id = ev.id_produto
+                WHERE ev.id = :id
+            """), params)
+        if not (diferido or venda):
+            return db.execute(text("SELECT quantidade FROM estoque_variacoes WHERE id = :id"), params).scalar()
+        linha = db.execute(text(f"""
+            SELECT {colunas_historico}
+            FROM estoque_variacoes ev JOIN produtos p ON p.id = ev.id_produto
+            WHERE ev.id = :id
+        """), params).first()
+
+    if diferido or venda:
+        historico = [_linha_historico(variacao_id, id_usuario, params["tipo"], params["qtd"], linha.quantidade,
+                                      linha.preco_venda, linha.preco_custo, linha.data_hora)]
+        if diferido:
+            historico_diferido.adiar(db, historico)
+        if venda:
+            vendas_diarias.acumular(db, historico)
+    return linha.quantidade
+
+def registar_compra(db: Session, variacao_id: int, quantidade: int, custo_unitario: Decimal, id_usuario: int) -> Tuple[int, Decimal]:
+    """
+    Entrada de uma compra: soma a quantidade e recalcula o custo médio ponderado no próprio
+    UPDATE. Devolve (nova quantidade, novo custo médio).
+    """
+    params = {"id": variacao_id, "qtd": quantidade, "custo": custo_unitario, "id_usuario": id_usuario}
+    # No MySQL as atribuições do SET são avaliadas por ordem e veem os valores já alterados:
+    # o custo tem de ser calculado antes de a quantidade mudar.
+    atribuicoes = """
+        preco_custo = CASE WHEN quantidade + :qtd > 0
+                           THEN (quantidade * COALESCE(preco_custo, 0) + :qtd * :custo) / (quantidade + :qtd)
+                           ELSE 0 END,
+        quantidade = quantidade + :qtd
+    """
+
+    diferido = historico_diferido.ATIVO
+
+    if _postgres(db):
+        historico = "" if diferido else f""", historico AS (
+                INSERT INTO {COLUNAS_HISTORICO}
+                SELECT a.id, :id_usuario, 'incremento', :qtd, a.quantidade, NULL, :custo
+                FROM alterada a
+            )"""
+        query = text(f"""
+            WITH alterada AS (
+                UPDATE estoque_variacoes SET {atribuicoes}
+                WHERE id = :id
+                RETURNING id, quantidade, preco_custo
+            ){historico}
+            SELECT quantidade, preco_custo, LOCALTIMESTAMP AS data_hora FROM alterada
+        """)
+        linha = db.execute(query, params).first()
+        if linha is None:
+            raise HTTPException(status_code=404, detail="Variação de estoque não encontrada.")
+        if diferido:
+            historico_diferido.adiar(db, [_linha_historico(variacao_id, id_usuario, 'incremento', quantidade, linha.quantidade,
+                                                           None, custo_unitario, linha.data_hora)])
+        return linha.quantidade, linha.preco_custo
+
+    resultado = db.execute(text(f"UPDATE estoque_variacoes SET {atribuicoes} WHERE id = :id"), params)
+    if resultado.rowcount == 0:
+        raise HTTPException(status_code=404, detail="Variação de estoque não encontrada.")
+    linha = db.execute(text("SELECT quantidade, preco_custo, LOCALTIMESTAMP AS data_hora FROM estoque_variacoes WHERE id = :id"), params).first()
+    if diferido:
+        historico_diferido.adiar(db, [_linha_historico(variacao_id, id_usuario, 'incremento', quantidade, linha.quantidade,
+                                                       None, custo_unitario, linha.data_hora)])
+        return linha.quantidade, linha.preco_custo
+    db.execute(text(f"""
+        INSERT INTO {COLUNAS_HISTORICO}
+        VALUES (:id, :id_usuario, 'incremento', :qtd, :nova_qtd, NULL, :custo)
+    """), {**params, "nova_qtd": linha.quantidade})
+    return linha.quantidade, linha.preco_custo
+
+def vender_carrinho(db: Session, quantidades: Dict[int, int], id_usuario: int) -> Tuple[Dict[int, int], Decimal]:
+    """
+    Venda de vários itens ({variacao_id: quantidade}). As linhas são bloqueadas por ordem de
+    ID (evita deadlocks entre vendas simultâneas) para validar o carrinho inteiro antes de
+    alterar qualquer uma; depois, um único UPDATE e um único INSERT com várias linhas.
+    Devolve ({variacao_id: nova quantidade}, total da venda).
+    """
+    ids = sorted(quantidades)
+    params = {f"id{i}": variacao_id for i, variacao_id in enumerate(ids)}
+    params.update({f"qtd{i}": quantidades[variacao_id] for i, variacao_id in enumerate(ids)})
+    params["id_usuario"] = id_usuario
+    marcadores = ", ".join(f":id{i}" for i in range(len(ids)))
+
+    # 1. Bloqueia apenas as linhas de estoque_variacoes (o preço de venda vem de uma subconsulta)
+    variacoes = {row.id: row for row in db.execute(text(f"""
+        SELECT ev.id, ev.quantidade, ev.preco_custo, LOCALTIMESTAMP AS data_hora,
+               (SELECT p.preco_venda FROM produtos p WHERE p.id = ev.id_produto) AS preco_venda
+        FROM estoque_variacoes ev
+        WHERE ev.id IN ({marcadores})
+        ORDER BY ev.id
+        FOR UPDATE
+    """), params).all()}
+
+    # 2. Valida todo o carrinho antes de alterar qualquer linha
+    em_falta = [variacao_id for variacao_id in ids if variacao_id not in variacoes]
+    if em_falta:
+        raise HTTPException(status_code=404, detail=f"Variações de estoque não encontradas: {', '.join(map(str, em_falta))}.")
+    sem_estoque = [
+        {"variacao_id": variacao_id, "disponivel": variacoes[variacao_id].quantidade, "pedido": quantidades[variacao_id]}
+        for variacao_id in ids if variacoes[variacao_id].quantidade < quantidades[variacao_id]
+    ]
+    if sem_estoque:
+        raise HTTPException(status_code=400, detail={"mensagem": "Estoque insuficiente para realizar a venda.", "itens": sem_estoque})
+
+    # 3. Um único UPDATE para todas as variações (as linhas já estão bloqueadas e validadas)
+    casos = " ".join(f"WHEN :id{i} THEN :qtd{i}" for i in range(len(ids)))
+    db.execute(text(f"UPDATE estoque_variacoes SET quantidade = quantidade - CASE id {casos} END WHERE id IN ({marcadores})"), params)
+
+    # 4. Histórico num único INSERT com várias linhas, com os preços do momento
+    novas_quantidades = {variacao_id: variacoes[variacao_id].quantidade - quantidades[variacao_id] for variacao_id in ids}
+    historico = [
+        _linha_historico(variacao_id, id_usuario, 'decremento', quantidades[variacao_id], novas_quantidades[variacao_id],
+                         variacoes[variacao_id].preco_venda, variacoes[variacao_id].preco_custo, variacoes[variacao_id].data_hora)
+        for variacao_id in ids
+    ]
+    if historico_diferido.ATIVO:
+        historico_diferido.adiar(db, historico)
+    else:
+        linhas = []
+        for i, h in enumerate(historico):
+            linhas.append(f"(:id{i}, :id_usuario, 'decremento', :qtd{i}, :nova{i}, :venda{i}, :custo{i})")
+            params[f"nova{i}"] = h["nova_quantidade_estoque"]
+            params[f"venda{i}"] = h["preco_venda_momento"]
+            params[f"custo{i}"] = h["preco_custo_momento"]
+        db.execute(text(f"INSERT INTO {COLUNAS_HISTORICO} VALUES {', '.join(linhas)}"), params)
+    vendas_diarias.acumular(db, historico)
+
+    total = sum((Decimal(variacoes[variacao_id].preco_venda) * quantidades[variacao_id] for variacao_id in ids), Decimal('0'))
+    return novas_quantidades, total
+
+def _blocos(itens: list, tamanho: int):
+    for inicio in range(0, len(itens), tamanho):
+        yield itens[inicio:inicio + tamanho]
+
+def registar_compras(db: Session, compras: List[Tuple[int, int, int, Decimal]], id_usuario: int) -> Tuple[Dict[int, Tuple[int, Decimal]], List[dict]]:
+    """
+    Entrada de várias compras [(linha, variacao_id, quantidade, custo_unitario)], por exemplo
+    a remessa de um fornecedor. As variações são bloqueadas por ordem de ID e o novo custo
+    médio ponderado de cada uma é calculado de uma vez em Decimal (várias linhas da mesma
+    variação acumulam por ordem). Depois, um UPDATE por bloco de variações e o histórico
+    (uma linha por compra) num INSERT com várias linhas.
+    Devolve ({variacao_id: (nova quantidade, novo custo médio)}, [erros por linha]).
+    """
+    ids = sorted({variacao_id for _, variacao_id, _, _ in compras})
+    variacoes = {}
+    for bloco in _blocos(ids, TAMANHO_BLOCO):
+        params = {f"id{i}": variacao_id for i, variacao_id in enumerate(bloco)}
+        variacoes.update({row.id: row for row in db.execute(text(f"""
+            SELECT id, quantidade, preco_custo, LOCALTIMESTAMP AS data_hora
+            FROM estoque_variacoes
+            WHERE id IN ({", ".join(f":id{i}" for i in range(len(bloco)))})
+            ORDER BY id
+            FOR UPDATE
+        """), params).all()})
+
+    erros = [{"linha": linha, "variacao_id": variacao_id, "erro": "Variação de estoque não encontrada."}
+             for linha, variacao_id, _, _ in compras if variacao_id not in variacoes]
+
+    # Custo médio ponderado acumulado por variação, pela ordem das linhas (igual a registar
+    # as compras uma a uma, mas sem arredondar o custo entre linhas)
+    estado = {variacao_id: (row.quantidade, Decimal(row.preco_custo or 0)) for variacao_id, row in variacoes.items()}
+    historico = []
+    for linha, variacao_id, quantidade, custo_unitario in compras:
+        if variacao_id not in estado:
+            continue
+        qtd_atual, custo_atual = estado[variacao_id]
+        nova_qtd = qtd_atual + quantidade
+        novo_custo = (qtd_atual * custo_atual + quantidade * custo_unitario) / nova_qtd if nova_qtd > 0 else Decimal('0')
+        estado[variacao_id] = (nova_qtd, novo_custo)
+        historico.append(_linha_historico(variacao_id, id_usuario, 'incremento', quantidade, nova_qtd,
+                                          None, custo_unitario, variacoes[variacao_id].data_hora))
+
+    # preco_custo é DECIMAL(10, 2): arredonda só o resultado final de cada variação
+    finais = {variacao_id: (estado[variacao_id][0], estado[variacao_id][1].quantize(Decimal('0.01'), ROUND_HALF_UP))
+              for variacao_id in sorted({h["id_variacao_estoque"] for h in historico})}
+    for bloco in _blocos(list(finais), TAMANHO_BLOCO):
+        params = {}
+        for i, variacao_id in enumerate(bloco):
+            params[f"id{i}"] = variacao_id
+            params[f"qtd{i}"], params[f"custo{i}"] = finais[variacao_id]
+        casos_qtd = " ".join(f"WHEN :id{i} THEN :qtd{i}" for i in range(len(bloco)))
+        casos_custo = " ".join(f"WHEN :id{i} THEN :custo{i}" for i in range(len(bloco)))
+        db.execute(text(f"""
+            UPDATE estoque_variacoes
+            SET preco_custo = CASE id {casos_custo} END, quantidade = CASE id {casos_qtd} END
+            WHERE id IN ({", ".join(f":id{i}" for i in range(len(bloco)))})
+        """), params)
+
+    if historico_diferido.ATIVO:
+        historico_diferido.adiar(db, historico)
+    else:
+        for bloco in _blocos(historico, TAMANHO_BLOCO):
+            linhas, params = [], {"id_usuario": id_usuario}
+            for i, h in enumerate(bloco):
+                linhas.append(f"(:id{i}, :id_usuario, 'incremento', :qtd{i}, :nova{i}, NULL, :custo{i})")
+                params[f"id{i}"] = h["id_variacao_estoque"]
+                params[f"qtd{i}"] = h["quantidade_alterada"]
+                params[f"nova{i}"] = h["nova_quantidade_estoque"]
+                params[f"custo{i}"] = h["preco_custo_momento"]
+            db.execute(text(f"INSERT INTO {COLUNAS_HISTORICO} VALUES {', '.join(linhas)}"), params)
+
+    return finais, erros
@@ -0,0 +1,277 @@
+# tarefas_imagens.py
+
+import io
+import os
+import hashlib
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+import armazenamento_imagens
+import eventos_catalogo
+
+# Envio e remoção de fotos em segundo plano. Com IMAGENS_SEGUNDO_PLANO=true, criar ou editar
+# uma variação regista uma tarefa em `tarefas_imagens` com os bytes da foto (coluna
+# `conteudo`), na mesma transação da variação: o pedido responde sem esperar pelo
+# Cloudinary. Um thread da aplicação processa as tarefas e preenche url_foto quando o envio
+# termina. Como a foto está na base de dados, qualquer instância pode processar a tarefa,
+# mesmo depois de um reinício num disco efémero (Render).
+#
+# - Enquanto há um envio por concluir, a variação está com a foto pendente (e, numa
+#   edição, mantém a foto anterior, que só é apagada depois de a nova estar disponível).
+# - Falhas são repetidas com backoff exponencial (IMAGENS_BACKOFF_SEGUNDOS, até
+#   IMAGENS_BACKOFF_MAX_SEGUNDOS); ao fim de IMAGENS_MAX_TENTATIVAS a tarefa fica 'falhada'.
+# - As remoções são tarefas com uma chave por URL: pedir duas vezes a remoção da mesma
+#   imagem gera uma só tarefa.
+# - Um novo envio para a mesma variação cancela o anterior ainda por concluir.
+# - As tarefas 'em_curso' há mais de IMAGENS_RESERVA_MINUTOS (processo terminado a meio)
+#   voltam a 'pendente'.
+# - Um envio sem foto (tarefas antigas, com o ficheiro num disco local entretanto perdido)
+#   fica logo 'falhada', com o erro registado, em vez de esgotar as tentativas.
+
+ATIVO = os.getenv("IMAGENS_SEGUNDO_PLANO", "false").lower() in ("1", "true", "sim")
+INTERVALO_SEGUNDOS = float(os.getenv("IMAGENS_INTERVALO_SEGUNDOS", "5"))
+MAX_TENTATIVAS = int(os.getenv("IMAGENS_MAX_TENTATIVAS", "8"))
+BACKOFF_SEGUNDOS = float(os.getenv("IMAGENS_BACKOFF_SEGUNDOS", "10"))
+BACKOFF_MAX_SEGUNDOS = float(os.getenv("IMAGENS_BACKOFF_MAX_SEGUNDOS", "3600"))
+RESERVA_MINUTOS = int(os.getenv("IMAGENS_RESERVA_MINUTOS", "10"))
+
+def _agora() -> datetime:
+    # Datas gravadas pela aplicação, em UTC, para não depender do fuso do servidor da BD
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def _backoff(tentativas: int) -> timedelta:
+    return timedelta(seconds=min(BACKOFF_SEGUNDOS * 2 ** (tentativas - 1), BACKOFF_MAX_SEGUNDOS))
+
+def _apagar_ficheiro(caminho: Optional[str]):
+    if caminho and os.path.exists(caminho):
+        os.remove(caminho)
+
+# --- Agendamento (chamado pelos routers, dentro da transação do pedido) ---
+def foto_pendente_sql(alias: str) -> str:
+    """Expressão SQL que indica se a variação `alias` tem um envio de foto por concluir."""
+    if not ATIVO:
+        return "FALSE"
+    return f"""EXISTS (SELECT 1 FROM tarefas_imagens t
+                       WHERE t.tipo = 'enviar' AND t.id_variacao = {alias}.id AND t.estado IN ('pendente', 'em_curso'))"""
+
+def agendar_envio(db: Session, variacao_id: int, ficheiro, nome: str, url_anterior: Optional[str] = None):
+    """Regista o envio com os bytes da foto. A foto anterior é apagada quando a nova estiver disponível."""
+    cancelar_envios(db, variacao_id)
+    db.execute(text("""
+        INSERT INTO tarefas_imagens (tipo, id_variacao, conteudo, nome_original, url, estado, tentativas, proxima_tentativa, criado_em)
+        VALUES ('enviar', :id_variacao, :conteudo, :nome, :url, 'pendente', 0, :agora, :agora)
+    """), {"id_variacao": variacao_id, "conteudo": ficheiro.read(), "nome": nome, "url": url_anterior, "agora": _agora()})
+
+def cancelar_envios(db: Session, variacao_id: int):
+    """Cancela os envios por concluir da variação (substituída ou removida)."""
+    db.execute(text("""
+        UPDATE tarefas_imagens SET estado = 'cancelada'
+        WHERE tipo = 'enviar' AND id_variacao = :id AND estado IN ('pendente', 'em_curso')
+    """), {"id": variacao_id})
+
+def agendar_remocao(db: Session, url: Optional[str]):
+    """Regista a remoção de uma imagem; pedidos repetidos para o mesmo URL são ignorados."""
+    if not url:
+        return
+    params = {"url": url, "chave": hashlib.sha256(url.encode()).hexdigest(), "agora": _agora()}
+    valores = "('apagar', :url, :chave, 'pendente', 0, :agora, :agora)"
+    colunas = "(tipo, url, chave, estado, tentativas, proxima_tentativa, criado_em)"
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(text(f"INSERT INTO tarefas_imagens {colunas} VALUES {valores} ON CONFLICT (chave) DO NOTHING"), params)
+    else:
+        db.execute(text(f"INSERT IGNORE INTO tarefas_imagens {colunas} VALUES {valores}"), params)
+
+# --- Processamento ---
+class FotoEmFalta(Exception):
+    """Envio sem foto para enviar: repetir não resolve."""
+
+class ProcessadorTarefas:
+    """Thread que executa as tarefas vencidas, em paralelo no executor de armazenamento_imagens."""
+
+    def __init__(self, fabrica_sessao, intervalo: float, lote: int):
+        self.fabrica_sessao = fabrica_sessao
+        self.intervalo = intervalo
+        self.lote = lote
+        self._acordar = threading.Event()
+        self._parar = False
+        self._thread: Optional[threading.Thread] = None
+        self.concluidas = 0
+        self.repetidas = 0
+        self.falhadas = 0
+
+    def iniciar(self):
+        self._parar = False
+        self._thread = threading.Thread(target=self._ciclo, name="tarefas-imagens", daemon=True)
+        self._thread.start()
+
+    def parar(self):
+        self._parar = True
+        self._acordar.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def acordar(self):
+        self._acordar.set()
+
+    def _ciclo(self):
+        while not self._parar:
+            try:
+                while self.processar() and not self._parar:
+                    pass
+            except Exception as e:
+                print(f"Erro ao processar tarefas de imagens: {e}")
+            self._acordar.wait(self.intervalo)
+            self._acordar.clear()
+
+    def _reservar(self) -> list:
+        agora = _agora()
+        with self.fabrica_sessao() as db:
+            # Tarefas presas num processo que terminou a meio
+            db.execute(text("""
+                UPDATE tarefas_imagens SET estado = 'pendente'
+                WHERE estado = 'em_curso' AND reservada_em < :limite
+            """), {"limite": agora - timedelta(minutes=RESERVA_MINUTOS)})
+            # Envios cancelados (e o ficheiro local das tarefas antigas)
+            for row in db.execute(text("SELECT id, ficheiro FROM tarefas_imagens WHERE estado = 'cancelada'")).fetchall():
+                _apagar_ficheiro(row.ficheiro)
+                db.execute(text("DELETE FROM tarefas_imagens WHERE id = :id"), {"id": row.id})
+            candidatas = db.execute(text("""
+                SELECT id, tipo, id_variacao, ficheiro, nome_original, url, tentativas FROM tarefas_imagens
+                WHERE estado = 'pendente' AND proxima_tentativa <= :agora
+                ORDER BY proxima_tentativa
+                LIMIT :lote
+            """), {"agora": agora, "lote": self.lote}).fetchall()
+            reservadas = []
+            for tarefa in candidatas:
+                # Outro worker pode ter reservado a mesma tarefa entretanto
+                resultado = db.execute(text("""
+                    UPDATE tarefas_imagens SET estado = 'em_curso', reservada_em = :agora
+                    WHERE id = :id AND estado = 'pendente'
+                """), {"id": tarefa.id, "agora": agora})
+                if resultado.rowcount == 1:
+                    reservadas.append(tarefa)
+            db.commit()
+        return reservadas
+
+    def processar(self) -> bool:
+        """Executa um lote de tarefas vencidas. Devolve True se havia tarefas."""
+        tarefas = self._reservar()
+        if not tarefas:
+            return False
+        executor = armazenamento_imagens._obter_executor()
+        futuros = [executor.submit(self._executar, tarefa) for tarefa in tarefas]
+        for futuro in futuros:
+            futuro.result()
+        return True
+
+    def _executar(self, tarefa):
+        try:
+            if tarefa.tipo == "enviar":
+                conteudo = self._conteudo(tarefa)
+                if conteudo is None:
+                    self._registar_falha(tarefa, FotoEmFalta("A foto a enviar não está disponível (tarefa sem conteúdo nem ficheiro local)."), definitiva=True)
+                    return
+                url = armazenamento_imagens.armazenamento.enviar(io.BytesIO(conteudo), tarefa.nome_original)
+                self._concluir_envio(tarefa, url)
+            else:
+                with self.fabrica_sessao() as db:
+                    # A mesma foto (mesmo hash) pode ter sido reutilizada noutra variação
+                    if not armazenamento_imagens.imagem_em_uso(db, tarefa.url):
+                        armazenamento_imagens.armazenamento.apagar(tarefa.url)
+                    db.execute(text("DELETE FROM tarefas_imagens WHERE id = :id"), {"id": tarefa.id})
+                    db.commit()
+            self.concluidas += 1
+        except Exception as e:
+            self._registar_falha(tarefa, e)
+
+    def _conteudo(self, tarefa) -> Optional[bytes]:
+        """Bytes da foto: da tarefa ou, nas tarefas antigas, do ficheiro local (se ainda existir)."""
+        with self.fabrica_sessao() as db:
+            conteudo = db.execute(text("SELECT conteudo FROM tarefas_imagens WHERE id = :id"), {"id": tarefa.id}).scalar()
+        if conteudo is not None:
+            return bytes(conteudo)
+        if tarefa.ficheiro and os.path.exists(tarefa.ficheiro):
+            with open(tarefa.ficheiro, "rb") as ficheiro:
+                return ficheiro.read()
+        return None
+
+    def _concluir_envio(self, tarefa, url: str):
+        with self.fabrica_sessao() as db:
+            ainda_ativa = db.execute(text("""
+                UPDATE tarefas_imagens SET estado = 'concluida' WHERE id = :id AND estado = 'em_curso'
+            """), {"id": tarefa.id}).rowcount == 1
+            variacao = None
+            if ainda_ativa:
+                variacao = db.execute(text("SELECT id_produto FROM estoque_variacoes WHERE id = :id"), {"id": tarefa.id_variacao}).first()
+            if variacao is None:
+                # Envio cancelado ou variação removida entretanto: a imagem enviada já não é usada
+                agendar_remocao(db, url)
+            else:
+                db.execute(text("UPDATE estoque_variacoes SET url_foto = :url WHERE id = :id"), {"url": url, "id": tarefa.id_variacao})
+                agendar_remocao(db, tarefa.url)
+            db.execute(text("DELETE FROM tarefas_imagens WHERE id = :id"), {"id": tarefa.id})
+            db.commit()
+            _apagar_ficheiro(tarefa.ficheiro)
+            if variacao is not None:
+                eventos_catalogo.variacao_alterada(db, tarefa.id_variacao, variacao.id_produto)
+            else:
+                self.acordar()
+
+    def _registar_falha(self, tarefa, erro: Exception, definitiva: bool = False):
+        tentativas = tarefa.tentativas + 1
+        falhada = definitiva or tentativas >= MAX_TENTATIVAS
+        with self.fabrica_sessao() as db:
+            db.execute(text("""
+                UPDATE tarefas_imagens
+                SET estado = :estado, tentativas = :tentativas, proxima_tentativa = :proxima, erro = :erro
+                WHERE id = :id AND estado = 'em_curso'
+            """), {"id": tarefa.id, "estado": "falhada" if falhada else "pendente", "tentativas": tentativas,
+                   "proxima": _agora() + _backoff(tentativas), "erro": str(erro)[:1000]})
+            db.commit()
+        if falhada:
+            self.falhadas += 1
+            print(f"Tarefa de imagem {tarefa.id} ({tarefa.tipo}) falhou {tentativas} vezes: {erro}")
+        else:
+            self.repetidas += 1
+
+processador: Optional[ProcessadorTarefas] = None
+
+def iniciar():
+    global processador
+    from database import SessionLocal
+    processador = ProcessadorTarefas(SessionLocal, INTERVALO_SEGUNDOS, armazenamento_imagens.UPLOAD_WORKERS * 2)
+    processador.iniciar()
+
+def encerrar():
+    global processador
+    if processador is not None:
+        processador.parar()
+        processador = None
+
+def acordar():
+    """Chamado depois do commit de um pedido que agendou tarefas."""
+    if processador is not None:
+        processador.acordar()
+
+def estatisticas(db: Session) -> dict:
+    contagens = {row.estado: row.total for row in db.execute(text(
+        "SELECT estado, COUNT(*) AS total FROM tarefas_imagens GROUP BY estado")).fetchall()}
+    resultado = {"ativo": ATIVO, "por_estado": contagens}
+    if processador is not None:
+        resultado.update({"concluidas": processador.concluidas, "repetidas": processador.repetidas, "falhadas": processador.falhadas})
+    return resultado
+
+def repetir_falhadas(db: Session) -> int:
+    """Volta a pôr na fila as tarefas que esgotaram as tentativas."""
+    resultado = db.execute(text("""
+        UPDATE tarefas_imagens SET estado = 'pendente', tentativas = 0, proxima_tentativa = :agora
+        WHERE estado = 'falhada'
+    """), {"agora": _agora()})
+    db.commit()
+    acordar()
+    return resultado.rowcount
@@ -0,0 +1,122 @@
+# vendas_diarias.py
+
+from datetime import date
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+# Resumo das vendas por dia e variação (vendas_diarias), para o dashboard não agregar
+# historico_estoque a cada visita. Cada venda soma a sua parte na mesma transação que
+# altera o estoque (acumular, chamada por servico_estoque), por isso o resumo nunca fica
+# à frente nem atrás do estoque. `vendas` conta linhas de venda (como o COUNT(h.id) de
+# antes); `unidades`, `faturacao` e `custo` somam quantidade, receita e custo.
+# reconstruir() volta a calcular um intervalo de dias a partir do histórico
+# (scripts/reconstruir_vendas_diarias.py), para o preenchimento inicial ou correções.
+
+def acumular(db: Session, linhas_historico: List[dict]):
+    """
+    Soma ao resumo as linhas de venda (tipo 'decremento') no formato de
+    servico_estoque._linha_historico. Uma instrução para todas as linhas; as chaves são
+    escritas por ordem (dia, variação), como os bloqueios em vender_carrinho.
+    """
+    totais: Dict[Tuple[date, int], List] = {}
+    for h in linhas_historico:
+        if h["tipo_movimento"] != 'decremento':
+            continue
+        dia = h["data_hora"].date()
+        quantidade = h["quantidade_alterada"]
+        total = totais.setdefault((dia, h["id_variacao_estoque"]), [0, 0, Decimal('0'), Decimal('0')])
+        total[0] += 1
+        total[1] += quantidade
+        total[2] += Decimal(h["preco_venda_momento"] or 0) * quantidade
+        total[3] += Decimal(h["preco_custo_momento"] or 0) * quantidade
+    if not totais:
+        return
+
+    linhas, params = [], {}
+    for i, ((dia, variacao_id), (vendas, unidades, faturacao, custo)) in enumerate(sorted(totais.items())):
+        linhas.append(f"(:dia{i}, :id{i}, :vendas{i}, :unidades{i}, :faturacao{i}, :custo{i})")
+        params.update({f"dia{i}": dia, f"id{i}": variacao_id, f"vendas{i}": vendas,
+                       f"unidades{i}": unidades, f"faturacao{i}": faturacao, f"custo{i}": custo})
+    if db.get_bind().dialect.name == 'postgresql':
+        conflito = """ON CONFLICT (dia, id_variacao_estoque) DO UPDATE SET
+            vendas = vendas_diarias.vendas + EXCLUDED.vendas,
+            unidades = vendas_diarias.unidades + EXCLUDED.unidades,
+            faturacao = vendas_diarias.faturacao + EXCLUDED.faturacao,
+            custo = vendas_diarias.custo + EXCLUDED.custo"""
+    else:
+        conflito = """ON DUPLICATE KEY UPDATE
+            vendas = vendas + VALUES(vendas), unidades = unidades + VALUES(unidades),
+            faturacao = faturacao + VALUES(faturacao), custo = custo + VALUES(custo)"""
+    db.execute(text(f"""
+        INSERT INTO vendas_diarias (dia, id_variacao_estoque, vendas, unidades, faturacao, custo)
+        VALUES {", ".join(linhas)}
+        {conflito}
+    """), params)
+
+def reconstruir(db: Session, desde: Optional[date] = None, ate: Optional[date] = None) -> int:
+    """
+    Recalcula o resumo dos dias [desde, ate] (todos, se omitidos) a partir de
+    historico_estoque. Não faz commit. No PostgreSQL a tabela fica bloqueada para escrita
+    até ao commit: vendas em curso esperam e somam depois, sem serem contadas duas vezes.
+    Com HISTORICO_DIFERIDO=true, as linhas ainda no spool não estão no histórico: correr
+    com o spool vazio (GET /sistema/historico). Devolve o número de linhas do resumo.
+    """
+    postgres = db.get_bind().dialect.name == 'postgresql'
+    if postgres:
+        db.execute(text("LOCK TABLE vendas_diarias IN EXCLUSIVE MODE"))
+    filtro_resumo, filtro_historico, params = [], [], {}
+    if desde is not None:
+        filtro_resumo.append("dia >= :desde")
+        filtro_historico.append("data_hora >= :desde")
+        params["desde"] = desde
+    if ate is not None:
+        filtro_resumo.append("dia <= :ate")
+        # data_hora < dia seguinte, para usar o índice de data_hora
+        filtro_historico.append(f"data_hora < {'CAST(:ate AS DATE) + 1' if postgres else 'DATE_ADD(:ate, INTERVAL 1 DAY)'}")
+        params["ate"] = ate
+    db.execute(text(f"DELETE FROM vendas_diarias {'WHERE ' + ' AND '.join(filtro_resumo) if filtro_resumo else ''}"), params)
+    return db.execute(text(f"""
+        INSERT INTO vendas_diarias (dia, id_variacao_estoque, vendas, unidades, faturacao, custo)
+        SELECT CAST(data_hora AS DATE), id_variacao_estoque, COUNT(*), SUM(quantidade_alterada),
+               SUM(COALESCE(preco_venda_momento, 0) * quantidade_alterada),
+               SUM(COALESCE(preco_custo_momento, 0) * quantidade_alterada)
+        FROM historico_estoque
+        WHERE tipo_movimento = 'decremento' {''.join(' AND ' + f for f in filtro_historico)}
+        GROUP BY CAST(data_hora AS DATE), id_variacao_estoque
+    """), params).rowcount
+
+# Critérios de ordenação do top de variações (coluna agregada do resumo)
+CRITERIOS_TOP = {
+    "vendas": "SUM(vendas)",
+    "unidades": "SUM(unidades)",
+    "faturacao": "SUM(faturacao)",
+    "margem": "SUM(faturacao - custo)",
+}
+
+def query_mais_vendidas(criterio: str = "vendas", desde: bool = True):
+    """
+    Top N variações (:limite) no período [:inicio, :fim] (ou em todo o resumo, com
+    desde=False). Agrega por id no resumo (intervalo de `dia`, a chave primária) e só
+    junta nomes às N linhas finais: o custo depende de dias x variações vendidas, não
+    do número de vendas.
+    """
+    ordem = CRITERIOS_TOP[criterio]
+    return text(f"""
+        SELECT t.id_variacao_estoque, p.nome AS produto_nome, ev.cor,
+               t.vendas, t.unidades, t.faturacao, t.margem
+        FROM (
+            SELECT id_variacao_estoque, SUM(vendas) AS vendas, SUM(unidades) AS unidades,
+                   SUM(faturacao) AS faturacao, SUM(faturacao - custo) AS margem, {ordem} AS criterio
+            FROM vendas_diarias
+            {"WHERE dia BETWEEN :inicio AND :fim" if desde else ""}
+            GROUP BY id_variacao_estoque
+            ORDER BY criterio DESC, id_variacao_estoque
+            LIMIT :limite
+        ) t
+        JOIN estoque_variacoes ev ON ev.id = t.id_variacao_estoque
+        JOIN produtos p ON p.id = ev.id_produto
+        ORDER BY t.criterio DESC, t.id_variacao_estoque
+    """)